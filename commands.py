@@ -1,8 +1,26 @@
 import sys
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from core.vector_orch_library import initialize_vector_library as initialize_orchestrator_library
 from core.agents.agent_one.vector_library import initialize_vector_library as initialize_agent_one_library
 from core.agents.agent_two.vector_library import initialize_vector_library as initialize_agent_two_library
 from core.log_control import LogManager
+from core.query_classifier import TASKS as CLASSIFIER_TASKS, train_task
+from db.backends import BACKENDS as CONVERSATION_BACKENDS, migrate_conversations as migrate_conversation_store
+from db.backends import get_backend as get_conversation_backend, CONVERSATION_BACKEND
+from db.sharding import reshard_conversations as reshard_conversation_store
+from db.archive import archive_conversations as archive_conversation_store, get_archive as get_conversation_archive
+
+# Bibliotecas disponibles: nombre -> (descripción, función de inicialización)
+LIBRARIES = {
+    "orchestrator": ("del orquestador", initialize_orchestrator_library),
+    "agent_one": ("del Agente 1", initialize_agent_one_library),
+    "agent_two": ("del Agente 2", initialize_agent_two_library),
+}
+
+# Número máximo de procesos para construir bibliotecas en paralelo
+DEFAULT_WORKERS = int(os.getenv("VECTOR_BUILD_WORKERS", len(LIBRARIES)))
 
 
 def print_help():
@@ -11,18 +29,59 @@ def print_help():
     """
     help_text = """
 === COMANDOS DISPONIBLES ===
-1. initialize_vectors [orchestrator|agent_one|agent_two|all]
+1. initialize_vectors [orchestrator|agent_one|agent_two|all] [...]
     - Descripción: Inicializa las bibliotecas de vectores.
       - 'orchestrator': Inicializa la biblioteca del orquestador.
       - 'agent_one': Inicializa la biblioteca del Agente 1.
       - 'agent_two': Inicializa la biblioteca del Agente 2.
-      - 'all': Inicializa todas las bibliotecas.
+      - 'all': Inicializa todas las bibliotecas en paralelo.
+      - Varias bibliotecas a la vez se construyen en paralelo, cada una en su propio proceso.
+      - '--incremental': Solo embebe archivos nuevos o modificados y elimina los borrados.
+      - '--workers N': Número máximo de procesos en paralelo (por defecto VECTOR_BUILD_WORKERS o 3).
     - Uso: python commands.py initialize_vectors orchestrator
+    - Uso: python commands.py initialize_vectors agent_one agent_two --workers 2
+    - Uso: python commands.py initialize_vectors all --incremental
     
 2. logs
     - Descripción: Abre el visor de logs.
     - Uso: python commands.py logss
 
+3. train_classifier [orchestrator|router|all]
+    - Descripción: Entrena el clasificador local de consultas con las decisiones registradas del LLM.
+      - 'orchestrator': Consulta general o técnica.
+      - 'router': Categoría del router (embeddings, generation, pdf, agent_one, agent_two).
+      - 'all': Entrena ambos modelos (por defecto).
+    - Uso: python commands.py train_classifier all
+
+4. migrate_conversations [origen] [destino]
+    - Descripción: Copia todas las conversaciones de un motor de almacenamiento a otro.
+      - Motores: 'tinydb' (db/conversations.json), 'sqlite' (db/conversations.sqlite3)
+        y 'jsonl' (un registro de solo anexado por conversación en db/conversation_log/).
+      - Por defecto migra de 'tinydb' a 'sqlite'. Las conversaciones existentes en el destino se reemplazan.
+      - Después, selecciona el motor con la variable CONVERSATION_BACKEND.
+    - Uso: python commands.py migrate_conversations tinydb sqlite
+
+5. compact_conversations
+    - Descripción: Compacta los registros del motor 'jsonl' (una instantánea por conversación).
+      - Los segmentos también se compactan solos al acumular CONVERSATION_LOG_COMPACT_THRESHOLD actualizaciones.
+    - Uso: python commands.py compact_conversations
+
+6. reshard_conversations N [motor]
+    - Descripción: Redistribuye las conversaciones en N shards (db/shards/) según el hash de conversation_id.
+      - Por defecto usa el motor de CONVERSATION_BACKEND. Con N=1 vuelve al almacenamiento sin shards.
+      - Detén el servidor antes de ejecutarlo y después define CONVERSATION_SHARDS=N.
+      - La distribución anterior se conserva como db/shards.old-<fecha>.
+    - Uso: python commands.py reshard_conversations 8
+
+7. archive_conversations [--inactive-days N] [--max-age-days N] [--undated] [--force]
+    - Descripción: Mueve las conversaciones frías a un archivo comprimido (db/archive/, gzip + índice).
+      - '--inactive-days N': Sin mensajes en los últimos N días (por defecto CONVERSATION_RETENTION_DAYS o 30).
+      - '--max-age-days N': Primer mensaje hace más de N días.
+      - '--undated': Incluye las conversaciones sin fechas (guardadas antes de registrar la fecha de los mensajes).
+      - Las conversaciones archivadas se recuperan solas al volver a consultarse.
+      - Con CONVERSATION_WRITE_BEHIND=true se rechaza: detén el servidor y usa '--force'.
+    - Uso: python commands.py archive_conversations --inactive-days 90
+
 === NOTAS ===
 - Asegúrate de que las carpetas correspondientes ('documents/') contengan archivos antes de ejecutar.
 - Este script está diseñado para ejecutar tareas administrativas directamente desde la consola.
@@ -30,54 +89,196 @@ def print_help():
     print(help_text)
 
 
-def initialize_orchestrator():
+def initialize_orchestrator(incremental=False):
     """
     Inicializa la biblioteca de vectores del orquestador.
     """
     print("Inicializando la biblioteca de vectores del orquestador...")
     try:
-        vector_library = initialize_orchestrator_library()
+        vector_library = initialize_orchestrator_library(incremental=incremental)
         print("¡Biblioteca del orquestador inicializada con éxito!")
         print(f"Documentos cargados: {len(vector_library.storage_context.docstore)}")
     except Exception as e:
         print(f"Error al inicializar la biblioteca del orquestador: {str(e)}")
 
 
-def initialize_agent_one():
+def initialize_agent_one(incremental=False):
     """
     Inicializa la biblioteca de vectores del Agente 1.
     """
     print("Inicializando la biblioteca de vectores del Agente 1...")
     try:
-        vector_library = initialize_agent_one_library()
+        vector_library = initialize_agent_one_library(incremental=incremental)
         print("¡Biblioteca del Agente 1 inicializada con éxito!")
         print(f"Documentos cargados: {len(vector_library.storage_context.docstore)}")
     except Exception as e:
         print(f"Error al inicializar la biblioteca del Agente 1: {str(e)}")
 
 
-def initialize_agent_two():
+def initialize_agent_two(incremental=False):
     """
     Inicializa la biblioteca de vectores del Agente 2.
     """
     print("Inicializando la biblioteca de vectores del Agente 2...")
     try:
-        vector_library = initialize_agent_two_library()
+        vector_library = initialize_agent_two_library(incremental=incremental)
         print("¡Biblioteca del Agente 2 inicializada con éxito!")
         print(f"Documentos cargados: {len(vector_library.storage_context.docstore)}")
     except Exception as e:
         print(f"Error al inicializar la biblioteca del Agente 2: {str(e)}")
 
 
-def initialize_all():
+def _build_library(target, incremental=False):
     """
-    Inicializa todas las bibliotecas de vectores.
+    Construye una biblioteca dentro de un proceso trabajador.
+    Devuelve solo datos serializables: el índice no puede cruzar procesos.
     """
-    print("Inicializando todas las bibliotecas de vectores...")
-    initialize_orchestrator()
-    initialize_agent_one()
-    initialize_agent_two()
+    start = time.perf_counter()
+    try:
+        vector_library = LIBRARIES[target][1](incremental=incremental)
+        return {
+            "target": target,
+            "documents": len(vector_library.storage_context.docstore.docs),
+            "elapsed": time.perf_counter() - start,
+            "error": None,
+        }
+    except Exception as e:
+        return {
+            "target": target,
+            "documents": 0,
+            "elapsed": time.perf_counter() - start,
+            "error": str(e),
+        }
+
+
+def initialize_parallel(targets, incremental=False, workers=DEFAULT_WORKERS):
+    """
+    Inicializa varias bibliotecas de vectores en procesos separados.
+
+    Returns:
+        int: Código de salida combinado (0 si todas terminaron con éxito, 1 si alguna falló).
+    """
+    workers = max(1, min(workers, len(targets)))
+    print(f"Inicializando {len(targets)} bibliotecas con {workers} procesos: {', '.join(targets)}")
+    start = time.perf_counter()
+    failed = []
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(_build_library, target, incremental): target for target in targets}
+        for future in as_completed(futures):
+            target = futures[future]
+            description = LIBRARIES[target][0]
+            try:
+                result = future.result()
+            except Exception as e:
+                # El proceso trabajador murió antes de devolver un resultado
+                result = {"target": target, "documents": 0, "elapsed": 0.0, "error": str(e)}
+
+            if result["error"]:
+                failed.append(target)
+                print(f"[{target}] Error al inicializar la biblioteca {description} "
+                      f"({result['elapsed']:.1f}s): {result['error']}")
+            else:
+                print(f"[{target}] Biblioteca {description} inicializada en {result['elapsed']:.1f}s. "
+                      f"Documentos cargados: {result['documents']}")
+
+    print(f"Tiempo total: {time.perf_counter() - start:.1f}s")
+    if failed:
+        print(f"Bibliotecas con errores: {', '.join(failed)}")
+        return 1
     print("¡Todas las bibliotecas inicializadas con éxito!")
+    return 0
+
+
+def initialize_all(incremental=False, workers=DEFAULT_WORKERS):
+    """
+    Inicializa todas las bibliotecas de vectores en paralelo.
+    """
+    print("Inicializando todas las bibliotecas de vectores...")
+    return initialize_parallel(list(LIBRARIES), incremental=incremental, workers=workers)
+
+
+def train_classifier(target="all"):
+    """
+    Entrena los clasificadores locales a partir de los ejemplos registrados.
+    """
+    tasks = CLASSIFIER_TASKS if target == "all" else [target]
+    status = 0
+    for task in tasks:
+        print(f"Entrenando clasificador local '{task}'...")
+        try:
+            summary = train_task(task)
+            print(f"Ejemplos: {summary['examples']} | Clases: {', '.join(summary['classes'])} | "
+                  f"Exactitud (entrenamiento): {summary['accuracy']:.1%}")
+        except Exception as e:
+            print(f"Error al entrenar el clasificador '{task}': {str(e)}")
+            status = 1
+    return status
+
+
+def migrate_conversations(source="tinydb", target="sqlite"):
+    """
+    Migra las conversaciones entre motores de almacenamiento.
+    """
+    print(f"Migrando conversaciones de '{source}' a '{target}'...")
+    start = time.perf_counter()
+    try:
+        migrated = migrate_conversation_store(source, target)
+    except Exception as e:
+        print(f"Error al migrar las conversaciones: {str(e)}")
+        return 1
+    print(f"Conversaciones migradas: {migrated} ({time.perf_counter() - start:.1f}s)")
+    return 0
+
+
+def compact_conversations():
+    """
+    Compacta todos los segmentos del almacenamiento de conversaciones 'jsonl'.
+    """
+    print("Compactando registros de conversaciones...")
+    start = time.perf_counter()
+    try:
+        compacted = get_conversation_backend("jsonl").compact_all()
+    except Exception as e:
+        print(f"Error al compactar las conversaciones: {str(e)}")
+        return 1
+    print(f"Conversaciones compactadas: {compacted} ({time.perf_counter() - start:.1f}s)")
+    return 0
+
+
+def reshard_conversations(shards, base=CONVERSATION_BACKEND):
+    """
+    Redistribuye las conversaciones entre shards (sin conexión).
+    """
+    print(f"Redistribuyendo conversaciones del motor '{base}' en {shards} shards...")
+    start = time.perf_counter()
+    try:
+        copied = reshard_conversation_store(shards, base)
+    except Exception as e:
+        print(f"Error al redistribuir las conversaciones: {str(e)}")
+        return 1
+    print(f"Conversaciones copiadas: {copied} ({time.perf_counter() - start:.1f}s)")
+    print(f"Define CONVERSATION_SHARDS={shards} antes de iniciar el servidor.")
+    return 0
+
+
+def archive_conversations(inactive_days=None, max_age_days=None, include_undated=False, force=False):
+    """
+    Aplica la política de retención y archiva las conversaciones frías.
+    """
+    print("Archivando conversaciones inactivas...")
+    start = time.perf_counter()
+    try:
+        result = archive_conversation_store(inactive_days, max_age_days, include_undated, force=force)
+        stats = get_conversation_archive().stats()
+    except Exception as e:
+        print(f"Error al archivar las conversaciones: {str(e)}")
+        return 1
+    print(f"Conversaciones archivadas: {result['archived']} | Conservadas: {result['kept']} "
+          f"({time.perf_counter() - start:.1f}s)")
+    print(f"Archivo: {stats['conversations']} conversaciones en {stats['segments']} segmentos "
+          f"({stats['bytes'] / 1024:.1f} KB)")
+    return 0
 
 
 def view_logs():
@@ -98,23 +299,99 @@ if __name__ == "__main__":
     command = sys.argv[1].strip().lower()
 
     if command == "initialize_vectors":
+        # Modo incremental opcional: solo embebe archivos nuevos o modificados
+        args = [arg.strip().lower() for arg in sys.argv[2:]]
+        incremental = "--incremental" in args
+        args = [arg for arg in args if arg != "--incremental"]
+
+        # Número de procesos opcional para la construcción en paralelo
+        workers = DEFAULT_WORKERS
+        if "--workers" in args:
+            position = args.index("--workers")
+            try:
+                workers = int(args[position + 1])
+            except (IndexError, ValueError):
+                print("Error: '--workers' requiere un número entero.")
+                print_help()
+                sys.exit(1)
+            del args[position:position + 2]
+
         # Verificar el argumento opcional para seleccionar la biblioteca
-        if len(sys.argv) == 3:
-            target = sys.argv[2].strip().lower()
+        unknown = [target for target in args if target not in LIBRARIES and target != "all"]
+        if not args:
+            print("Error: Se requiere un argumento para 'initialize_vectors'.")
+            print_help()
+            sys.exit(1)
+        elif unknown:
+            print(f"Error: Argumento desconocido '{unknown[0]}'.")
+            print_help()
+            sys.exit(1)
+        elif "all" in args:
+            sys.exit(initialize_all(incremental, workers))
+        elif len(args) == 1:
+            target = args[0]
             if target == "orchestrator":
-                initialize_orchestrator()
+                initialize_orchestrator(incremental)
             elif target == "agent_one":
-                initialize_agent_one()
+                initialize_agent_one(incremental)
             elif target == "agent_two":
-                initialize_agent_two()
-            elif target == "all":
-                initialize_all()
-            else:
-                print(f"Error: Argumento desconocido '{target}'.")
-                print_help()
+                initialize_agent_two(incremental)
         else:
-            print("Error: Se requiere un argumento para 'initialize_vectors'.")
+            # Eliminar duplicados conservando el orden
+            targets = list(dict.fromkeys(args))
+            sys.exit(initialize_parallel(targets, incremental, workers))
+    elif command == "train_classifier":
+        target = sys.argv[2].strip().lower() if len(sys.argv) > 2 else "all"
+        if target != "all" and target not in CLASSIFIER_TASKS:
+            print(f"Error: Argumento desconocido '{target}'.")
+            print_help()
+            sys.exit(1)
+        sys.exit(train_classifier(target))
+    elif command == "migrate_conversations":
+        args = [arg.strip().lower() for arg in sys.argv[2:4]]
+        source = args[0] if len(args) > 0 else "tinydb"
+        target = args[1] if len(args) > 1 else "sqlite"
+        unknown = [name for name in (source, target) if name not in CONVERSATION_BACKENDS]
+        if unknown:
+            print(f"Error: Motor desconocido '{unknown[0]}'.")
             print_help()
+            sys.exit(1)
+        sys.exit(migrate_conversations(source, target))
+    elif command == "compact_conversations":
+        sys.exit(compact_conversations())
+    elif command == "reshard_conversations":
+        args = [arg.strip().lower() for arg in sys.argv[2:4]]
+        try:
+            shards = int(args[0])
+        except (IndexError, ValueError):
+            print("Error: 'reshard_conversations' requiere un número entero de shards.")
+            print_help()
+            sys.exit(1)
+        base = args[1] if len(args) > 1 else CONVERSATION_BACKEND
+        if base not in CONVERSATION_BACKENDS:
+            print(f"Error: Motor desconocido '{base}'.")
+            print_help()
+            sys.exit(1)
+        sys.exit(reshard_conversations(shards, base))
+    elif command == "archive_conversations":
+        args = [arg.strip().lower() for arg in sys.argv[2:]]
+        include_undated = "--undated" in args
+        force = "--force" in args
+        args = [arg for arg in args if arg not in ("--undated", "--force")]
+        options = {"--inactive-days": None, "--max-age-days": None}
+        while args:
+            option = args.pop(0)
+            if option not in options or not args:
+                print(f"Error: Argumento desconocido o incompleto '{option}'.")
+                print_help()
+                sys.exit(1)
+            try:
+                options[option] = float(args.pop(0))
+            except ValueError:
+                print(f"Error: '{option}' requiere un número de días.")
+                print_help()
+                sys.exit(1)
+        sys.exit(archive_conversations(options["--inactive-days"], options["--max-age-days"], include_undated, force))
     elif command in ["help", "--help", "-h"]:
         print_help()
     elif command == "logs":
@@ -0,0 +1,190 @@
+from collections import deque
+from contextlib import contextmanager, asynccontextmanager
+import asyncio
+import logging
+import queue
+import threading
+import time
+
+# Configurar logging
+logger = logging.getLogger('agent_pool')
+logger.setLevel(logging.INFO)
+
+# Marca para "crear una instancia nueva" en lugar de prestar una existente
+_CREATE = object()
+
+
+class AgentPool:
+    """
+    Pool de instancias de agentes de larga duración.
+
+    Las instancias se crean bajo demanda hasta `size` y se prestan de forma exclusiva:
+    un agente nunca atiende dos consultas a la vez, así que su estado interno es seguro
+    entre hilos. Si todas están ocupadas, la solicitud espera a que se libere una.
+    """
+
+    def __init__(self, name: str, factory, size: int = 4):
+        self.name = name
+        self.factory = factory
+        self.size = max(1, size)
+        self._idle = []
+        self._lock = threading.Lock()
+        self._released = threading.Condition(self._lock)
+        # Solicitudes asíncronas en espera: (event loop, future); no ocupan hilos del executor
+        self._waiters = deque()
+        self._created = 0
+        self._in_use = 0
+        self._borrows = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+
+    def _take(self):
+        """
+        Instancia libre, _CREATE si todavía se puede crear una o None si hay que esperar (con el lock tomado).
+        """
+        if self._idle:
+            return self._idle.pop()
+        if self._created < self.size:
+            self._created += 1
+            return _CREATE
+        return None
+
+    def _create(self):
+        try:
+            logger.info(f"Creando instancia {self._created}/{self.size} del pool {self.name}")
+            return self.factory()
+        except Exception:
+            with self._lock:
+                self._created -= 1
+                self._released.notify()
+            self._dispatch_slot()
+            raise
+
+    def _borrowed(self, start: float):
+        wait = time.perf_counter() - start
+        with self._lock:
+            self._in_use += 1
+            self._borrows += 1
+            self._total_wait += wait
+            self._max_wait = max(self._max_wait, wait)
+
+    def _acquire(self, timeout: float = None):
+        start = time.perf_counter()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._released:
+            agent = self._take()
+            while agent is None:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise queue.Empty
+                self._released.wait(remaining)
+                agent = self._take()
+        if agent is _CREATE:
+            agent = self._create()
+        self._borrowed(start)
+        return agent
+
+    async def _aacquire(self, timeout: float = None):
+        start = time.perf_counter()
+        with self._lock:
+            agent = self._take()
+            if agent is None:
+                future = asyncio.get_running_loop().create_future()
+                waiter = (asyncio.get_running_loop(), future)
+                self._waiters.append(waiter)
+        if agent is None:
+            try:
+                agent = await asyncio.wait_for(future, timeout)
+            except BaseException:
+                with self._lock:
+                    if waiter in self._waiters:
+                        self._waiters.remove(waiter)
+                if future.done() and not future.cancelled():
+                    # Se canceló la solicitud justo después de recibir la instancia
+                    self._hand_over(future.result())
+                raise
+        if agent is _CREATE:
+            # La creación es síncrona y está acotada por `size`: no depende de otras solicitudes
+            agent = await asyncio.to_thread(self._create)
+        self._borrowed(start)
+        return agent
+
+    def _deliver(self, future, agent):
+        # Se ejecuta en el event loop del solicitante
+        if future.done():
+            # Cancelada o vencida mientras se entregaba: la instancia vuelve al pool
+            self._hand_over(agent)
+        else:
+            future.set_result(agent)
+
+    def _hand_over(self, agent):
+        """
+        Entrega la instancia (o el permiso para crear una, _CREATE) a la primera solicitud
+        asíncrona en espera; si no hay ninguna, la deja libre para las síncronas.
+        """
+        while True:
+            with self._lock:
+                if not self._waiters:
+                    if agent is _CREATE:
+                        self._created -= 1
+                    else:
+                        self._idle.append(agent)
+                    self._released.notify()
+                    return
+                loop, future = self._waiters.popleft()
+            try:
+                loop.call_soon_threadsafe(self._deliver, future, agent)
+                return
+            except RuntimeError:
+                # El event loop de la solicitud ya se cerró
+                continue
+
+    def _dispatch_slot(self):
+        # Una creación fallida libera un hueco: lo aprovecha la siguiente solicitud asíncrona
+        with self._lock:
+            if not self._waiters or self._created >= self.size:
+                return
+            self._created += 1
+        self._hand_over(_CREATE)
+
+    def _release(self, agent):
+        with self._lock:
+            self._in_use -= 1
+        self._hand_over(agent)
+
+    @contextmanager
+    def borrow(self, timeout: float = None):
+        """
+        Presta una instancia del pool durante el bloque `with` y la devuelve al terminar.
+        """
+        agent = self._acquire(timeout=timeout)
+        try:
+            yield agent
+        finally:
+            self._release(agent)
+
+    @asynccontextmanager
+    async def aborrow(self, timeout: float = None):
+        """
+        Versión asíncrona de borrow: la espera es un future del event loop, no un hilo bloqueado,
+        así que las solicitudes en cola no agotan el executor que usan los agentes prestados.
+        """
+        agent = await self._aacquire(timeout)
+        try:
+            yield agent
+        finally:
+            self._release(agent)
+
+    def stats(self) -> dict:
+        """
+        Estadísticas del pool, incluido el tiempo de espera para obtener una instancia.
+        """
+        with self._lock:
+            return {
+                "size": self.size,
+                "created": self._created,
+                "in_use": self._in_use,
+                "borrows": self._borrows,
+                "avg_wait_ms": round(self._total_wait / self._borrows * 1000, 3) if self._borrows else 0.0,
+                "max_wait_ms": round(self._max_wait * 1000, 3),
+            }
@@ -2,6 +2,7 @@ from langchain_openai import OpenAI
 from langchain.tools import Tool
 import os
 import dotenv
+from core.pdf_retrieval import PDF_ANALYSIS_MODE
 
 from .generation_tool import handle_generation
 from .vector_library import query_vector_library, list_available_documents
@@ -79,7 +80,8 @@ def pdf_analysis_tool(query: str) -> str:
 
     # Cargar los documentos y procesar la consulta
     try:
-        documents = load_pdfs_from_directory(PDF_DIR)
+        # Los modos por fragmentos consumen las páginas en streaming mientras se analizan los PDFs
+        documents = load_pdfs_from_directory(PDF_DIR, stream=PDF_ANALYSIS_MODE != "full")
         response = analyze_pdf_content(documents, query)
         return response
     except ValueError as e:
@@ -1,8 +1,11 @@
-from llama_index.core import VectorStoreIndex, SimpleDirectoryReader, StorageContext, load_index_from_storage
+from llama_index.core import VectorStoreIndex, StorageContext, load_index_from_storage
 from llama_index.llms.openai import OpenAI
 import os
 import dotenv
 from pathlib import Path
+from core.index_registry import index_registry
+from core.index_builder import sync_vector_index, save_manifest, manifest_from_documents, load_documents
+from core.embedding_cache import get_cached_embed_model
 
 # Cargar las variables de entorno desde .env
 dotenv.load_dotenv()
@@ -17,33 +20,42 @@ DATA_DIR = PROJECT_ROOT / "documents" / "doc_a_one"
 PERSIST_DIR = PROJECT_ROOT / "storage" / "sto_a_one"
 
 
-def initialize_vector_library():
+def initialize_vector_library(incremental: bool = False):
     """
     Carga o crea un índice vectorial basado en documentos técnicos.
 
+    Args:
+        incremental (bool): Si es True, sincroniza el índice existente embebiendo solo
+            los archivos nuevos o modificados y eliminando los borrados.
+
     Returns:
         VectorStoreIndex: Índice de vector cargado o creado.
     """
     if not DATA_DIR.exists():
         raise ValueError(f"No se encontró el directorio de documentos: {DATA_DIR}")
 
+    if incremental:
+        return sync_vector_index(DATA_DIR, PERSIST_DIR, embed_model=get_cached_embed_model())
+
     # Verificar si existe el archivo docstore.json en el directorio storage
     docstore_path = PERSIST_DIR / "docstore.json"
     
     if not docstore_path.exists():
         # Crear un nuevo índice desde los documentos
         print("Cargando documentos desde el directorio...")
-        documents = SimpleDirectoryReader(DATA_DIR).load_data()
+        documents = load_documents(DATA_DIR)
         print(f"Se cargaron {len(documents)} documentos.")
 
         print("Creando un nuevo índice de vectores...")
-        index = VectorStoreIndex.from_documents(documents)
+        # Los embeddings ya calculados se reutilizan desde la caché compartida en disco
+        index = VectorStoreIndex.from_documents(documents, embed_model=get_cached_embed_model())
 
         # Crear el directorio storage si no existe
         PERSIST_DIR.mkdir(parents=True, exist_ok=True)
         
         # Guardar el índice para reutilización futura
         index.storage_context.persist(persist_dir=PERSIST_DIR)
+        save_manifest(PERSIST_DIR, manifest_from_documents(DATA_DIR, documents))
         print(f"Índice guardado en {PERSIST_DIR}.")
     else:
         # Cargar el índice existente desde el almacenamiento persistente
@@ -67,15 +79,11 @@ def query_vector_library(query):
     if not PERSIST_DIR.exists():
         return "El índice no existe. Por favor, genera la biblioteca primero."
     
-    # Configurar el modelo LLM
-    llm = OpenAI(api_key=OPENAI_API_KEY, model="gpt-3.5-turbo")
-
-    # Cargar el índice desde el almacenamiento
-    storage_context = StorageContext.from_defaults(persist_dir=PERSIST_DIR)
-    index = load_index_from_storage(storage_context)
-    
-    # Crear el motor de consulta utilizando el modelo LLM
-    query_engine = index.as_query_engine(llm=llm)
+    # Obtener el motor de consulta del registro compartido (solo recarga si cambió PERSIST_DIR)
+    query_engine = index_registry.get_query_engine(
+        PERSIST_DIR,
+        llm_factory=lambda: OpenAI(api_key=OPENAI_API_KEY, model="gpt-3.5-turbo")
+    )
 
     # Realizar la consulta
     print("Consultando la biblioteca de vectores...")
@@ -3,6 +3,7 @@ from langchain.prompts import PromptTemplate
 import os
 import logging
 from .primary_tools import embeddings_tool, generation_tool, pdf_analysis_tool, list_available_documents
+from core.classification_cache import classification_cache
 
 # Configurar logger
 logger = logging.getLogger('agent_two')
@@ -14,6 +15,8 @@ logger.handlers = []
 logger.addHandler(console_handler)
 logger.propagate = True
 
+VALID_TOOLS = {'embeddings_tool', 'generation_tool', 'pdf_analysis_tool', 'llm'}
+
 class SimpleAgent:
     def __init__(self, user_id: str = "default_user"):
         self.llm = ChatOpenAI(temperature=0.7, api_key=os.getenv("OPENAI_API_KEY"))
@@ -42,9 +45,9 @@ class SimpleAgent:
                 Devuelve una de las siguientes opciones, sin explicaciones extra: 'embeddings_tool', 'generation_tool', 'pdf_analysis_tool', 'llm'."""
         )
         
-    def classify_tool(self, query: str) -> str:
+    def _classification_query(self, query: str) -> str:
         """
-        Usa el modelo LLM para clasificar la consulta y determinar qué herramienta utilizar.
+        Construye el prompt de clasificación con la lista de documentos disponibles.
         """
         classification_prompt = PromptTemplate(
             input_variables=["query", "documents"],
@@ -65,28 +68,56 @@ class SimpleAgent:
         )
         
         docs = list_available_documents()
+        return classification_prompt.format(
+            query=query, 
+            documents=docs.get('documents', [])
+        )
+
+    @staticmethod
+    def _validate_tool(query: str, response: str) -> str:
+        # Validar que la respuesta sea una de las opciones válidas
+        if response not in VALID_TOOLS:
+            logger.warning(f"Respuesta inválida del clasificador: {response}")
+            return 'llm'
+        classification_cache.set("agent_two", query, response)
+        return response
+
+    def classify_tool(self, query: str) -> str:
+        """
+        Usa el modelo LLM para clasificar la consulta y determinar qué herramienta utilizar.
+        """
+        cached = classification_cache.get("agent_two", query)
+        if cached is not None:
+            return cached
         try:
-            classification_query = classification_prompt.format(
-                query=query, 
-                documents=docs.get('documents', [])
-            )
+            classification_query = self._classification_query(query)
             response = self.llm.invoke(classification_query).content.strip().lower()
-            
-            # Validar que la respuesta sea una de las opciones válidas
-            valid_tools = {'embeddings_tool', 'generation_tool', 'pdf_analysis_tool', 'llm'}
-            if response not in valid_tools:
-                logger.warning(f"Respuesta inválida del clasificador: {response}")
-                return 'llm'
-                
-            return response
+            return self._validate_tool(query, response)
             
         except Exception as e:
             logger.error(f"Error clasificando la herramienta: {str(e)}")
             return "llm"
 
-    def handle_query(self, query: str) -> str:
+    async def aclassify_tool(self, query: str) -> str:
+        """
+        Versión asíncrona de classify_tool.
+        """
+        cached = classification_cache.get("agent_two", query)
+        if cached is not None:
+            return cached
+        try:
+            classification_query = self._classification_query(query)
+            response = (await self.llm.ainvoke(classification_query)).content.strip().lower()
+            return self._validate_tool(query, response)
+
+        except Exception as e:
+            logger.error(f"Error clasificando la herramienta: {str(e)}")
+            return "llm"
+
+    def handle_query(self, query: str, selected_tool: str = None) -> str:
         """
         Maneja una consulta llamando directamente a las herramientas según el tipo de consulta.
+        Si `selected_tool` ya viene decidido (clasificación combinada) no se vuelve a clasificar.
         """
         logger.info("=== Iniciando procesamiento de consulta ===")
         try:
@@ -96,7 +127,8 @@ class SimpleAgent:
                 raise ValueError("La consulta es demasiado corta. Por favor, proporcione más detalles.")
 
             # Clasificar la consulta para seleccionar la herramienta adecuada
-            selected_tool = self.classify_tool(query)
+            if selected_tool not in VALID_TOOLS:
+                selected_tool = self.classify_tool(query)
             logger.info(f"Herramienta seleccionada: {selected_tool}")
 
             # Validar y ejecutar la herramienta correspondiente
@@ -126,3 +158,46 @@ class SimpleAgent:
             logger.error(f"Error procesando la consulta: {str(e)}")
             return f"Error procesando la consulta: {str(e)}"
 
+    async def ahandle_query(self, query: str, selected_tool: str = None) -> str:
+        """
+        Versión asíncrona de handle_query: las llamadas al LLM no bloquean el event loop
+        y las herramientas síncronas se ejecutan en el pool de hilos.
+        """
+        logger.info("=== Iniciando procesamiento de consulta (async) ===")
+        try:
+            # Validación básica de la consulta
+            query = query.strip()
+            if len(query) < 3:
+                raise ValueError("La consulta es demasiado corta. Por favor, proporcione más detalles.")
+
+            # Clasificar la consulta para seleccionar la herramienta adecuada
+            if selected_tool not in VALID_TOOLS:
+                selected_tool = await self.aclassify_tool(query)
+            logger.info(f"Herramienta seleccionada: {selected_tool}")
+
+            # Validar y ejecutar la herramienta correspondiente
+            if selected_tool == "embeddings_tool":
+                logger.info("Usando biblioteca de vectores")
+                response = await embeddings_tool.arun(query)
+
+            elif selected_tool == "generation_tool":
+                logger.info("Usando generación de texto")
+                response = await generation_tool.arun(query)
+
+            elif selected_tool == "pdf_analysis_tool":
+                logger.info("Usando análisis de PDFs")
+                pdf_directory = "path_to_pdf_directory"
+                if not os.path.exists(pdf_directory) or not os.listdir(pdf_directory):
+                    return "No hay documentos PDF disponibles para analizar."
+                response = await pdf_analysis_tool.arun(query)
+
+            else:
+                logger.info("Usando LLM directamente")
+                formatted_prompt = self.base_prompt.format(query=query)
+                response = (await self.llm.ainvoke(formatted_prompt)).content.strip()
+
+            return response
+
+        except Exception as e:
+            logger.error(f"Error procesando la consulta: {str(e)}")
+            return f"Error procesando la consulta: {str(e)}"
@@ -1,4 +1,7 @@
-from llama_index.core.readers import SimpleDirectoryReader
+from core.pdf_cache import get_pdf_text_cache
+from core.pdf_retrieval import PDF_ANALYSIS_MODE, select_relevant_chunks, format_chunks
+from core.pdf_map_reduce import map_reduce_analysis
+from itertools import chain
 from pathlib import Path
 import os
 
@@ -11,43 +14,68 @@ PDF_DIR = CURRENT_DIR / "unic_pdf"
 
 
 # FUNCIONES PRINCIPALES
-def load_pdfs_from_directory(pdf_directory: Path):
+def load_pdfs_from_directory(pdf_directory: Path, stream: bool = False):
     """
     Lee todos los archivos PDF en un directorio y los convierte en documentos procesables.
 
     Args:
         pdf_directory (Path): Ruta del directorio donde están los PDFs.
+        stream (bool): Si es True devuelve un generador que entrega las páginas a medida
+            que se analizan, sin esperar a que termine el último archivo.
 
     Returns:
-        List[Document]: Lista de documentos cargados desde los PDFs.
+        List[Document]: Lista de documentos cargados desde los PDFs (o generador si stream=True).
     """
     if not pdf_directory.exists() or not pdf_directory.is_dir():
         raise ValueError(f"El directorio {pdf_directory} no existe o no es válido.")
 
-    # Leer los documentos PDF usando SimpleDirectoryReader
+    # Leer los documentos PDF; los archivos sin cambios se sirven desde la caché de texto
+    # y el resto se analiza en paralelo en un pool de procesos
     print(f"Cargando documentos desde la carpeta: {pdf_directory}")
-    documents = SimpleDirectoryReader(pdf_directory, file_extractor="pdf").load_data()
+    if stream:
+        return get_pdf_text_cache().iter_directory(pdf_directory)
+    documents = get_pdf_text_cache().load_directory(pdf_directory)
     
     print(f"Se cargaron {len(documents)} documentos.")
     return documents
 
 
-def analyze_pdf_content(documents, query: str) -> str:
+def analyze_pdf_content(documents, query: str, mode: str = PDF_ANALYSIS_MODE) -> str:
     """
     Analiza los documentos PDF y responde a una consulta específica basada en el contenido.
 
     Args:
         documents (List[Document]): Lista de documentos cargados.
         query (str): Consulta realizada por el usuario.
+        mode (str): 'full' envía todo el texto; 'retrieval' envía solo los fragmentos
+            más relevantes (BM25) dentro de PDF_CONTEXT_TOKEN_BUDGET; 'map_reduce' consulta
+            cada fragmento en paralelo y combina las respuestas (preguntas sobre el documento completo).
 
     Returns:
         str: Respuesta basada en el contenido de los documentos.
     """
-    if not documents:
+    # Con stream=True los documentos son un generador: se comprueba que haya alguno tomando el primero
+    documents = iter(documents)
+    first = next(documents, None)
+    if first is None:
         return "No se encontraron documentos para analizar."
-
-    # Concatenar todo el texto de los documentos en un único contexto
-    full_text = "\n".join([doc.get_text() for doc in documents])
+    documents = chain([first], documents)
+
+    if mode == "map_reduce":
+        # Preguntas sobre el documento completo: fragmentos en paralelo + reducción jerárquica
+        from langchain_openai import ChatOpenAI
+        llm = ChatOpenAI(temperature=0.7, api_key=os.getenv("OPENAI_API_KEY"))
+        return map_reduce_analysis(documents, query, llm)
+
+    if mode == "retrieval":
+        # Solo los fragmentos más relevantes, con un prompt de tamaño acotado
+        chunks = select_relevant_chunks(documents, query)
+        if not chunks:
+            return "No se encontró contenido relevante en los documentos para esta consulta."
+        full_text = format_chunks(chunks)
+    else:
+        # Concatenar todo el texto de los documentos en un único contexto
+        full_text = "\n".join([doc.text for doc in documents])
 
     # Crear un prompt basado en el contenido y la consulta
     prompt = (
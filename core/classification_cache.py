@@ -0,0 +1,78 @@
+from collections import OrderedDict
+from .query_classifier import normalize_query
+import os
+import threading
+import time
+
+CLASSIFICATION_CACHE_SIZE = int(os.getenv("CLASSIFICATION_CACHE_SIZE", 10000))
+CLASSIFICATION_CACHE_TTL = float(os.getenv("CLASSIFICATION_CACHE_TTL", 3600))
+
+
+class ClassificationCache:
+    """
+    Caché LRU con expiración (TTL) de decisiones de clasificación.
+
+    Las claves son (espacio, consulta normalizada), de modo que variaciones de mayúsculas,
+    espacios o acentos de la misma consulta comparten entrada. Cada espacio
+    ('orchestrator', 'router', 'agent_one', ...) lleva sus propios contadores de aciertos.
+    """
+
+    def __init__(self, maxsize: int = CLASSIFICATION_CACHE_SIZE, ttl: float = CLASSIFICATION_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {}
+
+    def _count(self, namespace: str, field: str):
+        counters = self._counters.setdefault(namespace, {"hits": 0, "misses": 0})
+        counters[field] += 1
+
+    def get(self, namespace: str, query: str):
+        """
+        Devuelve la decisión cacheada o None si no existe o expiró.
+        """
+        key = (namespace, normalize_query(query))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self._count(namespace, "hits")
+                return entry[1]
+            if entry is not None:
+                del self._entries[key]
+            self._count(namespace, "misses")
+            return None
+
+    def set(self, namespace: str, query: str, value):
+        key = (namespace, normalize_query(query))
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        """
+        Tamaño de la caché y tasa de aciertos por espacio.
+        """
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "namespaces": {
+                    namespace: {
+                        **counters,
+                        "hit_rate": round(counters["hits"] / (counters["hits"] + counters["misses"]), 4)
+                        if counters["hits"] + counters["misses"] else 0.0,
+                    }
+                    for namespace, counters in self._counters.items()
+                },
+            }
+
+
+# Caché única por proceso, compartida por el orquestador, el router y los agentes
+classification_cache = ClassificationCache()
@@ -0,0 +1,93 @@
+from langchain.prompts import PromptTemplate
+import json
+import logging
+import os
+import re
+
+# Configurar logging
+logger = logging.getLogger('combined_classification')
+logger.setLevel(logging.INFO)
+
+# Modo de clasificación combinada: una sola llamada al LLM decide las tres clasificaciones
+COMBINED_CLASSIFICATION = os.getenv("COMBINED_CLASSIFICATION", "false").lower() == "true"
+
+ROUTER_CATEGORIES = {"embeddings", "generation", "pdf", "agent_one", "agent_two"}
+AGENT_TOOLS = {"embeddings_tool", "generation_tool", "pdf_analysis_tool", "llm"}
+
+combined_prompt = PromptTemplate(
+    input_variables=["query"],
+    template="""Eres un clasificador de consultas. Toma las tres decisiones siguientes a la vez:
+
+1. "tipo": 'general' si es una pregunta general, 'técnica' si es técnica.
+2. "categoria" (solo si es técnica), una de:
+   - embeddings: Búsqueda en documentos técnicos sobre Linux.
+   - agent_one: Programación Python avanzada, ciencia de datos.
+   - agent_two: Automatización con Bash, Git, MySQL.
+   - generation: Generación de contenido técnico general.
+   - pdf: Análisis específico de PDFs.
+3. "herramienta" (solo si la categoría es agent_one o agent_two), una de:
+   - embeddings_tool: Buscar en documentos de referencia.
+   - generation_tool: Generar explicaciones detalladas.
+   - pdf_analysis_tool: Analizar PDFs.
+   - llm: Respuesta general del agente.
+
+Consulta: {query}
+
+Responde ÚNICAMENTE con un objeto JSON, por ejemplo:
+{{"tipo": "técnica", "categoria": "agent_one", "herramienta": "llm"}}"""
+)
+
+
+def parse_combined(text: str):
+    """
+    Interpreta la respuesta JSON del LLM.
+
+    Returns:
+        dict | None: {"is_general", "category", "agent_tool"} o None si la respuesta no es válida.
+    """
+    match = re.search(r"\{.*\}", text, re.DOTALL)
+    if not match:
+        return None
+    try:
+        data = json.loads(match.group(0))
+    except ValueError:
+        return None
+
+    kind = str(data.get("tipo", "")).strip().lower()
+    if kind not in {"general", "técnica", "tecnica"}:
+        return None
+    is_general = kind == "general"
+
+    category = str(data.get("categoria") or "").strip().lower()
+    if not is_general and category not in ROUTER_CATEGORIES:
+        return None
+
+    agent_tool = str(data.get("herramienta") or "").strip().lower()
+    if agent_tool not in AGENT_TOOLS:
+        agent_tool = ""
+
+    return {
+        "is_general": is_general,
+        "category": "" if is_general else category,
+        "agent_tool": agent_tool if category in {"agent_one", "agent_two"} else "",
+    }
+
+
+def classify_combined(llm, query: str):
+    """
+    Clasificación combinada en una sola llamada al LLM (None si la respuesta no es válida).
+    """
+    result = parse_combined(llm.invoke(combined_prompt.format(query=query)).content)
+    if result is None:
+        logger.warning("Respuesta combinada inválida; se usará la clasificación por pasos")
+    return result
+
+
+async def aclassify_combined(llm, query: str):
+    """
+    Versión asíncrona de classify_combined.
+    """
+    result = parse_combined((await llm.ainvoke(combined_prompt.format(query=query))).content)
+    if result is None:
+        logger.warning("Respuesta combinada inválida; se usará la clasificación por pasos")
+    return result
@@ -0,0 +1,186 @@
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.embeddings.openai import OpenAIEmbedding
+from pydantic import PrivateAttr
+from functools import lru_cache
+from array import array
+from pathlib import Path
+import asyncio
+import hashlib
+import sqlite3
+import threading
+import tiktoken
+import os
+
+# Caché compartida por las tres bibliotecas (storage/ en la raíz del proyecto)
+PROJECT_ROOT = Path(__file__).parent.parent
+CACHE_PATH = PROJECT_ROOT / "storage" / "embedding_cache.sqlite3"
+
+# Tamaño de los lotes que se envían a la API para los textos que no están en caché
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", 256))
+# Tokens por solicitud a la API (OpenAI rechaza las que superan ~300k tokens en total)
+EMBEDDING_BATCH_TOKENS = int(os.getenv("EMBEDDING_BATCH_TOKENS", 250000))
+# SQLite limita el número de parámetros por consulta
+LOOKUP_BATCH_SIZE = 500
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+@lru_cache(maxsize=1)
+def _encoding():
+    # Tokenizador de los modelos de embeddings de OpenAI
+    return tiktoken.get_encoding("cl100k_base")
+
+
+def token_batches(texts: list, max_tokens: int = EMBEDDING_BATCH_TOKENS, max_size: int = EMBEDDING_BATCH_SIZE):
+    """
+    Divide los textos en lotes de como máximo `max_size` textos y `max_tokens` tokens.
+    """
+    batch, tokens = [], 0
+    for text in texts:
+        count = len(_encoding().encode(text, disallowed_special=()))
+        if batch and (len(batch) >= max_size or tokens + count > max_tokens):
+            yield batch
+            batch, tokens = [], 0
+        batch.append(text)
+        tokens += count
+    if batch:
+        yield batch
+
+
+class EmbeddingCache:
+    """
+    Caché en disco direccionada por contenido: (modelo de embeddings, hash del texto) -> vector.
+    """
+
+    def __init__(self, path: Path = CACHE_PATH):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), timeout=30, check_same_thread=False)
+        # WAL permite que varios procesos de construcción lean y escriban a la vez
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " model TEXT NOT NULL,"
+            " text_hash TEXT NOT NULL,"
+            " vector BLOB NOT NULL,"
+            " PRIMARY KEY (model, text_hash))"
+        )
+        self._conn.commit()
+
+    def get_many(self, model: str, hashes: list) -> dict:
+        """
+        Busca varios hashes a la vez. Devuelve {hash: vector} solo para los encontrados.
+        """
+        found = {}
+        unique = list(dict.fromkeys(hashes))
+        with self._lock:
+            for i in range(0, len(unique), LOOKUP_BATCH_SIZE):
+                chunk = unique[i:i + LOOKUP_BATCH_SIZE]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND text_hash IN ({placeholders})",
+                    [model, *chunk]
+                ).fetchall()
+                for digest, blob in rows:
+                    found[digest] = array("f", blob).tolist()
+        return found
+
+    def put_many(self, model: str, items: dict):
+        """
+        Guarda {hash: vector} en una sola transacción.
+        """
+        if not items:
+            return
+        rows = [(model, digest, array("f", vector).tobytes()) for digest, vector in items.items()]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, text_hash, vector) VALUES (?, ?, ?)", rows
+            )
+            self._conn.commit()
+
+
+class CachedEmbedding(BaseEmbedding):
+    """
+    Modelo de embeddings que consulta la caché antes de llamar a la API.
+    Los fallos de caché se envían juntos en lotes grandes al modelo subyacente.
+    """
+
+    _inner: BaseEmbedding = PrivateAttr()
+    _cache: EmbeddingCache = PrivateAttr()
+
+    def __init__(self, inner: BaseEmbedding, cache: EmbeddingCache, **kwargs):
+        # Lote externo grande: la búsqueda en caché y el envío de fallos se hacen en bloque
+        super().__init__(model_name=inner.model_name, embed_batch_size=2048, **kwargs)
+        self._inner = inner
+        self._cache = cache
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "CachedEmbedding"
+
+    def _get_query_embedding(self, query: str) -> list:
+        # Las consultas son únicas: no vale la pena cachearlas
+        return self._inner.get_query_embedding(query)
+
+    async def _aget_query_embedding(self, query: str) -> list:
+        return await self._inner.aget_query_embedding(query)
+
+    def _get_text_embedding(self, text: str) -> list:
+        return self._get_text_embeddings([text])[0]
+
+    def _lookup(self, texts: list):
+        hashes = [text_hash(text) for text in texts]
+        found = self._cache.get_many(self.model_name, hashes)
+
+        # Textos sin embedding en caché (sin repetir los duplicados dentro del lote)
+        missing = {}
+        for digest, text in zip(hashes, texts):
+            if digest not in found:
+                missing.setdefault(digest, text)
+        if missing:
+            print(f"Embeddings en caché: {len(texts) - len(missing)}/{len(texts)}; "
+                  f"solicitando {len(missing)} a la API...")
+        return hashes, found, missing
+
+    def _get_text_embeddings(self, texts: list) -> list:
+        hashes, found, missing = self._lookup(texts)
+        if missing:
+            vectors = []
+            # Cada lote respeta el límite de tokens por solicitud de la API
+            for batch in token_batches(list(missing.values())):
+                vectors.extend(self._inner.get_text_embedding_batch(batch))
+            computed = dict(zip(missing.keys(), vectors))
+            self._cache.put_many(self.model_name, computed)
+            found.update(computed)
+
+        return [found[digest] for digest in hashes]
+
+    async def _aget_text_embedding(self, text: str) -> list:
+        return (await self._aget_text_embeddings([text]))[0]
+
+    async def _aget_text_embeddings(self, texts: list) -> list:
+        # La caché (SQLite) y el conteo de tokens se ejecutan en el pool de hilos; la API, con el cliente asíncrono
+        hashes, found, missing = await asyncio.to_thread(self._lookup, texts)
+        if missing:
+            vectors = []
+            for batch in await asyncio.to_thread(lambda: list(token_batches(list(missing.values())))):
+                vectors.extend(await self._inner.aget_text_embedding_batch(batch))
+            computed = dict(zip(missing.keys(), vectors))
+            await asyncio.to_thread(self._cache.put_many, self.model_name, computed)
+            found.update(computed)
+
+        return [found[digest] for digest in hashes]
+
+
+def get_cached_embed_model(cache_path: Path = CACHE_PATH) -> CachedEmbedding:
+    """
+    Crea el modelo de embeddings de OpenAI envuelto con la caché compartida en disco.
+    """
+    inner = OpenAIEmbedding(
+        api_key=os.getenv("OPENAI_API_KEY"),
+        embed_batch_size=EMBEDDING_BATCH_SIZE
+    )
+    return CachedEmbedding(inner=inner, cache=EmbeddingCache(cache_path))
@@ -0,0 +1,170 @@
+from llama_index.core import VectorStoreIndex, SimpleDirectoryReader, StorageContext, load_index_from_storage
+from llama_index.core.ingestion import run_transformations
+from pathlib import Path
+import hashlib
+import json
+
+MANIFEST_NAME = "manifest.json"
+# Metadatos que dependen de la ubicación del archivo: no se embeben, de modo que el mismo
+# archivo en dos bibliotecas produce el mismo texto y comparte la caché de embeddings
+PATH_METADATA_KEYS = ["file_path"]
+
+
+def load_documents(data_dir: Path = None, input_files: list = None) -> list:
+    """
+    Carga los documentos de una biblioteca con SimpleDirectoryReader, sin la ruta del archivo
+    en el texto que se embebe (el nombre del archivo sí se incluye).
+    """
+    reader = SimpleDirectoryReader(input_files=input_files) if input_files else SimpleDirectoryReader(data_dir)
+    documents = reader.load_data()
+    for doc in documents:
+        excluded = [key for key in doc.excluded_embed_metadata_keys if key != "file_name"]
+        doc.excluded_embed_metadata_keys = excluded + [key for key in PATH_METADATA_KEYS if key not in excluded]
+    return documents
+
+
+def file_sha256(path: Path) -> str:
+    """
+    Calcula el hash SHA-256 del contenido de un archivo leyéndolo por bloques.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def scan_data_dir(data_dir: Path) -> dict:
+    """
+    Lista los archivos del directorio de documentos (mismo criterio que SimpleDirectoryReader:
+    sin recursión y sin archivos ocultos) junto con el hash de su contenido.
+
+    Returns:
+        dict: {nombre_relativo: sha256}
+    """
+    return {
+        path.name: file_sha256(path)
+        for path in sorted(data_dir.iterdir())
+        if path.is_file() and not path.name.startswith(".")
+    }
+
+
+def load_manifest(persist_dir: Path) -> dict:
+    manifest_path = persist_dir / MANIFEST_NAME
+    if not manifest_path.exists():
+        return {}
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        return json.load(f).get("files", {})
+
+
+def save_manifest(persist_dir: Path, files: dict):
+    manifest_path = persist_dir / MANIFEST_NAME
+    tmp_path = manifest_path.with_suffix(".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"files": files}, f, indent=2, ensure_ascii=False)
+    tmp_path.replace(manifest_path)
+
+
+def manifest_from_documents(data_dir: Path, documents) -> dict:
+    """
+    Construye el manifiesto de una carga completa del directorio de documentos.
+    """
+    current = scan_data_dir(data_dir)
+    files = {}
+    for doc in documents:
+        name = Path(doc.metadata.get("file_path", "")).name
+        if name in current:
+            entry = files.setdefault(name, {"hash": current[name], "doc_ids": []})
+            entry["doc_ids"].append(doc.doc_id)
+    return files
+
+
+def _manifest_from_index(index) -> dict:
+    """
+    Reconstruye un manifiesto para un índice creado antes de existir el modo incremental.
+    Los hashes quedan vacíos, así que cada archivo se re-embebe una única vez.
+    """
+    files = {}
+    for ref_doc_id, info in index.ref_doc_info.items():
+        file_path = (info.metadata or {}).get("file_path")
+        if not file_path:
+            continue
+        entry = files.setdefault(Path(file_path).name, {"hash": None, "doc_ids": []})
+        entry["doc_ids"].append(ref_doc_id)
+    return files
+
+
+def _load_documents_by_file(data_dir: Path, names: list) -> dict:
+    """
+    Carga solo los archivos indicados y agrupa los documentos resultantes por archivo.
+    """
+    if not names:
+        return {}
+    documents = load_documents(input_files=[data_dir / name for name in names])
+    grouped = {name: [] for name in names}
+    for doc in documents:
+        grouped.setdefault(Path(doc.metadata.get("file_path", "")).name, []).append(doc)
+    return grouped
+
+
+def sync_vector_index(data_dir: Path, persist_dir: Path, **index_kwargs):
+    """
+    Sincroniza de forma incremental el índice persistido con el directorio de documentos.
+
+    Mantiene un manifiesto con el hash de cada archivo: solo se embeben los archivos nuevos
+    o modificados, se eliminan los nodos de los archivos borrados y se persiste el delta.
+
+    Args:
+        data_dir (Path): Directorio de documentos de la biblioteca.
+        persist_dir (Path): Directorio donde se persiste el índice.
+        **index_kwargs: Argumentos adicionales para VectorStoreIndex / load_index_from_storage.
+
+    Returns:
+        VectorStoreIndex: Índice actualizado.
+    """
+    current = scan_data_dir(data_dir)
+    docstore_path = persist_dir / "docstore.json"
+
+    if docstore_path.exists():
+        print(f"Cargando índice existente desde {persist_dir}.")
+        storage_context = StorageContext.from_defaults(persist_dir=str(persist_dir))
+        index = load_index_from_storage(storage_context, **index_kwargs)
+        manifest = load_manifest(persist_dir)
+        if not manifest:
+            print("Índice sin manifiesto: se reconstruye a partir de los metadatos del docstore.")
+            manifest = _manifest_from_index(index)
+    else:
+        print("Creando un nuevo índice de vectores vacío...")
+        index = VectorStoreIndex.from_documents([], **index_kwargs)
+        manifest = {}
+
+    added = [name for name in current if name not in manifest]
+    changed = [name for name in current if name in manifest and manifest[name]["hash"] != current[name]]
+    removed = [name for name in manifest if name not in current]
+    print(f"Cambios detectados: {len(added)} nuevos, {len(changed)} modificados, {len(removed)} eliminados.")
+
+    # Eliminar los nodos de los archivos borrados o modificados
+    for name in removed + changed:
+        for doc_id in manifest.pop(name)["doc_ids"]:
+            index.delete_ref_doc(doc_id, delete_from_docstore=True)
+
+    # Embeber únicamente los archivos nuevos o modificados: todos sus nodos en una sola inserción,
+    # de modo que los embeddings se piden en lotes de embed_batch_size y no documento a documento
+    new_documents = []
+    for name, documents in _load_documents_by_file(data_dir, added + changed).items():
+        new_documents.extend(documents)
+        if name in current:
+            manifest[name] = {"hash": current[name], "doc_ids": [doc.doc_id for doc in documents]}
+    if new_documents:
+        nodes = run_transformations(new_documents, index._transformations)
+        index.insert_nodes(nodes)
+        for doc in new_documents:
+            index.docstore.set_document_hash(doc.doc_id, doc.hash)
+
+    persist_dir.mkdir(parents=True, exist_ok=True)
+    if added or changed or removed or not docstore_path.exists():
+        index.storage_context.persist(persist_dir=str(persist_dir))
+        print(f"Índice guardado en {persist_dir}.")
+    save_manifest(persist_dir, manifest)
+
+    return index
@@ -0,0 +1,94 @@
+from llama_index.core import StorageContext, load_index_from_storage
+from pathlib import Path
+import logging
+import threading
+
+# Configurar logging
+logger = logging.getLogger('index_registry')
+logger.setLevel(logging.INFO)
+
+
+class IndexRegistry:
+    """
+    Registro de índices vectoriales compartido por todo el proceso.
+
+    Cada biblioteca (orquestador, agent_one, agent_two) se carga una sola vez desde su
+    PERSIST_DIR y su motor de consulta se mantiene en memoria. La entrada solo se invalida
+    cuando cambia la huella (nombre, tamaño y mtime) de los archivos persistidos.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._library_locks = {}
+
+    @staticmethod
+    def fingerprint(persist_dir: Path) -> tuple:
+        """
+        Calcula una huella barata del contenido de PERSIST_DIR sin leer los archivos.
+        """
+        persist_dir = Path(persist_dir)
+        if not persist_dir.exists():
+            return ()
+        return tuple(sorted(
+            (entry.name, stat.st_size, stat.st_mtime_ns)
+            for entry in persist_dir.iterdir() if entry.is_file()
+            for stat in [entry.stat()]
+        ))
+
+    def _library_lock(self, key: str) -> threading.Lock:
+        with self._lock:
+            return self._library_locks.setdefault(key, threading.Lock())
+
+    def get_query_engine(self, persist_dir: Path, llm_factory, **engine_kwargs):
+        """
+        Devuelve el motor de consulta de la biblioteca, cargándolo solo si no está en memoria
+        o si los archivos persistidos cambiaron desde la última carga.
+
+        Args:
+            persist_dir (Path): Directorio donde está persistido el índice.
+            llm_factory (callable): Crea el LLM del motor de consulta (solo se llama al cargar).
+            **engine_kwargs: Argumentos adicionales para `index.as_query_engine`.
+
+        Returns:
+            BaseQueryEngine: Motor de consulta listo para usarse.
+        """
+        key = str(Path(persist_dir).resolve())
+        current = self.fingerprint(persist_dir)
+
+        entry = self._entries.get(key)
+        if entry and entry["fingerprint"] == current:
+            return entry["query_engine"]
+
+        # Un solo hilo recarga cada biblioteca; el resto espera y reutiliza el resultado
+        with self._library_lock(key):
+            entry = self._entries.get(key)
+            current = self.fingerprint(persist_dir)
+            if entry and entry["fingerprint"] == current:
+                return entry["query_engine"]
+
+            logger.info(f"Cargando índice en memoria desde {persist_dir}")
+            storage_context = StorageContext.from_defaults(persist_dir=str(persist_dir))
+            index = load_index_from_storage(storage_context)
+            query_engine = index.as_query_engine(llm=llm_factory(), **engine_kwargs)
+
+            self._entries[key] = {
+                "fingerprint": current,
+                "index": index,
+                "query_engine": query_engine,
+            }
+            return query_engine
+
+    def invalidate(self, persist_dir: Path = None):
+        """
+        Descarta una biblioteca del registro (o todas si no se indica directorio).
+        """
+        with self._lock:
+            if persist_dir is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(str(Path(persist_dir).resolve()), None)
+
+
+# Registro único por proceso
+index_registry = IndexRegistry()
@@ -5,7 +5,11 @@ from langchain_core.runnables import RunnableSequence
 from .agents.agent_one.primary_tools import embeddings_tool, generation_tool, pdf_analysis_tool
 from .agents.agent_one.agent_core import SimpleAgent as AgentOne
 from .agents.agent_two.agent_core import SimpleAgent as AgentTwo
+from .agent_pool import AgentPool
+from .query_classifier import classify_locally, record_example
+from .classification_cache import classification_cache
 import os
+import re
 
 # Configurar logging
 logger = logging.getLogger('router')
@@ -38,8 +42,98 @@ Respuesta (solo el nombre de la categoría en minúsculas):"""
 
 classification_chain = classification_prompt | llm
 
-def dispatch_category(category: str, query: str) -> dict:
-    """Ejecuta la lógica para la categoría clasificada."""
+VALID_CATEGORIES = {"embeddings", "generation", "pdf", "agent_one", "agent_two"}
+
+# Categoría usada cuando el LLM responde algo que no es una categoría válida
+DEFAULT_CATEGORY = os.getenv("ROUTER_DEFAULT_CATEGORY", "generation")
+if DEFAULT_CATEGORY not in VALID_CATEGORIES:
+    DEFAULT_CATEGORY = "generation"
+
+# Pools de agentes de larga duración (tamaño configurable por agente)
+agent_pools = {
+    "agent_one": AgentPool("agent_one", AgentOne, size=int(os.getenv("AGENT_ONE_POOL_SIZE", 4))),
+    "agent_two": AgentPool("agent_two", AgentTwo, size=int(os.getenv("AGENT_TWO_POOL_SIZE", 4))),
+}
+
+
+def classify_category_cached(query: str):
+    """
+    Categoría desde la caché de clasificaciones o el clasificador local (None si hay que usar el LLM).
+    """
+    category = classification_cache.get("router", query)
+    if category is None:
+        category = classify_locally("router", query)
+        if category is not None:
+            classification_cache.set("router", query, category)
+    return category
+
+
+def normalize_category(text: str) -> str:
+    """
+    Extrae la categoría de la respuesta del LLM aunque traiga comillas, puntuación o texto
+    adicional (None si no menciona ninguna categoría válida).
+    """
+    text = (text or "").strip().lower()
+    if text in VALID_CATEGORIES:
+        return text
+    for word in re.findall(r"[a-z_]+", text):
+        if word in VALID_CATEGORIES:
+            return word
+    return None
+
+
+def store_category(query: str, category: str):
+    """Guarda en caché y como ejemplo de entrenamiento la categoría decidida por el LLM."""
+    if category in VALID_CATEGORIES:
+        classification_cache.set("router", query, category)
+        record_example("router", query, category)
+
+
+def resolve_category(query: str, category: str = None) -> str:
+    """
+    Categoría de la consulta: la recibida si es válida (clasificación combinada), después la
+    caché y el clasificador local, y por último el LLM. Siempre devuelve una categoría válida,
+    de modo que el router no vuelve a clasificar una consulta ya resuelta.
+    """
+    if category in VALID_CATEGORIES:
+        return category
+    category = classify_category_cached(query)
+    if category is None:
+        classification = classification_chain.invoke({"query": query})
+        category = normalize_category(classification.content)
+        if category is None:
+            # Respuesta inválida: no se guarda como ejemplo ni se reintenta la clasificación
+            logger.warning(f"Categoría inválida del LLM: {classification.content!r}; se usa '{DEFAULT_CATEGORY}'")
+            return DEFAULT_CATEGORY
+        store_category(query, category)
+    return category
+
+
+async def aresolve_category(query: str, category: str = None) -> str:
+    """Versión asíncrona de resolve_category."""
+    if category in VALID_CATEGORIES:
+        return category
+    category = classify_category_cached(query)
+    if category is None:
+        classification = await classification_chain.ainvoke({"query": query})
+        category = normalize_category(classification.content)
+        if category is None:
+            # Respuesta inválida: no se guarda como ejemplo ni se reintenta la clasificación
+            logger.warning(f"Categoría inválida del LLM: {classification.content!r}; se usa '{DEFAULT_CATEGORY}'")
+            return DEFAULT_CATEGORY
+        store_category(query, category)
+    return category
+
+
+def get_pool_stats() -> dict:
+    """Estadísticas de uso y espera de los pools de agentes."""
+    return {name: pool.stats() for name, pool in agent_pools.items()}
+
+def dispatch_category(category: str, query: str, agent_tool: str = None) -> dict:
+    """
+    Ejecuta la lógica para la categoría clasificada.
+    `agent_tool` (clasificación combinada) evita que el agente vuelva a clasificar la consulta.
+    """
     logger.info(f"Iniciando dispatch para categoría: {category}")
     try:
         if category == "embeddings":
@@ -58,16 +152,16 @@ def dispatch_category(category: str, query: str) -> dict:
             return {"module": "pdf", "response": pdf_analysis_tool.run(query)}
         
         elif category == "agent_one":
-            logger.info("Inicializando Agent One")
-            print(f"(router) Inicializando Agent One")
-            agent = AgentOne()
-            return {"module": "agent_one", "response": agent.handle_query(query)}
+            logger.info("Usando Agent One del pool")
+            print(f"(router) Usando Agent One del pool")
+            with agent_pools["agent_one"].borrow() as agent:
+                return {"module": "agent_one", "response": agent.handle_query(query, selected_tool=agent_tool)}
         
         elif category == "agent_two":
-            logger.info("Inicializando Agent Two")
-            print(f"(router) Inicializando Agent Two")
-            agent = AgentTwo()
-            return {"module": "agent_two", "response": agent.handle_query(query)}
+            logger.info("Usando Agent Two del pool")
+            print(f"(router) Usando Agent Two del pool")
+            with agent_pools["agent_two"].borrow() as agent:
+                return {"module": "agent_two", "response": agent.handle_query(query, selected_tool=agent_tool)}
         
         else:
             logger.error(f"Categoría no reconocida: {category}")
@@ -78,21 +172,24 @@ def dispatch_category(category: str, query: str) -> dict:
         return {"error": f"Error en {category}: {str(e)}"}
 
 
-def route_query_with_langchain(query: str, user_id: str = None, **kwargs) -> dict:
-    """Clasificación y enrutamiento directo sin contexto adicional."""
+def route_query_with_langchain(query: str, user_id: str = None, category: str = None,
+                               agent_tool: str = None, **kwargs) -> dict:
+    """
+    Clasificación y enrutamiento directo sin contexto adicional.
+    Si se recibe `category` (clasificación combinada del orquestador) no se vuelve a clasificar.
+    """
     logger.info(f"Iniciando procesamiento de query. User ID: {user_id}")
     logger.info(f"Query recibida: {query}")
     print(f"(router) Procesando query para usuario: {user_id}")
     
     try:
-        # Clasificación precisa
+        # Clasificación precisa: modelo local primero, LLM si no hay confianza suficiente
         logger.info("Iniciando clasificación de la query")
-        classification = classification_chain.invoke({"query": query.strip()})
-        category = classification.content.strip().lower()
+        category = resolve_category(query.strip(), category)
         logger.info(f"Categoría clasificada: {category}")
         
         # Validación estricta
-        valid_categories = {"embeddings", "generation", "pdf", "agent_one", "agent_two"}
+        valid_categories = VALID_CATEGORIES
         
         if category not in valid_categories:
             logger.error(f"Categoría inválida detectada: {category}")
@@ -102,10 +199,67 @@ def route_query_with_langchain(query: str, user_id: str = None, **kwargs) -> dic
             }
         
         logger.info("Enviando query a dispatch_category")
-        result = dispatch_category(category, query.strip())
+        result = dispatch_category(category, query.strip(), agent_tool=agent_tool)
+        logger.info("Proceso completado exitosamente")
+        return result
+
+    except Exception as e:
+        logger.error(f"ERROR CRÍTICO en el router: {str(e)}")
+        return {"error": f"Error crítico en el router: {str(e)}"}
+
+
+async def adispatch_category(category: str, query: str, agent_tool: str = None) -> dict:
+    """Versión asíncrona de dispatch_category."""
+    logger.info(f"Iniciando dispatch asíncrono para categoría: {category}")
+    try:
+        if category == "embeddings":
+            logger.info("Ejecutando herramienta de embeddings")
+            return {"module": "embeddings", "response": await embeddings_tool.arun(query)}
+
+        elif category == "generation":
+            logger.info("Ejecutando herramienta de generación")
+            return {"module": "generation", "response": await generation_tool.arun(query)}
+
+        elif category == "pdf":
+            logger.info("Ejecutando herramienta de análisis PDF")
+            return {"module": "pdf", "response": await pdf_analysis_tool.arun(query)}
+
+        elif category in agent_pools:
+            logger.info(f"Usando {category} del pool")
+            async with agent_pools[category].aborrow() as agent:
+                return {"module": category, "response": await agent.ahandle_query(query, selected_tool=agent_tool)}
+
+        else:
+            logger.error(f"Categoría no reconocida: {category}")
+            return {"error": f"Categoría '{category}' no reconocida"}
+
+    except Exception as e:
+        logger.error(f"ERROR en adispatch_category: {str(e)}")
+        return {"error": f"Error en {category}: {str(e)}"}
+
+
+async def aroute_query_with_langchain(query: str, user_id: str = None, category: str = None,
+                                      agent_tool: str = None, **kwargs) -> dict:
+    """Versión asíncrona de route_query_with_langchain (clasificación con ainvoke)."""
+    logger.info(f"Iniciando procesamiento asíncrono de query. User ID: {user_id}")
+    logger.info(f"Query recibida: {query}")
+
+    try:
+        category = await aresolve_category(query.strip(), category)
+        logger.info(f"Categoría clasificada: {category}")
+
+        valid_categories = VALID_CATEGORIES
+        if category not in valid_categories:
+            logger.error(f"Categoría inválida detectada: {category}")
+            return {
+                "error": f"Clasificación inválida: '{category}'",
+                "valid_categories": list(valid_categories)
+            }
+
+        result = await adispatch_category(category, query.strip(), agent_tool=agent_tool)
         logger.info("Proceso completado exitosamente")
         return result
 
     except Exception as e:
         logger.error(f"ERROR CRÍTICO en el router: {str(e)}")
-        return {"error": f"Error crítico en el router: {str(e)}"}
\ No newline at end of file
+        return {"error": f"Error crítico en el router: {str(e)}"}
@@ -3,10 +3,19 @@ from langchain.prompts import PromptTemplate
 import os
 import logging
 import traceback
-from .orch_router import route_query_with_langchain  # Enrutador para delegar tareas a herramientas/agentes
+import threading
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from .orch_router import route_query_with_langchain, aroute_query_with_langchain  # Enrutador para delegar tareas a herramientas/agentes
+from .orch_router import resolve_category, aresolve_category, VALID_CATEGORIES
 from db.tinydb_manager import ConversationManager
 from .log_control import LogManager
+from .query_classifier import classify_locally, record_example
+from .classification_cache import classification_cache
+from .combined_classification import COMBINED_CLASSIFICATION, classify_combined, aclassify_combined
+from .semantic_cache import SEMANTIC_CACHE_ENABLED, semantic_cache
 from langgraph.graph import StateGraph, START, END
+from langchain_core.runnables import RunnableLambda
 from typing import TypedDict, Optional
 
 # Configurar logging
@@ -19,8 +28,20 @@ console_handler = logging.StreamHandler()
 console_handler.setFormatter(formatter)
 logger.addHandler(console_handler)
 
+# Instancia compartida por el proceso: el grafo compilado y los clientes LLM se crean una sola vez
+_orchestrator = None
+_orchestrator_lock = threading.Lock()
+
+# Modo especulativo: clasificación, carga del historial y refinamiento se ejecutan a la vez
+ORCH_SPECULATIVE_EXECUTION = os.getenv("ORCH_SPECULATIVE_EXECUTION", "false").lower() == "true"
+_speculative_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("ORCH_SPECULATIVE_WORKERS", 8)),
+    thread_name_prefix="orch-speculative"
+)
+
+
 class OrchestratorAgent:
-    def __init__(self, user_id):
+    def __init__(self, user_id: str = "default_user"):
         try:
             logger.info("=== INICIANDO ORCHESTRATOR AGENT ===")
             logger.info("Inicializando componentes...")
@@ -30,7 +51,18 @@ class OrchestratorAgent:
             )
             
             self.user_id = user_id
-            self.conversation_manager = ConversationManager()
+            # En el modo de memoria 'summary' los turnos antiguos se resumen con el LLM del orquestador
+            self.summary_prompt = PromptTemplate(
+                input_variables=["summary", "messages"],
+                template=(
+                    "Actualiza el resumen de una conversación técnica con los mensajes nuevos.\n\n"
+                    "Resumen actual:\n{summary}\n\n"
+                    "Mensajes nuevos:\n{messages}\n\n"
+                    "Escribe un resumen breve que conserve los datos técnicos, decisiones y preguntas "
+                    "pendientes relevantes para continuar la conversación:"
+                )
+            )
+            self.conversation_manager = ConversationManager(summarizer=self._summarize_history)
             
             logger.info("Inicializando grafo de decisiones...")
             self.orchestrator_graph = self._initialize_graph()
@@ -51,9 +83,18 @@ class OrchestratorAgent:
             query: str
             conversation_id: str
             optional_id: str
+            user_id: str
             response: str
             refined_query: str
             is_general: bool
+            category: str
+            agent_tool: str
+            module: str
+            agent_response: str
+            conv_history: str
+            defer_synthesis: bool
+            bypass_cache: bool
+            cache_hit: bool
 
         logger.info("Creando grafo con el esquema...")
         graph = StateGraph(StateSchema)
@@ -88,6 +129,8 @@ class OrchestratorAgent:
                 "Genera una respuesta clara, profesional y detallada para el usuario:"
             )
         )
+        # Se guarda para la síntesis en streaming (astream_query)
+        self.orchestrator_prompt = orchestrator_prompt
 
         classification_prompt = PromptTemplate(
             input_variables=["query"],
@@ -99,14 +142,98 @@ class OrchestratorAgent:
             )
         )
 
+        def defer_synthesis(context, agent_response, conv_history):
+            # En modo streaming la síntesis final se hace fuera del grafo, token a token
+            if not context.get("defer_synthesis"):
+                return False
+            context["agent_response"] = agent_response
+            context["conv_history"] = conv_history
+            return True
+
+        def load_history(context):
+            # En modo especulativo el historial ya viene cargado en el estado
+            if not context.get("conv_history"):
+                context["conv_history"] = conversation_manager.get_formatted_conversation(context['conversation_id'])
+            return context["conv_history"]
+
+        async def aload_history(context):
+            if not context.get("conv_history"):
+                context["conv_history"] = await asyncio.to_thread(
+                    conversation_manager.get_formatted_conversation, context['conversation_id']
+                )
+            return context["conv_history"]
+
+        def refine(query, conv_history):
+            return llm.invoke(refine_prompt.format(query=query, context=conv_history)).content.strip()
+
+        async def arefine(query, conv_history):
+            return (await llm.ainvoke(refine_prompt.format(query=query, context=conv_history))).content.strip()
+
+        def use_semantic_cache(context):
+            return SEMANTIC_CACHE_ENABLED and not context.get("bypass_cache")
+
+        def apply_cached_response(context, scope, response):
+            # Salida del router de una consulta equivalente: no se enruta, pero la síntesis con el
+            # historial de esta conversación se hace igual (la caché no guarda respuestas personalizadas)
+            context["category"] = scope
+            context["cache_hit"] = True
+            logger.info(f"Respuesta del router obtenida de la caché semántica ({scope})")
+            return {"module": scope, "response": response}
+
+        def cacheable(context, router_response):
+            # Los errores del router no se guardan
+            return use_semantic_cache(context) and bool(router_response.get("module")) and "response" in router_response
+
+        def cached_combined(query):
+            combined = classification_cache.get("combined", query)
+            if combined is not None:
+                logger.info("Clasificación combinada obtenida de la caché")
+            return combined
+
+        def store_combined(query, combined):
+            classification_cache.set("combined", query, combined)
+            record_example("orchestrator", query, "general" if combined["is_general"] else "técnica")
+
+        def apply_combined(context, combined):
+            # Una sola respuesta estructurada decide tipo, categoría del router y herramienta del agente
+            context.update(combined)
+            logger.info(f"Clasificación combinada: {combined}")
+            return context
+
+        def cached_classification(query):
+            # Caché de decisiones y después el clasificador local; None si hay que consultar al LLM
+            classification = classification_cache.get("orchestrator", query)
+            if classification is None:
+                classification = classify_locally("orchestrator", query)
+                if classification is not None:
+                    classification_cache.set("orchestrator", query, classification)
+            return classification
+
+        def store_classification(query, classification):
+            classification_cache.set("orchestrator", query, classification)
+            record_example("orchestrator", query, "general" if classification == "general" else "técnica")
+
         def classify_query(context):
             logger.info("=== CLASIFICACIÓN DE CONSULTA ===")
             logger.info(f"Consulta original: {context['query']}")
             
             query = context["query"]
-            classification = llm.invoke(
-                classification_prompt.format(query=query)
-            ).content.strip().lower()
+            if COMBINED_CLASSIFICATION:
+                combined = cached_combined(query)
+                if combined is None:
+                    combined = classify_combined(llm, query)
+                    if combined is not None:
+                        store_combined(query, combined)
+                if combined is not None:
+                    return apply_combined(context, combined)
+
+            # Caché y clasificador local primero; el LLM solo si no hay confianza suficiente
+            classification = cached_classification(query)
+            if classification is None:
+                classification = llm.invoke(
+                    classification_prompt.format(query=query)
+                ).content.strip().lower()
+                store_classification(query, classification)
             context["is_general"] = classification == "general"
             
             logger.info(f"Clasificación: {classification}")
@@ -115,7 +242,9 @@ class OrchestratorAgent:
         def handle_general_query(context):
             logger.info("=== MANEJANDO CONSULTA GENERAL ===")
             
-            conv_history = conversation_manager.get_formatted_conversation(context['conversation_id'])
+            conv_history = load_history(context)
+            if defer_synthesis(context, "Esta es una consulta general sobre tecnología.", conv_history):
+                return context
             response = llm.invoke(
                 orchestrator_prompt.format(
                     query=context['query'],
@@ -128,21 +257,43 @@ class OrchestratorAgent:
             logger.info("Respuesta general generada")
             return context
 
-        def refine_and_route_query(context):
-            logger.info("=== REFINAMIENTO Y ENRUTAMIENTO ===")
+        def refine_query(context):
+            logger.info("=== REFINAMIENTO ===")
+
+            conv_history = load_history(context)
+            # El refinamiento especulativo ya pudo haberse completado durante la clasificación
+            context["refined_query"] = context.get("refined_query") or refine(context['query'], conv_history)
+
+            logger.info(f"Consulta refinada: {context['refined_query']}")
+            return context
+
+        def route_query(context):
+            logger.info("=== ENRUTAMIENTO ===")
+
+            conv_history = load_history(context)
+            refined_query = context["refined_query"]
+
+            # La caché semántica se consulta por categoría, antes de ejecutar la herramienta o el agente
+            router_response = None
+            if use_semantic_cache(context):
+                context["category"] = resolve_category(refined_query, context.get("category") or None)
+                if context["category"] in VALID_CATEGORIES:
+                    cached = semantic_cache.lookup(context["category"], refined_query)
+                    if cached is not None:
+                        router_response = apply_cached_response(context, context["category"], cached)
             
-            conv_history = conversation_manager.get_formatted_conversation(context['conversation_id'])
-            refined_query = llm.invoke(
-                refine_prompt.format(
-                    query=context['query'],
-                    context=conv_history
+            if router_response is None:
+                # Si la clasificación combinada ya decidió, el router y el agente no vuelven a clasificar
+                router_response = route_query_with_langchain(
+                    refined_query,
+                    category=context.get("category") or None,
+                    agent_tool=context.get("agent_tool") or None
                 )
-            ).content.strip()
-            context["refined_query"] = refined_query
-            
-            logger.info(f"Consulta refinada: {refined_query}")
-            
-            router_response = route_query_with_langchain(refined_query)
+                if cacheable(context, router_response):
+                    semantic_cache.store(router_response["module"], refined_query, router_response["response"])
+            context["module"] = router_response.get("module", "")
+            if defer_synthesis(context, router_response.get("response", "Error en el router"), conv_history):
+                return context
             
             final_response = llm.invoke(
                 orchestrator_prompt.format(
@@ -156,19 +307,154 @@ class OrchestratorAgent:
             logger.info("Respuesta técnica generada")
             return context
 
+        # Versiones asíncronas de los nodos: el mismo grafo sirve para invoke y ainvoke
+        async def aclassify_query(context):
+            logger.info("=== CLASIFICACIÓN DE CONSULTA (async) ===")
+            if COMBINED_CLASSIFICATION:
+                combined = cached_combined(context["query"])
+                if combined is None:
+                    combined = await aclassify_combined(llm, context["query"])
+                    if combined is not None:
+                        store_combined(context["query"], combined)
+                if combined is not None:
+                    return apply_combined(context, combined)
+
+            classification = cached_classification(context["query"])
+            if classification is None:
+                classification = (await llm.ainvoke(
+                    classification_prompt.format(query=context["query"])
+                )).content.strip().lower()
+                store_classification(context["query"], classification)
+            context["is_general"] = classification == "general"
+
+            logger.info(f"Clasificación: {classification}")
+            return context
+
+        async def ahandle_general_query(context):
+            logger.info("=== MANEJANDO CONSULTA GENERAL (async) ===")
+
+            conv_history = await aload_history(context)
+            if defer_synthesis(context, "Esta es una consulta general sobre tecnología.", conv_history):
+                return context
+            response = (await llm.ainvoke(
+                orchestrator_prompt.format(
+                    query=context['query'],
+                    agent_response="Esta es una consulta general sobre tecnología.",
+                    context=conv_history
+                )
+            )).content.strip()
+
+            context["response"] = response
+            logger.info("Respuesta general generada")
+            return context
+
+        async def arefine_query(context):
+            logger.info("=== REFINAMIENTO (async) ===")
+
+            conv_history = await aload_history(context)
+            context["refined_query"] = context.get("refined_query") or await arefine(context['query'], conv_history)
+
+            logger.info(f"Consulta refinada: {context['refined_query']}")
+            return context
+
+        async def aroute_query(context):
+            logger.info("=== ENRUTAMIENTO (async) ===")
+
+            conv_history = await aload_history(context)
+            refined_query = context["refined_query"]
+
+            router_response = None
+            if use_semantic_cache(context):
+                context["category"] = await aresolve_category(refined_query, context.get("category") or None)
+                if context["category"] in VALID_CATEGORIES:
+                    cached = await semantic_cache.alookup(context["category"], refined_query)
+                    if cached is not None:
+                        router_response = apply_cached_response(context, context["category"], cached)
+
+            if router_response is None:
+                router_response = await aroute_query_with_langchain(
+                    refined_query,
+                    category=context.get("category") or None,
+                    agent_tool=context.get("agent_tool") or None
+                )
+                if cacheable(context, router_response):
+                    await semantic_cache.astore(router_response["module"], refined_query, router_response["response"])
+            context["module"] = router_response.get("module", "")
+            if defer_synthesis(context, router_response.get("response", "Error en el router"), conv_history):
+                return context
+
+            final_response = (await llm.ainvoke(
+                orchestrator_prompt.format(
+                    query=context['query'],
+                    agent_response=router_response.get("response", "Error en el router"),
+                    context=conv_history
+                )
+            )).content.strip()
+
+            context["response"] = final_response
+            logger.info("Respuesta técnica generada")
+            return context
+
+        def speculative_classify(context):
+            # Historial y refinamiento arrancan en paralelo a la clasificación
+            logger.info("=== CLASIFICACIÓN ESPECULATIVA ===")
+            history = _speculative_executor.submit(
+                conversation_manager.get_formatted_conversation, context['conversation_id']
+            )
+            refinement = _speculative_executor.submit(lambda: refine(context['query'], history.result()))
+
+            context = classify_query(context)
+            context["conv_history"] = history.result()
+            if context["is_general"]:
+                # Rama perdedora: si la llamada ya está en curso, su resultado se descarta
+                refinement.cancel()
+            else:
+                context["refined_query"] = refinement.result()
+            return context
+
+        async def aspeculative_classify(context):
+            logger.info("=== CLASIFICACIÓN ESPECULATIVA (async) ===")
+            history = asyncio.create_task(asyncio.to_thread(
+                conversation_manager.get_formatted_conversation, context['conversation_id']
+            ))
+
+            async def refine_after_history():
+                return await arefine(context['query'], await history)
+
+            refinement = asyncio.create_task(refine_after_history())
+            try:
+                context = await aclassify_query(context)
+                context["conv_history"] = await history
+            except BaseException:
+                refinement.cancel()
+                raise
+
+            if context["is_general"]:
+                refinement.cancel()
+            else:
+                context["refined_query"] = await refinement
+            return context
+
         logger.info("Agregando nodos al grafo...")
-        graph.add_node("Classify Query", classify_query)
-        graph.add_node("Handle General Query", handle_general_query)
-        graph.add_node("Refine and Route Query", refine_and_route_query)
+        if ORCH_SPECULATIVE_EXECUTION:
+            graph.add_node("Classify Query", RunnableLambda(speculative_classify, afunc=aspeculative_classify))
+        else:
+            graph.add_node("Classify Query", RunnableLambda(classify_query, afunc=aclassify_query))
+        graph.add_node("Handle General Query", RunnableLambda(handle_general_query, afunc=ahandle_general_query))
+        # Refinamiento y enrutamiento en nodos separados: el streaming informa de la consulta
+        # refinada en cuanto está lista, antes de ejecutar el agente o la herramienta
+        graph.add_node("Refine Query", RunnableLambda(refine_query, afunc=arefine_query))
+        graph.add_node("Route Query", RunnableLambda(route_query, afunc=aroute_query))
 
         logger.info("Definiendo transiciones...")
         graph.add_edge(START, "Classify Query")
         graph.add_conditional_edges(
             "Classify Query",
-            lambda x: "Handle General Query" if x["is_general"] else "Refine and Route Query"
+            lambda x: "Handle General Query" if x["is_general"] else "Refine Query"
         )
         graph.add_edge("Handle General Query", END)
-        graph.add_edge("Refine and Route Query", END)
+        graph.add_edge("Refine Query", "Route Query")
+        graph.add_edge("Route Query", END)
 
         logger.info("Compilando grafo...")
         workflow = graph.compile()
@@ -176,22 +462,72 @@ class OrchestratorAgent:
         
         return workflow
 
-    def handle_query(self, query: str, conversation_id: str, optional_id: str = "default_user") -> str:
+    def _summarize_history(self, summary: str, messages: str) -> str:
+        """
+        Incorpora mensajes antiguos al resumen persistido de la conversación.
+        """
+        return self.llm.invoke(
+            self.summary_prompt.format(summary=summary or "Sin resumen previo.", messages=messages)
+        ).content.strip()
+
+    def _save_interaction(self, query: str, conversation_id: str, user_id: str, result: dict):
+        """
+        Guarda la consulta y la respuesta en la conversación y registra el log de la interacción.
+        """
+        final_response = result["response"]
+
+        # Guardar conversación
+        self.conversation_manager.add_message(conversation_id, "user", query)
+        self.conversation_manager.add_message(conversation_id, "system", final_response)
+        # En el modo 'summary' el resumen se actualiza en segundo plano, después de responder
+        self.conversation_manager.schedule_summary(conversation_id)
+
+        # Registrar log
+        log_entry = LogManager.create_log_entry(
+            user_id=result.get("user_id", user_id),
+            conversation_id=conversation_id,
+            query=query,
+            router_query=result.get("refined_query", ""),
+            router_response=result.get("response", ""),
+            final_response=final_response
+        )
+        LogManager.log_interaction(log_entry)
+
+    def _initial_state(self, query: str, conversation_id: str, optional_id: str, user_id: str,
+                       bypass_cache: bool = False) -> dict:
+        return {
+            "query": query.strip(),
+            "conversation_id": conversation_id,
+            "optional_id": optional_id,
+            "user_id": user_id,
+            "response": "",
+            "refined_query": "",
+            "is_general": False,
+            "category": "",
+            "agent_tool": "",
+            "module": "",
+            "agent_response": "",
+            "conv_history": "",
+            "defer_synthesis": False,
+            "bypass_cache": bypass_cache,
+            "cache_hit": False
+        }
+
+    def handle_query(self, query: str, conversation_id: str, optional_id: str = "default_user",
+                     user_id: Optional[str] = None, bypass_cache: bool = False) -> str:
         """
         Orquesta el flujo completo usando el grafo para decidir si manejar la consulta
         directamente o delegarla al router.
+
+        El estado de la solicitud (user_id, conversation_id) viaja en el estado del grafo,
+        por lo que una misma instancia atiende solicitudes de distintos usuarios.
+        Con `bypass_cache` la consulta no se responde desde la caché semántica ni se guarda en ella.
         """
+        user_id = user_id or self.user_id
         try:
             logger.info(f"Procesando nueva consulta: {query}")
             
-            context = {
-                "query": query.strip(),
-                "conversation_id": conversation_id,
-                "optional_id": optional_id,
-                "response": "",
-                "refined_query": "",
-                "is_general": False
-            }
+            context = self._initial_state(query, conversation_id, optional_id, user_id, bypass_cache)
 
             try:
                 result = self.orchestrator_graph.invoke(context)
@@ -201,21 +537,7 @@ class OrchestratorAgent:
                 raise
 
             final_response = result["response"]
-            
-            # Guardar conversación
-            self.conversation_manager.add_message(conversation_id, "user", query)
-            self.conversation_manager.add_message(conversation_id, "system", final_response)
-
-            # Registrar log
-            log_entry = LogManager.create_log_entry(
-                user_id=self.user_id,
-                conversation_id=conversation_id,
-                query=query,
-                router_query=result.get("refined_query", ""),
-                router_response=result.get("response", ""),
-                final_response=final_response
-            )
-            LogManager.log_interaction(log_entry)
+            self._save_interaction(query, conversation_id, user_id, result)
             
             logger.info("Respuesta generada exitosamente")
             return final_response
@@ -224,3 +546,94 @@ class OrchestratorAgent:
             logger.error(f"Error en handle_query: {str(e)}")
             logger.error(f"Detalles completos:\n{traceback.format_exc()}")
             return f"Error procesando la consulta en el orquestador: {str(e)}"
+
+
+    async def ahandle_query(self, query: str, conversation_id: str, optional_id: str = "default_user",
+                            user_id: Optional[str] = None, bypass_cache: bool = False) -> str:
+        """
+        Versión asíncrona de handle_query: ejecuta el grafo con ainvoke y las llamadas al LLM
+        sin bloquear el event loop; el acceso a la base de datos se hace en el pool de hilos.
+        """
+        user_id = user_id or self.user_id
+        try:
+            logger.info(f"Procesando nueva consulta (async): {query}")
+
+            context = self._initial_state(query, conversation_id, optional_id, user_id, bypass_cache)
+            try:
+                result = await self.orchestrator_graph.ainvoke(context)
+                logger.info("Grafo ejecutado exitosamente")
+            except Exception as graph_error:
+                logger.error(f"Error en la ejecución del grafo: {str(graph_error)}")
+                raise
+
+            await asyncio.to_thread(self._save_interaction, query, conversation_id, user_id, result)
+
+            logger.info("Respuesta generada exitosamente")
+            return result["response"]
+
+        except Exception as e:
+            logger.error(f"Error en ahandle_query: {str(e)}")
+            logger.error(f"Detalles completos:\n{traceback.format_exc()}")
+            return f"Error procesando la consulta en el orquestador: {str(e)}"
+
+
+    async def astream_query(self, query: str, conversation_id: str, optional_id: str = "default_user",
+                            user_id: Optional[str] = None, bypass_cache: bool = False):
+        """
+        Ejecuta el grafo emitiendo eventos de progreso y luego transmite la respuesta final
+        token a token a medida que el LLM la genera. Al terminar guarda la respuesta completa.
+
+        Yields:
+            tuple: (evento, datos) con eventos 'classified', 'refined', 'routed', 'token',
+                'done' o 'error'.
+        """
+        user_id = user_id or self.user_id
+        try:
+            logger.info(f"Procesando nueva consulta (streaming): {query}")
+            state = self._initial_state(query, conversation_id, optional_id, user_id, bypass_cache)
+            state["defer_synthesis"] = True
+
+            async for update in self.orchestrator_graph.astream(state, stream_mode="updates"):
+                for node, values in update.items():
+                    state.update(values or {})
+                    if node == "Classify Query":
+                        yield "classified", {"is_general": state["is_general"]}
+                    elif node == "Refine Query":
+                        yield "refined", {"refined_query": state["refined_query"]}
+                    elif node == "Route Query":
+                        yield "routed", {"module": state["module"], "cached": state["cache_hit"]}
+
+            # Síntesis final en streaming con el mismo prompt del grafo (también con la caché semántica)
+            prompt = self.orchestrator_prompt.format(
+                query=state['query'],
+                agent_response=state["agent_response"],
+                context=state["conv_history"]
+            )
+            tokens = []
+            async for chunk in self.llm.astream(prompt):
+                if chunk.content:
+                    tokens.append(chunk.content)
+                    yield "token", {"content": chunk.content}
+
+            state["response"] = "".join(tokens).strip()
+            await asyncio.to_thread(self._save_interaction, query, conversation_id, user_id, state)
+
+            logger.info("Respuesta transmitida exitosamente")
+            yield "done", {"response": state["response"]}
+
+        except Exception as e:
+            logger.error(f"Error en astream_query: {str(e)}")
+            logger.error(f"Detalles completos:\n{traceback.format_exc()}")
+            yield "error", {"error": f"Error procesando la consulta en el orquestador: {str(e)}"}
+
+
+def get_orchestrator() -> OrchestratorAgent:
+    """
+    Devuelve el orquestador compartido por el proceso, creándolo en la primera llamada.
+    """
+    global _orchestrator
+    if _orchestrator is None:
+        with _orchestrator_lock:
+            if _orchestrator is None:
+                _orchestrator = OrchestratorAgent()
+    return _orchestrator
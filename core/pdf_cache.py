@@ -0,0 +1,168 @@
+from llama_index.core import Document
+from .pdf_parsing import iter_parsed_files
+from pathlib import Path
+import hashlib
+import json
+import sqlite3
+import threading
+
+# Caché compartida por las herramientas PDF del orquestador y de los agentes
+PROJECT_ROOT = Path(__file__).parent.parent
+CACHE_PATH = PROJECT_ROOT / "storage" / "pdf_text_cache.sqlite3"
+
+
+def _file_sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class PdfTextCache:
+    """
+    Caché persistente del texto extraído de los PDFs.
+
+    Cada archivo se identifica por su ruta, tamaño y mtime. Si el tamaño o el mtime cambian
+    se compara el hash del contenido antes de volver a extraer el texto, de modo que solo
+    se analizan los archivos nuevos o realmente modificados.
+    """
+
+    def __init__(self, path: Path = CACHE_PATH):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS pdf_text ("
+            " path TEXT PRIMARY KEY,"
+            " directory TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " mtime_ns INTEGER NOT NULL,"
+            " sha256 TEXT NOT NULL,"
+            " documents TEXT NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS pdf_text_directory ON pdf_text (directory)")
+        self._conn.commit()
+
+    @staticmethod
+    def list_files(pdf_directory: Path) -> list:
+        """
+        Archivos del directorio con el mismo criterio que SimpleDirectoryReader (sin recursión ni ocultos).
+        """
+        return [
+            path for path in sorted(Path(pdf_directory).iterdir())
+            if path.is_file() and not path.name.startswith(".")
+        ]
+
+    def _get(self, path: str):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT size, mtime_ns, sha256, documents FROM pdf_text WHERE path = ?", (path,)
+            ).fetchone()
+
+    def lookup(self, path: Path):
+        """
+        Devuelve los documentos cacheados de un archivo, o None si hay que volver a analizarlo.
+        """
+        stat = path.stat()
+        row = self._get(str(path))
+        if row is None:
+            return None
+
+        size, mtime_ns, sha256, documents = row
+        if size != stat.st_size or mtime_ns != stat.st_mtime_ns:
+            # Cambió el stat: solo se reutiliza si el contenido es idéntico
+            if _file_sha256(path) != sha256:
+                return None
+            with self._lock:
+                self._conn.execute(
+                    "UPDATE pdf_text SET size = ?, mtime_ns = ? WHERE path = ?",
+                    (stat.st_size, stat.st_mtime_ns, str(path))
+                )
+                self._conn.commit()
+
+        return [
+            Document(id_=item["id"], text=item["text"], metadata=item["metadata"])
+            for item in json.loads(documents)
+        ]
+
+    def store(self, path: Path, documents: list):
+        """
+        Guarda los documentos extraídos de un archivo.
+        """
+        stat = path.stat()
+        payload = json.dumps(
+            [{"id": doc.doc_id, "text": doc.text, "metadata": doc.metadata} for doc in documents],
+            ensure_ascii=False, default=str
+        )
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO pdf_text (path, directory, size, mtime_ns, sha256, documents) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (str(path), str(path.parent), stat.st_size, stat.st_mtime_ns, _file_sha256(path), payload)
+            )
+            self._conn.commit()
+
+    def prune(self, pdf_directory: Path, present: list):
+        """
+        Elimina de la caché los archivos que ya no existen en el directorio.
+        """
+        present = {str(path) for path in present}
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT path FROM pdf_text WHERE directory = ?", (str(pdf_directory),)
+            ).fetchall()
+            stale = [(path,) for (path,) in rows if path not in present]
+            if stale:
+                self._conn.executemany("DELETE FROM pdf_text WHERE path = ?", stale)
+                self._conn.commit()
+
+    def iter_directory(self, pdf_directory: Path):
+        """
+        Entrega los documentos de un directorio a medida que están disponibles: primero los
+        archivos sin cambios desde la caché y después, página a página, los nuevos o
+        modificados analizados en paralelo (que se guardan en caché al terminar cada archivo).
+
+        Yields:
+            Document: Documentos de cada archivo del directorio.
+        """
+        pdf_directory = Path(pdf_directory).resolve()
+        files = self.list_files(pdf_directory)
+
+        pending = []
+        cached = 0
+        for path in files:
+            documents = self.lookup(path)
+            if documents is None:
+                pending.append(path)
+                continue
+            cached += 1
+            yield from documents
+
+        print(f"PDFs en caché: {cached}; por analizar: {len(pending)}")
+        self.prune(pdf_directory, files)
+        if pending:
+            yield from iter_parsed_files(pending, on_file_complete=self.store)
+
+    def load_directory(self, pdf_directory: Path) -> list:
+        """
+        Igual que iter_directory, pero devuelve todos los documentos en una lista.
+        """
+        return list(self.iter_directory(pdf_directory))
+
+
+_pdf_text_cache = None
+_pdf_text_cache_lock = threading.Lock()
+
+
+def get_pdf_text_cache() -> PdfTextCache:
+    """
+    Caché de texto compartida por el proceso; la base de datos se crea al usarse por primera vez.
+    """
+    global _pdf_text_cache
+    with _pdf_text_cache_lock:
+        if _pdf_text_cache is None:
+            _pdf_text_cache = PdfTextCache()
+        return _pdf_text_cache
@@ -0,0 +1,176 @@
+from .pdf_retrieval import chunk_documents, count_tokens
+import logging
+import os
+
+# Configurar logging
+logger = logging.getLogger('pdf_map_reduce')
+logger.setLevel(logging.INFO)
+
+# Configuración del modo map-reduce
+PDF_MAP_CHUNK_TOKENS = int(os.getenv("PDF_MAP_CHUNK_TOKENS", 3000))
+PDF_MAP_CONCURRENCY = int(os.getenv("PDF_MAP_CONCURRENCY", 4))
+PDF_REDUCE_FANOUT = int(os.getenv("PDF_REDUCE_FANOUT", 5))
+PDF_REDUCE_TOKEN_BUDGET = int(os.getenv("PDF_REDUCE_TOKEN_BUDGET", 6000))
+
+NO_INFO_MARKER = "SIN INFORMACIÓN RELEVANTE"
+
+MAP_PROMPT = (
+    "Eres un asistente experto en análisis de contenido. A continuación tienes un fragmento "
+    "de un documento ({source}). Responde a la consulta usando únicamente este fragmento. "
+    "Si el fragmento no contiene nada útil para la consulta, responde exactamente '" + NO_INFO_MARKER + "'.\n\n"
+    "Fragmento:\n{text}\n\n"
+    "Consulta: {query}\n\n"
+    "Respuesta parcial:"
+)
+
+REDUCE_PROMPT = (
+    "Eres un asistente experto en análisis de contenido. Tienes varias respuestas parciales "
+    "obtenidas de distintas partes de los documentos. Combínalas en una única respuesta clara, "
+    "completa y sin repeticiones para la consulta del usuario.\n\n"
+    "Respuestas parciales:\n{partials}\n\n"
+    "Consulta: {query}\n\n"
+    "Respuesta combinada:"
+)
+
+
+def _run_batch(llm, prompts: list, max_concurrency: int) -> list:
+    """
+    Ejecuta varios prompts en paralelo con un límite de concurrencia.
+
+    Returns:
+        list: Texto de cada respuesta, o la excepción si esa llamada falló (límite de
+            solicitudes, tiempo de espera...): un fallo no cancela las demás llamadas.
+    """
+    responses = llm.batch(prompts, config={"max_concurrency": max_concurrency}, return_exceptions=True)
+    return [response if isinstance(response, Exception) else response.content.strip() for response in responses]
+
+
+def _succeeded(results: list, phase: str) -> list:
+    """
+    Respuestas correctas de una ronda. Si fallaron todas se propaga el primer error.
+    """
+    failures = [result for result in results if isinstance(result, Exception)]
+    if failures:
+        logger.warning(f"Map-reduce: {len(failures)}/{len(results)} llamadas fallidas en la fase {phase}: "
+                       f"{str(failures[0])}")
+        if len(failures) == len(results):
+            raise failures[0]
+    return [result for result in results if not isinstance(result, Exception)]
+
+
+def pack_pages(documents, chunk_tokens: int = PDF_MAP_CHUNK_TOKENS):
+    """
+    Agrupa páginas consecutivas del mismo archivo en fragmentos de hasta `chunk_tokens` tokens
+    (los documentos llegan página a página, mucho más pequeños que un fragmento). Las páginas
+    que por sí solas superan el tamaño se dividen con chunk_documents.
+
+    Yields:
+        dict: {"text", "source", "tokens"} por fragmento.
+    """
+    group, used, name = [], 0, None
+
+    def packed():
+        labels = [doc.metadata.get("page_label") for doc, _ in group if doc.metadata.get("page_label")]
+        source = name
+        if labels:
+            source = f"{name}, página {labels[0]}" if len(labels) == 1 else f"{name}, páginas {labels[0]}-{labels[-1]}"
+        return {"text": "\n\n".join(doc.text for doc, _ in group), "source": source, "tokens": used}
+
+    for doc in documents:
+        doc_name = (doc.metadata or {}).get("file_name", "documento")
+        tokens = count_tokens(doc.text)
+        if group and (doc_name != name or used + tokens > chunk_tokens):
+            yield packed()
+            group, used = [], 0
+        if tokens > chunk_tokens:
+            yield from chunk_documents([doc], chunk_tokens=chunk_tokens, overlap=100)
+            continue
+        group.append((doc, tokens))
+        used += tokens
+        name = doc_name
+    if group:
+        yield packed()
+
+
+def _group_partials(partials: list, fanout: int, token_budget: int) -> list:
+    """
+    Agrupa respuestas parciales para la siguiente ronda de reducción respetando
+    el número máximo por grupo y el presupuesto de tokens (mínimo dos por grupo).
+    """
+    groups = []
+    current, used = [], 0
+    for partial in partials:
+        tokens = count_tokens(partial)
+        if len(current) >= 2 and (len(current) >= fanout or used + tokens > token_budget):
+            groups.append(current)
+            current, used = [], 0
+        current.append(partial)
+        used += tokens
+    if current:
+        groups.append(current)
+    return groups
+
+
+def map_reduce_analysis(documents, query: str, llm,
+                        chunk_tokens: int = PDF_MAP_CHUNK_TOKENS,
+                        max_concurrency: int = PDF_MAP_CONCURRENCY,
+                        fanout: int = PDF_REDUCE_FANOUT,
+                        token_budget: int = PDF_REDUCE_TOKEN_BUDGET) -> str:
+    """
+    Responde preguntas que requieren el documento completo (p. ej. resúmenes) dividiéndolo
+    en fragmentos, consultando cada fragmento en paralelo y reduciendo las respuestas
+    parciales de forma jerárquica.
+
+    Args:
+        documents (Iterable[Document]): Documentos cargados.
+        query (str): Consulta realizada por el usuario.
+        llm: Modelo de chat de LangChain.
+        chunk_tokens (int): Tamaño de cada fragmento de la fase map.
+        max_concurrency (int): Llamadas simultáneas máximas al LLM.
+        fanout (int): Respuestas parciales máximas por llamada de reducción.
+        token_budget (int): Tokens máximos de respuestas parciales por llamada de reducción.
+
+    Returns:
+        str: Respuesta final combinada.
+    """
+    chunks = list(pack_pages(documents, chunk_tokens=chunk_tokens))
+    if not chunks:
+        return "No se encontraron documentos para analizar."
+
+    # Fase map: una llamada por fragmento, en paralelo
+    logger.info(f"Map-reduce: {len(chunks)} fragmentos, concurrencia {max_concurrency}")
+    prompts = [MAP_PROMPT.format(source=chunk["source"], text=chunk["text"], query=query) for chunk in chunks]
+    results = _run_batch(llm, prompts, max_concurrency)
+    failed = sum(isinstance(result, Exception) for result in results)
+    # Se reduce sobre los fragmentos que sí se analizaron
+    partials = [
+        partial for partial in _succeeded(results, "map")
+        if NO_INFO_MARKER.lower() not in partial.lower()
+    ]
+    note = f"\n\n(No se pudieron analizar {failed} de {len(chunks)} fragmentos del documento.)" if failed else ""
+    if not partials:
+        return "No se encontró contenido relevante en los documentos para esta consulta." + note
+
+    # Fase reduce: combinar por grupos hasta obtener una sola respuesta
+    level = 0
+    while len(partials) > 1:
+        level += 1
+        groups = _group_partials(partials, fanout, token_budget)
+        logger.info(f"Map-reduce: nivel de reducción {level}, {len(partials)} parciales en {len(groups)} grupos")
+        prompts = [
+            REDUCE_PROMPT.format(
+                partials="\n\n".join(f"- {partial}" for partial in group),
+                query=query
+            )
+            for group in groups
+        ]
+        results = _run_batch(llm, prompts, max_concurrency)
+        _succeeded(results, "reduce")
+        # Las parciales de un grupo que falló pasan sin combinar a la siguiente ronda
+        partials = [
+            partial
+            for group, result in zip(groups, results)
+            for partial in (group if isinstance(result, Exception) else [result])
+        ]
+
+    return partials[0] + note
@@ -0,0 +1,223 @@
+from llama_index.core import Document
+from llama_index.core.readers import SimpleDirectoryReader
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
+from pathlib import Path
+from pypdf import PdfReader
+import atexit
+import logging
+import os
+import threading
+
+# Configurar logging
+logger = logging.getLogger('pdf_parsing')
+logger.setLevel(logging.INFO)
+
+# Configuración del motor de análisis
+PDF_PARSE_WORKERS = int(os.getenv("PDF_PARSE_WORKERS", os.cpu_count() or 2))
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", 25))
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    """
+    Pool de procesos compartido, creado al primer uso y cerrado al salir.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(max_workers=PDF_PARSE_WORKERS)
+            atexit.register(_executor.shutdown, wait=False)
+        return _executor
+
+
+def _page_metadata(path: Path, reader: PdfReader, page_number: int) -> dict:
+    # Mismos campos que produce el lector PDF de LlamaIndex
+    try:
+        label = reader.page_labels[page_number]
+    except (IndexError, KeyError, ValueError):
+        label = str(page_number + 1)
+    return {
+        "page_label": label,
+        "file_name": path.name,
+        "file_path": str(path),
+        "file_type": "application/pdf",
+    }
+
+
+def _parse_page_range(path: str, start: int, end: int) -> list:
+    """
+    Extrae el texto de un rango de páginas (se ejecuta en un proceso trabajador).
+
+    Returns:
+        list: [(texto, metadatos)] por página.
+    """
+    path = Path(path)
+    reader = PdfReader(str(path))
+    return [
+        (reader.pages[number].extract_text() or "", _page_metadata(path, reader, number))
+        for number in range(start, min(end, len(reader.pages)))
+    ]
+
+
+def _parse_other_file(path: str) -> list:
+    """
+    Archivos que no son PDF: se delegan a SimpleDirectoryReader.
+    """
+    documents = SimpleDirectoryReader(input_files=[path]).load_data()
+    return [(doc.text, doc.metadata) for doc in documents]
+
+
+def _count_pages(path: str) -> int:
+    """
+    Número de páginas de un PDF (se ejecuta en un proceso trabajador).
+    """
+    return len(PdfReader(path).pages)
+
+
+class _Done:
+    """
+    Resultado ya calculado con la misma interfaz que un Future (análisis en el propio proceso).
+    """
+
+    def __init__(self, func, *args):
+        try:
+            self._value, self._error = func(*args), None
+        except Exception as e:
+            self._value, self._error = None, e
+
+    def result(self):
+        if self._error is not None:
+            raise self._error
+        return self._value
+
+
+def iter_tasks(files, submit, pages_per_task: int = PDF_PAGES_PER_TASK, lookahead: int = 4):
+    """
+    Genera las tareas de análisis: los PDFs grandes se reparten por rangos de páginas.
+
+    Las páginas de cada PDF se cuentan en los procesos trabajadores, con `lookahead` archivos de
+    antelación, de modo que el análisis del primer archivo empieza sin esperar a abrir los demás.
+    Un archivo que no se puede abrir se registra y se omite.
+
+    Args:
+        submit (callable): submit(función, *args) -> Future.
+
+    Yields:
+        tuple: (ruta, función, argumentos, es_última_tarea_del_archivo)
+    """
+    files = iter(files)
+    counts = deque()
+
+    def request():
+        path = next(files, None)
+        if path is None:
+            return False
+        path = Path(path)
+        is_pdf = path.suffix.lower() == ".pdf"
+        counts.append((path, submit(_count_pages, str(path)) if is_pdf else None))
+        return True
+
+    while len(counts) < max(1, lookahead) and request():
+        pass
+
+    while counts:
+        path, counting = counts.popleft()
+        request()
+        if counting is None:
+            yield path, _parse_other_file, (str(path),), True
+            continue
+        try:
+            total = counting.result()
+        except Exception as e:
+            logger.error(f"No se pudo abrir el PDF {path.name}: {str(e)}")
+            continue
+        ranges = list(range(0, total, pages_per_task)) or [0]
+        for start in ranges:
+            is_last = start == ranges[-1]
+            yield path, _parse_page_range, (str(path), start, start + pages_per_task), is_last
+
+
+def iter_parsed_files(files, max_workers: int = PDF_PARSE_WORKERS,
+                      pages_per_task: int = PDF_PAGES_PER_TASK, on_file_complete=None):
+    """
+    Analiza los archivos en un pool de procesos y entrega las páginas a medida que llegan.
+
+    Las tareas se envían con una ventana acotada (2 por proceso) y se consumen en orden,
+    de modo que la memoria máxima depende del tamaño de la ventana y no del corpus. Los errores
+    de un archivo se registran y el archivo se omite (sin llamar a on_file_complete) sin
+    interrumpir el análisis de los demás.
+
+    Args:
+        files (Iterable[Path]): Archivos a analizar.
+        max_workers (int): Procesos simultáneos máximos.
+        pages_per_task (int): Páginas por tarea al dividir PDFs grandes.
+        on_file_complete (callable): Se llama con (ruta, documentos) al terminar cada archivo.
+
+    Yields:
+        Document: Un documento por página (o por archivo para formatos que no son PDF).
+    """
+    files = list(files)
+    if not files:
+        return
+
+    # Trabajo pequeño (un solo archivo de una sola tarea): analizar en el propio proceso
+    # evita el coste de los trabajadores
+    inline = max_workers <= 1
+    if not inline and len(files) == 1:
+        path = Path(files[0])
+        try:
+            inline = path.suffix.lower() != ".pdf" or _count_pages(str(path)) <= pages_per_task
+        except Exception:
+            # El error se registra al analizar el archivo
+            inline = True
+    executor = None if inline else _get_executor()
+
+    def submit(func, *args):
+        return _Done(func, *args) if inline else executor.submit(func, *args)
+
+    window = max(1, max_workers) * 2
+    pending = deque()
+    task_iter = iter_tasks(files, submit, pages_per_task, lookahead=window)
+    file_documents = []
+    failed = None
+
+    def submit_next():
+        task = next(task_iter, None)
+        if task is None:
+            return False
+        path, func, args, is_last = task
+        pending.append((path, submit(func, *args), is_last))
+        return True
+
+    while len(pending) < window and submit_next():
+        pass
+
+    while pending:
+        path, result, is_last = pending.popleft()
+        submit_next()
+        if failed != path:
+            try:
+                pages = result.result()
+            except Exception as e:
+                logger.error(f"Error al analizar {path.name}: {str(e)}")
+                # El resto del archivo se omite y no se guarda incompleto en la caché
+                failed, pages, file_documents = path, [], []
+
+        if failed != path:
+            for text, metadata in pages:
+                doc = Document(text=text, metadata=metadata)
+                if on_file_complete is not None:
+                    file_documents.append(doc)
+                yield doc
+
+        if is_last:
+            if failed == path:
+                failed = None
+            else:
+                logger.info(f"Archivo analizado: {path.name}")
+                if on_file_complete is not None:
+                    on_file_complete(path, file_documents)
+            file_documents = []
@@ -0,0 +1,132 @@
+from collections import Counter
+from functools import lru_cache
+import math
+import os
+import re
+import unicodedata
+import tiktoken
+
+# Configuración del modo de recuperación acotada
+PDF_ANALYSIS_MODE = os.getenv("PDF_ANALYSIS_MODE", "full")           # full | retrieval
+PDF_CHUNK_TOKENS = int(os.getenv("PDF_CHUNK_TOKENS", 400))
+PDF_CHUNK_OVERLAP = int(os.getenv("PDF_CHUNK_OVERLAP", 50))
+PDF_RETRIEVAL_TOP_K = int(os.getenv("PDF_RETRIEVAL_TOP_K", 8))
+PDF_CONTEXT_TOKEN_BUDGET = int(os.getenv("PDF_CONTEXT_TOKEN_BUDGET", 6000))
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+
+@lru_cache(maxsize=1)
+def _encoding():
+    # Se carga al usarse por primera vez: importar el módulo no descarga el vocabulario
+    return tiktoken.get_encoding("cl100k_base")
+
+
+def count_tokens(text: str) -> int:
+    return len(_encoding().encode(text, disallowed_special=()))
+
+
+def tokenize_terms(text: str) -> list:
+    """
+    Normaliza el texto (minúsculas y sin acentos) y lo separa en términos para BM25.
+    """
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    return _WORD_RE.findall(text)
+
+
+def chunk_documents(documents, chunk_tokens: int = PDF_CHUNK_TOKENS, overlap: int = PDF_CHUNK_OVERLAP):
+    """
+    Divide los documentos en fragmentos de tamaño fijo en tokens, con solapamiento.
+
+    Args:
+        documents (Iterable[Document]): Documentos cargados (puede ser un generador).
+        chunk_tokens (int): Tamaño de cada fragmento en tokens.
+        overlap (int): Tokens compartidos entre fragmentos consecutivos.
+
+    Yields:
+        dict: {"text", "source", "tokens"} por fragmento.
+    """
+    step = max(1, chunk_tokens - overlap)
+    for doc in documents:
+        metadata = doc.metadata or {}
+        source = metadata.get("file_name", "documento")
+        if metadata.get("page_label"):
+            source = f"{source}, página {metadata['page_label']}"
+
+        tokens = _encoding().encode(doc.text, disallowed_special=())
+        for start in range(0, max(len(tokens), 1), step):
+            window = tokens[start:start + chunk_tokens]
+            if not window:
+                break
+            yield {"text": _encoding().decode(window), "source": source, "tokens": len(window)}
+            if start + chunk_tokens >= len(tokens):
+                break
+
+
+class BM25Index:
+    """
+    Índice léxico BM25 en memoria sobre los fragmentos de los PDFs.
+    """
+
+    def __init__(self, chunks, k1: float = 1.5, b: float = 0.75):
+        self.chunks = list(chunks)
+        self.k1 = k1
+        self.b = b
+        self.term_freqs = [Counter(tokenize_terms(chunk["text"])) for chunk in self.chunks]
+        self.lengths = [sum(freqs.values()) for freqs in self.term_freqs]
+        self.avg_length = (sum(self.lengths) / len(self.lengths)) if self.lengths else 0.0
+
+        document_freqs = Counter()
+        for freqs in self.term_freqs:
+            document_freqs.update(freqs.keys())
+        total = len(self.chunks)
+        self.idf = {
+            term: math.log(1 + (total - freq + 0.5) / (freq + 0.5))
+            for term, freq in document_freqs.items()
+        }
+
+    def search(self, query: str, top_k: int = PDF_RETRIEVAL_TOP_K) -> list:
+        """
+        Devuelve los fragmentos mejor puntuados para la consulta, de mayor a menor relevancia.
+        """
+        terms = [term for term in set(tokenize_terms(query)) if term in self.idf]
+        if not terms or not self.chunks:
+            return []
+
+        scores = []
+        for position, freqs in enumerate(self.term_freqs):
+            norm = self.k1 * (1 - self.b + self.b * self.lengths[position] / (self.avg_length or 1))
+            score = 0.0
+            for term in terms:
+                freq = freqs.get(term, 0)
+                if freq:
+                    score += self.idf[term] * freq * (self.k1 + 1) / (freq + norm)
+            if score > 0:
+                scores.append((score, position))
+
+        scores.sort(reverse=True)
+        return [self.chunks[position] for _, position in scores[:top_k]]
+
+
+def select_relevant_chunks(documents, query: str, top_k: int = PDF_RETRIEVAL_TOP_K,
+                           token_budget: int = PDF_CONTEXT_TOKEN_BUDGET) -> list:
+    """
+    Selecciona los fragmentos más relevantes para la consulta sin superar el presupuesto de tokens.
+    """
+    index = BM25Index(chunk_documents(documents))
+    selected = []
+    used = 0
+    for chunk in index.search(query, top_k=top_k):
+        if used + chunk["tokens"] > token_budget:
+            continue
+        selected.append(chunk)
+        used += chunk["tokens"]
+    return selected
+
+
+def format_chunks(chunks: list) -> str:
+    """
+    Formatea los fragmentos seleccionados indicando su origen.
+    """
+    return "\n\n".join(f"[{chunk['source']}]\n{chunk['text']}" for chunk in chunks)
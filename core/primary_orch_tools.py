@@ -6,6 +6,7 @@ import dotenv
 from .generation_orch_tool import handle_generation
 from .vector_orch_library import query_vector_library
 from .pdf_orch_tool import analyze_pdf_content, load_pdfs_from_directory  # Nueva importación
+from .pdf_retrieval import PDF_ANALYSIS_MODE
 
 
 # Cargar las variables de entorno desde .env
@@ -69,7 +70,8 @@ def pdf_analysis_tool(query: str) -> str:
 
     # Cargar los documentos y procesar la consulta
     try:
-        documents = load_pdfs_from_directory(PDF_DIR)
+        # Los modos por fragmentos consumen las páginas en streaming mientras se analizan los PDFs
+        documents = load_pdfs_from_directory(PDF_DIR, stream=PDF_ANALYSIS_MODE != "full")
         response = analyze_pdf_content(documents, query)
         return response
     except ValueError as e:
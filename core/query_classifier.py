@@ -0,0 +1,261 @@
+from pathlib import Path
+import json
+import logging
+import os
+import re
+import threading
+import unicodedata
+import zlib
+import numpy as np
+
+# Configurar logging
+logger = logging.getLogger('query_classifier')
+logger.setLevel(logging.INFO)
+
+# Datos de entrenamiento y modelos (storage/ en la raíz del proyecto)
+PROJECT_ROOT = Path(__file__).parent.parent
+CLASSIFIER_DIR = PROJECT_ROOT / "storage" / "classifier"
+
+# Tareas de clasificación: orquestador (general/técnica) y router (cinco categorías)
+TASKS = ("orchestrator", "router")
+
+LOCAL_CLASSIFIER_ENABLED = os.getenv("LOCAL_CLASSIFIER_ENABLED", "true").lower() == "true"
+LOCAL_CLASSIFIER_THRESHOLD = float(os.getenv("LOCAL_CLASSIFIER_THRESHOLD", 0.85))
+FEATURE_DIM = 2 ** 18
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+_SPACE_RE = re.compile(r"\s+")
+
+
+def normalize_query(text: str) -> str:
+    """
+    Normaliza una consulta: minúsculas, sin acentos y con los espacios colapsados.
+    """
+    text = unicodedata.normalize("NFKD", text.casefold())
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    return _SPACE_RE.sub(" ", text).strip()
+
+
+def _features(text: str, dim: int = FEATURE_DIM) -> tuple:
+    """
+    N-gramas hasheados (palabras, bigramas y trigramas de caracteres por palabra).
+
+    Returns:
+        tuple: (índices, valores) de un vector disperso normalizado.
+    """
+    words = _WORD_RE.findall(normalize_query(text))
+    grams = [f"w:{word}" for word in words]
+    grams += [f"b:{a} {b}" for a, b in zip(words, words[1:])]
+    for word in words:
+        padded = f"<{word}>"
+        grams += [f"c:{padded[i:i + 3]}" for i in range(len(padded) - 2)]
+
+    counts = {}
+    for gram in grams:
+        index = zlib.crc32(gram.encode("utf-8")) % dim
+        counts[index] = counts.get(index, 0.0) + 1.0
+    if not counts:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+
+    indices = np.fromiter(counts.keys(), dtype=np.int64)
+    values = np.fromiter(counts.values(), dtype=np.float32)
+    values /= np.linalg.norm(values)
+    return indices, values
+
+
+class LocalClassifier:
+    """
+    Clasificador lineal (regresión logística multinomial) sobre n-gramas hasheados.
+    Responde en microsegundos y devuelve la confianza de su predicción.
+    """
+
+    def __init__(self, classes: list, weights=None, bias=None, dim: int = FEATURE_DIM):
+        self.classes = list(classes)
+        self.dim = dim
+        self.weights = weights if weights is not None else np.zeros((dim, len(self.classes)), dtype=np.float32)
+        self.bias = bias if bias is not None else np.zeros(len(self.classes), dtype=np.float32)
+
+    def _scores(self, indices, values):
+        logits = values @ self.weights[indices] + self.bias
+        logits = logits - logits.max()
+        probabilities = np.exp(logits)
+        return probabilities / probabilities.sum()
+
+    def predict(self, query: str) -> tuple:
+        """
+        Returns:
+            tuple: (etiqueta, confianza)
+        """
+        probabilities = self._scores(*_features(query, self.dim))
+        best = int(np.argmax(probabilities))
+        return self.classes[best], float(probabilities[best])
+
+    @classmethod
+    def train(cls, examples: list, epochs: int = 20, learning_rate: float = 0.5,
+              l2: float = 1e-6, dim: int = FEATURE_DIM, seed: int = 0):
+        """
+        Entrena el modelo con descenso de gradiente estocástico.
+
+        Args:
+            examples (list): [(consulta, etiqueta)].
+
+        Raises:
+            ValueError: Si los ejemplos tienen menos de dos clases. Un modelo de una sola clase
+                respondería siempre esa clase con confianza 1.0 y el LLM nunca se consultaría.
+        """
+        classes = sorted({label for _, label in examples})
+        if len(classes) < 2:
+            raise ValueError(
+                f"Se necesitan ejemplos de al menos dos clases para entrenar (clases: {', '.join(classes) or 'ninguna'})."
+            )
+        model = cls(classes, dim=dim)
+
+        label_index = {label: position for position, label in enumerate(classes)}
+        samples = [(_features(query, dim), label_index[label]) for query, label in examples]
+        rng = np.random.default_rng(seed)
+
+        for epoch in range(epochs):
+            rate = learning_rate / (1 + epoch)
+            for position in rng.permutation(len(samples)):
+                (indices, values), target = samples[position]
+                gradient = model._scores(indices, values)
+                gradient[target] -= 1.0
+                model.weights[indices] -= rate * (np.outer(values, gradient) + l2 * model.weights[indices])
+                model.bias -= rate * gradient
+        return model
+
+    def save(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Solo se guardan las filas con pesos para que el archivo sea pequeño
+        rows = np.flatnonzero(np.any(self.weights != 0, axis=1))
+        with open(path, "wb") as f:
+            np.savez_compressed(
+                f, rows=rows, weights=self.weights[rows], bias=self.bias,
+                classes=np.array(self.classes), dim=np.array(self.dim)
+            )
+
+    @classmethod
+    def load(cls, path: Path):
+        with np.load(path, allow_pickle=False) as data:
+            dim = int(data["dim"])
+            weights = np.zeros((dim, len(data["classes"])), dtype=np.float32)
+            weights[data["rows"]] = data["weights"]
+            return cls([str(label) for label in data["classes"]], weights, data["bias"], dim)
+
+
+def examples_path(task: str) -> Path:
+    return CLASSIFIER_DIR / f"{task}_examples.jsonl"
+
+
+def model_path(task: str) -> Path:
+    return CLASSIFIER_DIR / f"{task}_model.npz"
+
+
+def record_example(task: str, query: str, label: str):
+    """
+    Registra la decisión tomada por el LLM como ejemplo de entrenamiento.
+    """
+    try:
+        CLASSIFIER_DIR.mkdir(parents=True, exist_ok=True)
+        line = json.dumps({"query": query, "label": label}, ensure_ascii=False) + "\n"
+        with open(examples_path(task), "a", encoding="utf-8") as f:
+            f.write(line)
+    except OSError as e:
+        logger.error(f"No se pudo registrar el ejemplo de clasificación: {str(e)}")
+
+
+def load_examples(task: str) -> list:
+    path = examples_path(task)
+    if not path.exists():
+        return []
+    examples = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                item = json.loads(line)
+                examples.append((item["query"], item["label"]))
+            except (ValueError, KeyError):
+                continue
+    return examples
+
+
+def train_task(task: str) -> dict:
+    """
+    Entrena y guarda el modelo de una tarea a partir de los ejemplos registrados.
+
+    Returns:
+        dict: Resumen con ejemplos, clases y exactitud sobre los propios datos.
+    """
+    examples = load_examples(task)
+    if not examples:
+        raise ValueError(f"No hay ejemplos registrados para la tarea '{task}'.")
+
+    model = LocalClassifier.train(examples)
+    model.save(model_path(task))
+    _registry.invalidate(task)
+
+    correct = sum(1 for query, label in examples if model.predict(query)[0] == label)
+    return {
+        "task": task,
+        "examples": len(examples),
+        "classes": model.classes,
+        "accuracy": correct / len(examples),
+    }
+
+
+class _ClassifierRegistry:
+    """
+    Modelos cargados en memoria; se recargan si el archivo del modelo cambia.
+    """
+
+    def __init__(self):
+        self._models = {}
+        self._lock = threading.Lock()
+
+    def get(self, task: str):
+        path = model_path(task)
+        try:
+            mtime = path.stat().st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+        entry = self._models.get(task)
+        if entry and entry[0] == mtime:
+            return entry[1]
+        with self._lock:
+            try:
+                model = LocalClassifier.load(path)
+            except Exception as e:
+                logger.error(f"No se pudo cargar el clasificador '{task}': {str(e)}")
+                return None
+            if len(model.classes) < 2:
+                # Modelo degenerado (versiones anteriores lo guardaban): se ignora y decide el LLM
+                logger.error(f"El clasificador '{task}' tiene una sola clase; se ignora hasta volver a entrenarlo")
+                model = None
+            self._models[task] = (mtime, model)
+            return model
+
+    def invalidate(self, task: str):
+        with self._lock:
+            self._models.pop(task, None)
+
+
+_registry = _ClassifierRegistry()
+
+
+def classify_locally(task: str, query: str, threshold: float = LOCAL_CLASSIFIER_THRESHOLD):
+    """
+    Clasifica con el modelo local. Devuelve None si no hay modelo o si la confianza
+    no alcanza el umbral, en cuyo caso se debe consultar al LLM.
+    """
+    if not LOCAL_CLASSIFIER_ENABLED:
+        return None
+    model = _registry.get(task)
+    if model is None:
+        return None
+    label, confidence = model.predict(query)
+    if confidence < threshold:
+        logger.info(f"Clasificador local ({task}) sin confianza suficiente: {label} ({confidence:.2f})")
+        return None
+    logger.info(f"Clasificador local ({task}): {label} ({confidence:.2f})")
+    return label
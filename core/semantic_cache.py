@@ -0,0 +1,190 @@
+from langchain_openai import OpenAIEmbeddings
+from collections import OrderedDict
+from itertools import count
+import logging
+import os
+import threading
+import time
+import numpy as np
+
+# Configurar logging
+logger = logging.getLogger('semantic_cache')
+logger.setLevel(logging.INFO)
+
+# Caché semántica de las respuestas del router/agentes (opcional)
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "false").lower() == "true"
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", 0.95))
+SEMANTIC_CACHE_TTL = float(os.getenv("SEMANTIC_CACHE_TTL", 86400))
+SEMANTIC_CACHE_SIZE = int(os.getenv("SEMANTIC_CACHE_SIZE", 2000))
+# Embeddings recientes en memoria para no volver a calcularlos al guardar la respuesta
+EMBEDDING_MEMO_SIZE = 256
+
+
+class SemanticCache:
+    """
+    Caché de respuestas del router indexada por el embedding de la consulta refinada.
+
+    Solo guarda la salida de la herramienta o el agente, que depende únicamente de la consulta
+    refinada; la síntesis final usa el historial de cada conversación y no se cachea.
+
+    Cada entrada pertenece a un ámbito (la categoría del router: embeddings, pdf, agent_one, ...)
+    y solo se compara con consultas del mismo ámbito. Una consulta reutiliza la respuesta de la
+    entrada más parecida si la similitud coseno alcanza el umbral. Las entradas expiran tras
+    `ttl` segundos y, al superar `maxsize`, se descartan las menos usadas.
+
+    Los embeddings viven en una matriz preasignada de `maxsize` filas: una búsqueda es un único
+    producto matriz-vector sobre las filas ocupadas, sin reconstruir la matriz en cada consulta.
+    """
+
+    def __init__(self, threshold: float = SEMANTIC_CACHE_THRESHOLD, ttl: float = SEMANTIC_CACHE_TTL,
+                 maxsize: int = SEMANTIC_CACHE_SIZE, embeddings=None):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.maxsize = max(1, maxsize)
+        self._embeddings = embeddings
+        # Orden LRU de las entradas: clave -> {"slot", "scope", "query", "response"}
+        self._entries = OrderedDict()
+        self._vectors = None
+        self._expires = np.zeros(self.maxsize)
+        self._scopes = np.full(self.maxsize, -1, dtype=np.int32)
+        self._scope_codes = {}
+        self._slot_keys = [None] * self.maxsize
+        self._free = list(range(self.maxsize - 1, -1, -1))
+        self._used = 0
+        self._memo = OrderedDict()
+        self._ids = count()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    @property
+    def embeddings(self):
+        if self._embeddings is None:
+            self._embeddings = OpenAIEmbeddings(api_key=os.getenv("OPENAI_API_KEY"))
+        return self._embeddings
+
+    @staticmethod
+    def _normalize(vector) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _memoized(self, text: str):
+        with self._lock:
+            vector = self._memo.get(text)
+            if vector is not None:
+                self._memo.move_to_end(text)
+            return vector
+
+    def _remember(self, text: str, vector: np.ndarray):
+        with self._lock:
+            self._memo[text] = vector
+            while len(self._memo) > EMBEDDING_MEMO_SIZE:
+                self._memo.popitem(last=False)
+
+    def _embed(self, text: str) -> np.ndarray:
+        vector = self._memoized(text)
+        if vector is None:
+            vector = self._normalize(self.embeddings.embed_query(text))
+            self._remember(text, vector)
+        return vector
+
+    async def _aembed(self, text: str) -> np.ndarray:
+        vector = self._memoized(text)
+        if vector is None:
+            vector = self._normalize(await self.embeddings.aembed_query(text))
+            self._remember(text, vector)
+        return vector
+
+    def _evict(self, key):
+        # Con el lock tomado: libera la fila de la entrada
+        slot = self._entries.pop(key)["slot"]
+        self._scopes[slot] = -1
+        self._slot_keys[slot] = None
+        self._free.append(slot)
+
+    def _search(self, scope: str, vector: np.ndarray):
+        now = time.monotonic()
+        with self._lock:
+            best_key, best_score = None, -1.0
+            code = self._scope_codes.get(scope)
+            if self._vectors is not None and code is not None:
+                used = self._used
+                expired = np.flatnonzero((self._scopes[:used] >= 0) & (self._expires[:used] <= now))
+                for slot in expired:
+                    self._evict(self._slot_keys[slot])
+
+                candidates = self._scopes[:used] == code
+                if candidates.any():
+                    scores = np.where(candidates, self._vectors[:used] @ vector, -np.inf)
+                    position = int(np.argmax(scores))
+                    best_key, best_score = self._slot_keys[position], float(scores[position])
+
+            if best_key is not None and best_score >= self.threshold:
+                self._entries.move_to_end(best_key)
+                self._hits += 1
+                entry = self._entries[best_key]
+                logger.info(f"Caché semántica ({scope}): acierto con similitud {best_score:.3f}")
+                return entry["response"]
+            self._misses += 1
+            return None
+
+    def _insert(self, scope: str, text: str, vector: np.ndarray, response: str):
+        with self._lock:
+            if self._vectors is None:
+                self._vectors = np.zeros((self.maxsize, vector.shape[0]), dtype=np.float32)
+            if not self._free:
+                # Se descarta la entrada menos usada
+                self._evict(next(iter(self._entries)))
+            slot = self._free.pop()
+            key = next(self._ids)
+            self._vectors[slot] = vector
+            self._expires[slot] = time.monotonic() + self.ttl
+            self._scopes[slot] = self._scope_codes.setdefault(scope, len(self._scope_codes))
+            self._slot_keys[slot] = key
+            self._used = max(self._used, slot + 1)
+            self._entries[key] = {"slot": slot, "scope": scope, "query": text, "response": response}
+
+    def lookup(self, scope: str, text: str):
+        """
+        Devuelve la respuesta cacheada más parecida del ámbito, o None si ninguna alcanza el umbral.
+        """
+        return self._search(scope, self._embed(text))
+
+    async def alookup(self, scope: str, text: str):
+        """Versión asíncrona de lookup."""
+        return self._search(scope, await self._aembed(text))
+
+    def store(self, scope: str, text: str, response: str):
+        """
+        Guarda la respuesta de una consulta (reutiliza el embedding calculado en lookup).
+        """
+        self._insert(scope, text, self._embed(text), response)
+
+    async def astore(self, scope: str, text: str, response: str):
+        """Versión asíncrona de store."""
+        self._insert(scope, text, await self._aembed(text), response)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._memo.clear()
+            self._scopes[:] = -1
+            self._slot_keys = [None] * self.maxsize
+            self._free = list(range(self.maxsize - 1, -1, -1))
+            self._used = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "enabled": SEMANTIC_CACHE_ENABLED,
+                "size": len(self._entries),
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": round(self._hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+# Caché única por proceso
+semantic_cache = SemanticCache()
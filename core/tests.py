@@ -1,3 +1,1183 @@
-from django.test import TestCase
+from contextlib import contextmanager
+from django.test import SimpleTestCase
+from multiprocessing import get_context
+import os
+import tempfile
+import time
 
-# Create your tests here.
+PROCESSES = 8
+MESSAGES_PER_PROCESS = 40
+CONVERSATIONS = 3
+
+
+def _open_store(backend_name, directory):
+    from db.backends import TinyDBBackend, SQLiteBackend
+    from db.jsonl_backend import JsonlBackend
+    from db.locking import ConversationLocks
+    from db.sharding import ShardedBackend
+    from db.tinydb_manager import ConversationManager
+
+    if backend_name == "tinydb":
+        backend = TinyDBBackend(os.path.join(directory, "conversations.json"))
+    elif backend_name == "sqlite":
+        backend = SQLiteBackend(os.path.join(directory, "conversations.sqlite3"))
+    elif backend_name == "sharded":
+        backend = ShardedBackend("sqlite", 4, os.path.join(directory, "shards"))
+    else:
+        backend = JsonlBackend(os.path.join(directory, "log"))
+    locks = ConversationLocks(os.path.join(directory, "locks"), across_processes=True)
+    return ConversationManager(backend=backend, write_behind=False, locks=locks)
+
+
+def _hammer(backend_name, directory, worker):
+    # Cada proceso escribe en todas las conversaciones y repite la misma respuesta del sistema
+    manager = _open_store(backend_name, directory)
+    for number in range(MESSAGES_PER_PROCESS):
+        conversation_id = f"conversation-{number % CONVERSATIONS}"
+        manager.add_message(conversation_id, "user", f"worker-{worker}-message-{number}")
+        manager.add_message(conversation_id, "system", "respuesta compartida")
+
+
+class ConversationStoreMultiProcessTests(SimpleTestCase):
+    """
+    Varios procesos escriben a la vez en las mismas conversaciones: no se pierde ningún mensaje
+    y la respuesta repetida del sistema se guarda una sola vez por conversación.
+    """
+
+    def _run(self, backend_name):
+        with tempfile.TemporaryDirectory() as directory:
+            context = get_context("spawn")
+            processes = [
+                context.Process(target=_hammer, args=(backend_name, directory, worker))
+                for worker in range(PROCESSES)
+            ]
+            for process in processes:
+                process.start()
+            for process in processes:
+                process.join(timeout=300)
+                self.assertEqual(process.exitcode, 0)
+
+            manager = _open_store(backend_name, directory)
+            user_messages = []
+            for index in range(CONVERSATIONS):
+                messages = manager.get_conversation(f"conversation-{index}")["messages"]
+                user_messages += [msg["message"] for msg in messages if msg["sender"] == "user"]
+                system_messages = [msg for msg in messages if msg["sender"] == "system"]
+                self.assertEqual(len(system_messages), 1)
+
+            expected = {
+                f"worker-{worker}-message-{number}"
+                for worker in range(PROCESSES) for number in range(MESSAGES_PER_PROCESS)
+            }
+            self.assertEqual(len(user_messages), len(expected))
+            self.assertEqual(set(user_messages), expected)
+
+    def test_tinydb_backend(self):
+        self._run("tinydb")
+
+    def test_sqlite_backend(self):
+        self._run("sqlite")
+
+    def test_jsonl_backend(self):
+        self._run("jsonl")
+
+    def test_sharded_backend(self):
+        self._run("sharded")
+
+
+class ConversationArchiveTests(SimpleTestCase):
+    """
+    Las conversaciones inactivas pasan al archivo comprimido y vuelven al consultarlas.
+    """
+
+    def test_archive_and_restore(self):
+        from db.archive import ConversationArchive, archive_conversations
+
+        with tempfile.TemporaryDirectory() as directory:
+            manager = _open_store("sqlite", directory)
+            manager.archive = ConversationArchive(os.path.join(directory, "archive"))
+            manager.add_message("cold", "user", "pregunta antigua")
+            manager.add_message("cold", "system", "respuesta antigua")
+            manager.add_message("hot", "user", "pregunta reciente")
+
+            # Se envejece la conversación fría
+            cold = manager.backend.get("cold")
+            for message in cold["messages"]:
+                message["timestamp"] = time.time() - 40 * 24 * 60 * 60
+            manager.backend.put(cold)
+
+            result = archive_conversations(
+                inactive_days=30, backend=manager.backend, archive=manager.archive, locks=manager.locks
+            )
+            self.assertEqual(result, {"archived": 1, "kept": 1})
+            self.assertIsNone(manager.backend.get("cold"))
+
+            manager.add_message("cold", "system", "respuesta antigua")
+            manager.add_message("cold", "user", "nueva pregunta")
+            messages = [msg["message"] for msg in manager.get_conversation("cold")["messages"]]
+            self.assertEqual(messages, ["pregunta antigua", "respuesta antigua", "nueva pregunta"])
+            self.assertIsNone(manager.archive.get("cold"))
+
+            archive_conversations(inactive_days=30, backend=manager.backend, archive=manager.archive,
+                                  locks=manager.locks)
+            self.assertEqual(manager.get_conversation("hot")["messages"][0]["message"], "pregunta reciente")
+            manager.archive.close()
+            manager.backend.close()
+
+
+    def test_archive_in_batches(self):
+        from unittest import mock
+        from tinydb.storages import JSONStorage
+        from db.archive import ConversationArchive, archive_conversations
+
+        with tempfile.TemporaryDirectory() as directory:
+            manager = _open_store("tinydb", directory)
+            archive = ConversationArchive(os.path.join(directory, "archive"), segment_size=600)
+            old = time.time() - 40 * 24 * 60 * 60
+            for number in range(10):
+                manager.backend.put({"conversation_id": f"c{number}", "messages": [
+                    {"sender": "user", "message": f"pregunta {number}", "timestamp": old}
+                ]})
+            manager.add_message("hot", "user", "pregunta reciente")
+
+            with mock.patch.object(JSONStorage, "write", autospec=True, side_effect=JSONStorage.write) as write:
+                result = archive_conversations(inactive_days=30, backend=manager.backend, archive=archive,
+                                               locks=manager.locks, batch_size=4)
+            self.assertEqual(result, {"archived": 10, "kept": 1})
+            # Una reescritura del archivo de TinyDB por lote
+            self.assertEqual(write.call_count, 3)
+            self.assertEqual([conversation["conversation_id"] for conversation in manager.backend.iter_conversations()],
+                             ["hot"])
+            self.assertGreater(archive.stats()["segments"], 1)
+            for number in range(10):
+                self.assertEqual(archive.get(f"c{number}")["messages"][0]["message"], f"pregunta {number}")
+            archive.close()
+            manager.backend.close()
+
+    def test_refuses_with_write_behind(self):
+        from unittest import mock
+        from db.archive import ConversationArchive, archive_conversations
+
+        with tempfile.TemporaryDirectory() as directory:
+            manager = _open_store("sqlite", directory)
+            archive = ConversationArchive(os.path.join(directory, "archive"))
+            with mock.patch("db.tinydb_manager.CONVERSATION_WRITE_BEHIND", True):
+                with self.assertRaises(RuntimeError):
+                    archive_conversations(backend=manager.backend, archive=archive, locks=manager.locks)
+                result = archive_conversations(backend=manager.backend, archive=archive, locks=manager.locks,
+                                               force=True)
+            self.assertEqual(result, {"archived": 0, "kept": 0})
+            manager.backend.close()
+
+
+
+class JsonlTornTailTests(SimpleTestCase):
+    """
+    Un anexado no se pega a una última línea que quedó sin terminar.
+    """
+
+    def test_append_after_torn_line(self):
+        from db.jsonl_backend import JsonlBackend
+
+        with tempfile.TemporaryDirectory() as directory:
+            backend = JsonlBackend(os.path.join(directory, "log"))
+            backend.create("c1")
+            backend.append_message("c1", {"sender": "user", "message": "uno"})
+            with open(backend._path("c1"), "a", encoding="utf-8") as f:
+                f.write('{"op": "message", "message": {"sender": "sys')
+            backend.append_message("c1", {"sender": "user", "message": "dos"})
+            self.assertEqual([msg["message"] for msg in backend.get("c1")["messages"]], ["uno", "dos"])
+
+            # Registro completo al que solo le falta el salto de línea: se conserva
+            with open(backend._path("c1"), "a", encoding="utf-8") as f:
+                f.write('{"op": "message", "message": {"sender": "user", "message": "tres"}}')
+            backend.append_message("c1", {"sender": "user", "message": "cuatro"})
+            self.assertEqual([msg["message"] for msg in backend.get("c1")["messages"]],
+                             ["uno", "dos", "tres", "cuatro"])
+
+
+class AgentPoolTests(SimpleTestCase):
+    """
+    Las solicitudes asíncronas en espera no ocupan hilos del executor que usan los agentes prestados.
+    """
+
+    def test_waiters_do_not_exhaust_executor(self):
+        import asyncio
+        from concurrent.futures import ThreadPoolExecutor
+        from core.agent_pool import AgentPool
+
+        class Agent:
+            def handle_query(self, query):
+                time.sleep(0.005)
+                return query
+
+        pool = AgentPool("test", Agent, size=2)
+
+        async def request(number):
+            async with pool.aborrow() as agent:
+                return await asyncio.get_running_loop().run_in_executor(None, agent.handle_query, number)
+
+        async def main():
+            asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(2))
+            return await asyncio.wait_for(asyncio.gather(*[request(number) for number in range(50)]), 30)
+
+        self.assertEqual(asyncio.run(main()), list(range(50)))
+        stats = pool.stats()
+        self.assertEqual((stats["created"], stats["in_use"], stats["borrows"]), (2, 0, 50))
+
+    def test_timeout_returns_agent_to_pool(self):
+        import asyncio
+        from core.agent_pool import AgentPool
+
+        pool = AgentPool("test", object, size=1)
+
+        async def main():
+            async with pool.aborrow():
+                with self.assertRaises(asyncio.TimeoutError):
+                    async with pool.aborrow(timeout=0.01):
+                        pass
+            async with pool.aborrow(timeout=1) as agent:
+                return agent
+
+        self.assertIsNotNone(asyncio.run(main()))
+        self.assertEqual(pool.stats()["in_use"], 0)
+
+
+class FakeEmbeddings:
+    """
+    Embeddings fijos por texto para las pruebas de la caché semántica.
+    """
+
+    VECTORS = {
+        "instalar paquete": [1.0, 0.0, 0.0],
+        "cómo instalo un paquete": [0.99, 0.1, 0.0],
+        "borrar archivo": [0.0, 1.0, 0.0],
+        "leer pdf": [0.0, 0.0, 1.0],
+    }
+
+    def embed_query(self, text):
+        return self.VECTORS[text]
+
+    async def aembed_query(self, text):
+        return self.VECTORS[text]
+
+
+class SemanticCacheTests(SimpleTestCase):
+
+    def _cache(self, **kwargs):
+        from core.semantic_cache import SemanticCache
+        return SemanticCache(threshold=0.95, embeddings=FakeEmbeddings(), **kwargs)
+
+    def test_similar_query_hits_within_scope(self):
+        cache = self._cache()
+        cache.store("agent_one", "instalar paquete", "usa apt install")
+        self.assertEqual(cache.lookup("agent_one", "cómo instalo un paquete"), "usa apt install")
+        self.assertIsNone(cache.lookup("agent_two", "cómo instalo un paquete"))
+        self.assertIsNone(cache.lookup("agent_one", "borrar archivo"))
+        self.assertEqual((cache.stats()["hits"], cache.stats()["misses"]), (1, 2))
+
+    def test_entries_expire(self):
+        cache = self._cache(ttl=0.05)
+        cache.store("pdf", "leer pdf", "resumen")
+        self.assertEqual(cache.lookup("pdf", "leer pdf"), "resumen")
+        time.sleep(0.1)
+        self.assertIsNone(cache.lookup("pdf", "leer pdf"))
+        self.assertEqual(cache.stats()["size"], 0)
+
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = self._cache(maxsize=2)
+        cache.store("agent_one", "instalar paquete", "apt")
+        cache.store("agent_one", "borrar archivo", "rm")
+        cache.lookup("agent_one", "instalar paquete")
+        cache.store("pdf", "leer pdf", "resumen")
+        self.assertEqual(cache.stats()["size"], 2)
+        self.assertEqual(cache.lookup("agent_one", "instalar paquete"), "apt")
+        self.assertIsNone(cache.lookup("agent_one", "borrar archivo"))
+        self.assertEqual(cache.lookup("pdf", "leer pdf"), "resumen")
+
+
+class SQLiteTransactionTests(SimpleTestCase):
+
+    def test_failed_write_is_rolled_back(self):
+        from db.backends import SQLiteBackend
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "conversations.sqlite3")
+            backend = SQLiteBackend(path)
+            backend.create("c1")
+            with self.assertRaises(TypeError):
+                backend.update_fields("c1", {"summary": object()})
+            self.assertFalse(backend._conn.in_transaction)
+
+            # La misma conexión y otra conexión (otro worker) pueden seguir escribiendo
+            backend.update_fields("c1", {"summary": "ok"})
+            other = SQLiteBackend(path)
+            other._conn.execute("PRAGMA busy_timeout = 100")
+            other.delete("c1")
+            self.assertIsNone(backend.get("c1"))
+            other.close()
+            backend.close()
+
+
+class LocalClassifierTests(SimpleTestCase):
+
+    EXAMPLES = [
+        ("hola, ¿cómo estás?", "general"),
+        ("buenos días", "general"),
+        ("¿qué opinas del clima?", "general"),
+        ("cuéntame un chiste", "general"),
+        ("cómo listo procesos en linux", "técnica"),
+        ("error de importación en pandas", "técnica"),
+        ("configurar ssh en ubuntu", "técnica"),
+        ("cómo uso numpy para multiplicar matrices", "técnica"),
+    ]
+
+    def setUp(self):
+        from unittest import mock
+        from pathlib import Path
+
+        self.directory = tempfile.TemporaryDirectory()
+        patcher = mock.patch("core.query_classifier.CLASSIFIER_DIR", Path(self.directory.name))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.directory.cleanup)
+
+    def _record(self, examples):
+        from core.query_classifier import record_example
+        for query, label in examples:
+            record_example("orchestrator", query, label)
+
+    def test_training_separates_classes(self):
+        from core.query_classifier import train_task
+
+        self._record(self.EXAMPLES)
+        summary = train_task("orchestrator")
+        self.assertEqual(summary["classes"], ["general", "técnica"])
+        self.assertEqual(summary["accuracy"], 1.0)
+
+    def test_threshold_falls_back_to_llm(self):
+        from core.query_classifier import classify_locally, train_task
+
+        self._record(self.EXAMPLES)
+        train_task("orchestrator")
+        self.assertEqual(classify_locally("orchestrator", "cómo listo procesos en linux", threshold=0.5), "técnica")
+        self.assertIsNone(classify_locally("orchestrator", "cómo listo procesos en linux", threshold=1.01))
+
+    def test_single_class_is_not_trained(self):
+        from core.query_classifier import model_path, train_task
+
+        self._record([(query, "técnica") for query, _ in self.EXAMPLES])
+        with self.assertRaises(ValueError):
+            train_task("orchestrator")
+        self.assertFalse(model_path("orchestrator").exists())
+
+    def test_single_class_model_is_ignored(self):
+        from core.query_classifier import LocalClassifier, classify_locally, model_path
+
+        LocalClassifier(["técnica"], dim=16).save(model_path("orchestrator"))
+        self.assertIsNone(classify_locally("orchestrator", "buenos días", threshold=0.5))
+
+
+class SystemDigestTests(SimpleTestCase):
+
+    def test_system_message_is_one_tinydb_write(self):
+        from unittest import mock
+        from tinydb.storages import JSONStorage
+
+        with tempfile.TemporaryDirectory() as directory:
+            manager = _open_store("tinydb", directory)
+            manager.add_message("c1", "user", "hola")
+            with mock.patch.object(JSONStorage, "write", autospec=True, side_effect=JSONStorage.write) as write:
+                manager.add_message("c1", "system", "respuesta")
+                manager.add_message("c1", "system", "respuesta")
+            self.assertEqual(write.call_count, 1)
+
+            conversation = manager.get_conversation("c1")
+            self.assertEqual([msg["message"] for msg in conversation["messages"]], ["hola", "respuesta"])
+            self.assertIsInstance(conversation["system_digests"], dict)
+            manager.backend.close()
+
+
+
+class SummaryMemoryTests(SimpleTestCase):
+
+    def _manager(self, directory, summarizer):
+        from db.tinydb_manager import ConversationManager
+
+        manager = _open_store("tinydb", directory)
+        return ConversationManager(summarizer=summarizer, memory_mode="summary", recent_turns=1,
+                                   backend=manager.backend, write_behind=False, locks=manager.locks)
+
+    def test_history_does_not_call_summarizer(self):
+        from unittest import mock
+
+        summarizer = mock.Mock(return_value="resumen")
+        with tempfile.TemporaryDirectory() as directory:
+            manager = self._manager(directory, summarizer)
+            for number in range(3):
+                manager.add_message("c1", "user", f"pregunta {number}")
+                manager.add_message("c1", "system", f"respuesta {number}")
+
+            history = manager.get_formatted_conversation("c1")
+            summarizer.assert_not_called()
+            self.assertNotIn("pregunta 0", history)
+            self.assertIn("pregunta 2", history)
+
+            self.assertTrue(manager.update_summary("c1"))
+            summarizer.assert_called_once()
+            self.assertIn("pregunta 0", summarizer.call_args[0][1])
+            self.assertFalse(manager.update_summary("c1"))
+
+            history = manager.get_formatted_conversation("c1")
+            self.assertIn("Resumen de la conversación anterior:\nresumen", history)
+            self.assertEqual(manager.get_conversation("c1")["summarized_count"], 4)
+            manager.backend.close()
+
+    def test_schedule_summary_runs_in_background(self):
+        import threading
+
+        done = threading.Event()
+
+        def summarizer(summary, messages):
+            done.set()
+            return "resumen"
+
+        with tempfile.TemporaryDirectory() as directory:
+            manager = self._manager(directory, summarizer)
+            for number in range(2):
+                manager.add_message("c1", "user", f"pregunta {number}")
+                manager.add_message("c1", "system", f"respuesta {number}")
+            manager.schedule_summary("c1")
+            self.assertTrue(done.wait(10))
+            for _ in range(100):
+                if manager.get_conversation("c1").get("summary"):
+                    break
+                time.sleep(0.05)
+            self.assertEqual(manager.get_conversation("c1")["summary"], "resumen")
+            manager.backend.close()
+
+    def test_warns_without_summarizer(self):
+        with tempfile.TemporaryDirectory() as directory:
+            with self.assertLogs("conversations", level="WARNING"):
+                self._manager(directory, None)
+
+
+    def test_jsonl_digest_check_reads_only_new_records(self):
+        from unittest import mock
+        from db.backends import message_digest
+        from db.jsonl_backend import JsonlBackend
+
+        with tempfile.TemporaryDirectory() as directory:
+            manager = _open_store("jsonl", directory)
+            other = JsonlBackend(manager.backend.directory)
+            manager.add_message("c1", "user", "hola")
+            manager.add_message("c1", "system", "respuesta larga " * 100)
+            # Primera comprobación: una lectura completa del segmento
+            self.assertTrue(other.has_digest("c1", message_digest("respuesta larga " * 100)))
+
+            with mock.patch.object(JsonlBackend, "_replay_lines", side_effect=AssertionError("relectura")), \
+                    mock.patch.object(JsonlBackend, "_replay", side_effect=AssertionError("relectura")):
+                manager.add_message("c1", "system", "otra respuesta")
+                manager.add_message("c1", "system", "otra respuesta")
+                # Otro proceso ve el hash anexado sin volver a leer el segmento
+                self.assertTrue(other.has_digest("c1", message_digest("otra respuesta")))
+                self.assertFalse(other.has_digest("c1", message_digest("nueva")))
+
+            messages = [msg["message"] for msg in manager.get_conversation("c1")["messages"]]
+            self.assertEqual(messages, ["hola", "respuesta larga " * 100, "otra respuesta"])
+
+            manager.backend.compact("c1")
+            self.assertTrue(other.has_digest("c1", message_digest("otra respuesta")))
+
+
+class PdfParsingTests(SimpleTestCase):
+
+    def test_corrupt_pdf_does_not_abort_load(self):
+        from pathlib import Path
+        from pypdf import PdfWriter
+        from core.pdf_parsing import iter_parsed_files
+
+        with tempfile.TemporaryDirectory() as directory:
+            directory = Path(directory)
+            for name, pages in (("a.pdf", 7), ("c.pdf", 2)):
+                writer = PdfWriter()
+                for _ in range(pages):
+                    writer.add_blank_page(72, 72)
+                with open(directory / name, "wb") as f:
+                    writer.write(f)
+            (directory / "b.pdf").write_bytes(b"no es un pdf")
+
+            completed = []
+            documents = list(iter_parsed_files(
+                [directory / "a.pdf", directory / "b.pdf", directory / "c.pdf"], max_workers=2, pages_per_task=3,
+                on_file_complete=lambda path, docs: completed.append((path.name, len(docs)))
+            ))
+            self.assertEqual(len(documents), 9)
+            self.assertEqual(completed, [("a.pdf", 7), ("c.pdf", 2)])
+
+
+class ClassificationCacheTests(SimpleTestCase):
+
+    def test_normalized_hit_and_namespaces(self):
+        from core.classification_cache import ClassificationCache
+
+        cache = ClassificationCache(maxsize=10, ttl=60)
+        cache.set("router", "¿Cómo  configuro el PLC?", "module_one")
+        self.assertEqual(cache.get("router", "¿como configuro el plc?"), "module_one")
+        self.assertIsNone(cache.get("orchestrator", "¿como configuro el plc?"))
+
+        stats = cache.stats()["namespaces"]
+        self.assertEqual(stats["router"], {"hits": 1, "misses": 0, "hit_rate": 1.0})
+        self.assertEqual(stats["orchestrator"]["misses"], 1)
+
+    def test_expiry_and_lru_eviction(self):
+        from unittest import mock
+        from core.classification_cache import ClassificationCache
+
+        cache = ClassificationCache(maxsize=2, ttl=10)
+        with mock.patch("core.classification_cache.time.monotonic", return_value=100.0) as monotonic:
+            cache.set("router", "a", 1)
+            cache.set("router", "b", 2)
+            self.assertEqual(cache.get("router", "a"), 1)
+            # 'b' es la menos usada y sale al superar el tamaño
+            cache.set("router", "c", 3)
+            self.assertIsNone(cache.get("router", "b"))
+            self.assertEqual(cache.get("router", "c"), 3)
+
+            monotonic.return_value = 110.0
+            self.assertIsNone(cache.get("router", "a"))
+            self.assertEqual(cache.stats()["size"], 1)
+
+    def test_invalid_router_category_is_classified_once(self):
+        from types import SimpleNamespace
+        from unittest import mock
+        from core import orch_router
+
+        chain = mock.Mock()
+        chain.invoke.return_value = SimpleNamespace(content="No estoy seguro")
+        with mock.patch.object(orch_router, "classification_chain", chain), \
+                mock.patch.object(orch_router, "classify_category_cached", return_value=None), \
+                mock.patch.object(orch_router, "store_category") as store, \
+                mock.patch.object(orch_router, "dispatch_category",
+                                  return_value={"module": "generation", "response": "ok"}) as dispatch:
+            category = orch_router.resolve_category("consulta")
+            self.assertEqual(category, orch_router.DEFAULT_CATEGORY)
+            # El orquestador pasa la categoría ya resuelta: el router no vuelve a llamar al LLM
+            result = orch_router.route_query_with_langchain("consulta", category=category)
+
+        self.assertEqual(chain.invoke.call_count, 1)
+        store.assert_not_called()
+        dispatch.assert_called_once_with(orch_router.DEFAULT_CATEGORY, "consulta", agent_tool=None)
+        self.assertEqual(result["response"], "ok")
+
+        self.assertEqual(orch_router.normalize_category("Categoría: 'agent_two'."), "agent_two")
+
+
+class WriteBehindWriterTests(SimpleTestCase):
+    """
+    Escritor diferido sin hilo en segundo plano: los lotes se escriben al llamar a flush().
+    """
+
+    def _writer(self, directory, fail=None, retries=5):
+        from db.backends import SQLiteBackend
+        from db.tinydb_manager import WriteBehindWriter
+
+        class Backend(SQLiteBackend):
+            batches = []
+
+            def apply_batch(self, batch):
+                self.batches.append(sorted(batch))
+                if fail is not None and fail(batch):
+                    raise OSError("disco lleno")
+                super().apply_batch(batch)
+
+        class Writer(WriteBehindWriter):
+            def _run(self):
+                pass
+
+        backend = Backend(os.path.join(directory, "conversations.sqlite3"))
+        backend.batches = []
+        return Writer(backend, delay=0, retries=retries)
+
+    def _message(self, text):
+        return {"sender": "user", "message": text}
+
+    def test_coalesced_flush_and_overlay(self):
+        with tempfile.TemporaryDirectory() as directory:
+            writer = self._writer(directory)
+            for conversation_id in ("c1", "c2"):
+                writer.enqueue(conversation_id, "create")
+                writer.enqueue(conversation_id, "message", self._message(f"hola {conversation_id}"))
+            writer.enqueue("c1", "fields", {"summary": "resumen"})
+
+            # Las lecturas ven las escrituras pendientes antes de llegar al disco
+            self.assertIsNone(writer.backend.get("c1"))
+            conversation = writer.read("c1")
+            self.assertEqual(conversation["messages"][0]["message"], "hola c1")
+            self.assertEqual(conversation["summary"], "resumen")
+
+            self.assertEqual(writer.flush(), 2)
+            self.assertEqual(writer.backend.batches, [["c1", "c2"]])
+            self.assertEqual(writer.backend.get("c2")["messages"][0]["message"], "hola c2")
+            self.assertEqual(writer.flush(), 0)
+            writer.close()
+            writer.backend.close()
+
+    def test_failed_conversation_is_requeued_in_order(self):
+        # Falla el lote completo y el reintento individual de "bad"
+        failures = [2]
+
+        def fail(batch):
+            if "bad" in batch and failures[0]:
+                failures[0] -= 1
+                return True
+            return False
+
+        with tempfile.TemporaryDirectory() as directory:
+            writer = self._writer(directory, fail)
+            for conversation_id in ("good", "bad"):
+                writer.enqueue(conversation_id, "create")
+                writer.enqueue(conversation_id, "message", self._message("uno"))
+            with self.assertRaises(OSError):
+                writer.flush()
+            # La conversación sana se escribió por separado; la otra vuelve a la cola
+            self.assertEqual(writer.backend.get("good")["messages"][0]["message"], "uno")
+            self.assertIsNone(writer.backend.get("bad"))
+
+            writer.enqueue("bad", "message", self._message("dos"))
+            self.assertEqual([msg["message"] for msg in writer.read("bad")["messages"]], ["uno", "dos"])
+            self.assertEqual(writer.flush(), 1)
+            self.assertEqual([msg["message"] for msg in writer.backend.get("bad")["messages"]], ["uno", "dos"])
+            writer.close()
+            writer.backend.close()
+
+    def test_operations_dropped_after_retries(self):
+        with tempfile.TemporaryDirectory() as directory:
+            writer = self._writer(directory, lambda batch: "bad" in batch, retries=2)
+            writer.enqueue("bad", "create")
+            with self.assertLogs("conversations", level="ERROR"):
+                for _ in range(2):
+                    with self.assertRaises(OSError):
+                        writer.flush()
+            self.assertEqual(writer.flush(), 0)
+            self.assertIsNone(writer.read("bad"))
+            writer.close()
+            writer.backend.close()
+
+
+class ReshardTests(SimpleTestCase):
+    """
+    Activar los shards con datos en el almacenamiento sin shards no los oculta.
+    """
+
+    def test_unsharded_data_is_not_hidden(self):
+        from unittest import mock
+        from db.backends import TinyDBBackend
+        from db.sharding import ShardedBackend, open_sharded, reshard_conversations
+
+        with tempfile.TemporaryDirectory() as directory:
+            unsharded = os.path.join(directory, "conversations.json")
+            shard_dir = os.path.join(directory, "shards")
+            store = TinyDBBackend(unsharded)
+            store.put({"conversation_id": "c1", "messages": [{"sender": "user", "message": "hola"}]})
+            store.close()
+
+            with mock.patch("db.sharding.unsharded_store", return_value=unsharded):
+                with self.assertRaises(ValueError):
+                    open_sharded("tinydb", 4, shard_dir)
+                self.assertFalse(os.path.exists(shard_dir))
+
+                # Carpeta de shards creada sin redistribuir (distribución ya igual a la pedida)
+                ShardedBackend("tinydb", 4, shard_dir).close()
+                self.assertEqual(reshard_conversations(4, "tinydb", shard_dir), 1)
+                self.assertFalse(os.path.exists(unsharded))
+
+                backend = open_sharded("tinydb", 4, shard_dir)
+                self.assertEqual(backend.get("c1")["messages"][0]["message"], "hola")
+                backend.close()
+                self.assertEqual(reshard_conversations(4, "tinydb", shard_dir), 0)
+
+
+class SharedEmbeddingCacheTests(SimpleTestCase):
+    """
+    El mismo archivo en dos bibliotecas se embebe una sola vez.
+    """
+
+    def test_same_file_in_two_libraries(self):
+        from pathlib import Path
+        from llama_index.core import VectorStoreIndex
+        from llama_index.core.embeddings import MockEmbedding
+        from core.embedding_cache import CachedEmbedding, EmbeddingCache
+        from core.index_builder import load_documents
+
+        class CountingEmbedding(MockEmbedding):
+            calls: list = []
+
+            def _get_text_embeddings(self, texts):
+                self.calls.append(len(texts))
+                return super()._get_text_embeddings(texts)
+
+        with tempfile.TemporaryDirectory() as directory:
+            directory = Path(directory)
+            for library in ("doc_orch", "doc_a_one"):
+                (directory / library).mkdir()
+                (directory / library / "manual.txt").write_text("Procedimiento de calibración del sensor.")
+
+            inner = CountingEmbedding(embed_dim=8)
+            embed_model = CachedEmbedding(inner=inner, cache=EmbeddingCache(directory / "cache.sqlite3"))
+            for library in ("doc_orch", "doc_a_one"):
+                VectorStoreIndex.from_documents(load_documents(directory / library), embed_model=embed_model)
+            self.assertEqual(inner.calls, [1])
+
+
+class MapReduceTests(SimpleTestCase):
+
+    def test_pages_are_packed_and_failed_chunks_skipped(self):
+        from types import SimpleNamespace
+        from llama_index.core import Document
+        from core.pdf_map_reduce import map_reduce_analysis
+
+        class FakeLLM:
+            def __init__(self):
+                self.prompts = []
+
+            def batch(self, prompts, config=None, return_exceptions=False):
+                self.prompts.append(prompts)
+                return [
+                    TimeoutError("tiempo de espera agotado") if "b.pdf" in prompt and return_exceptions
+                    else SimpleNamespace(content=f"parcial {len(self.prompts)}-{number}")
+                    for number, prompt in enumerate(prompts)
+                ]
+
+        documents = [Document(text="texto " * 20, metadata={"file_name": "a.pdf", "page_label": str(page)})
+                     for page in range(1, 11)]
+        documents.append(Document(text="otro " * 20, metadata={"file_name": "b.pdf", "page_label": "1"}))
+
+        llm = FakeLLM()
+        response = map_reduce_analysis(documents, "resume el manual", llm, chunk_tokens=3000)
+        # Las diez páginas de a.pdf caben en un fragmento; b.pdf es otro
+        self.assertEqual(len(llm.prompts[0]), 2)
+        self.assertIn("a.pdf, páginas 1-10", llm.prompts[0][0])
+        self.assertEqual(len(llm.prompts), 1)
+        self.assertTrue(response.startswith("parcial 1-0"))
+        self.assertIn("1 de 2 fragmentos", response)
+
+
+class IncrementalSyncTests(SimpleTestCase):
+
+    def test_changed_files_are_embedded_in_one_batch(self):
+        from pathlib import Path
+        from llama_index.core.embeddings import MockEmbedding
+        from core.index_builder import sync_vector_index
+
+        class CountingEmbedding(MockEmbedding):
+            calls: list = []
+
+            def _get_text_embeddings(self, texts):
+                self.calls.append(len(texts))
+                return super()._get_text_embeddings(texts)
+
+        with tempfile.TemporaryDirectory() as directory:
+            data_dir, persist_dir = Path(directory) / "docs", Path(directory) / "storage"
+            data_dir.mkdir()
+            (data_dir / "a.txt").write_text("Manual del variador.")
+            embed_model = CountingEmbedding(embed_dim=8)
+            sync_vector_index(data_dir, persist_dir, embed_model=embed_model)
+
+            (data_dir / "a.txt").write_text("Manual del variador, revisión 2.")
+            for name in ("b.txt", "c.txt"):
+                (data_dir / name).write_text(f"Contenido de {name}.")
+            embed_model.calls.clear()
+            index = sync_vector_index(data_dir, persist_dir, embed_model=embed_model)
+            self.assertEqual(embed_model.calls, [3])
+            self.assertEqual(len(index.ref_doc_info), 3)
+
+
+class FakeLLM:
+    """
+    Modelo de chat de prueba: responde según el tipo de prompt y registra las llamadas.
+    """
+
+    def __init__(self, classification="técnica", refined="consulta refinada"):
+        self.classification = classification
+        self.refined = refined
+        self.prompts = []
+
+    def answer(self, prompt):
+        prompt = str(prompt)
+        self.prompts.append(prompt)
+        if "Responde únicamente con 'general' o 'técnica'" in prompt:
+            return self.classification
+        if "reformula la consulta" in prompt:
+            return self.refined
+        return "respuesta final"
+
+    def invoke(self, prompt, *args, **kwargs):
+        from types import SimpleNamespace
+        return SimpleNamespace(content=self.answer(prompt))
+
+    async def ainvoke(self, prompt, *args, **kwargs):
+        return self.invoke(prompt)
+
+    async def astream(self, prompt, *args, **kwargs):
+        yield self.invoke(prompt)
+
+
+@contextmanager
+def _fake_orchestrator(llm):
+    """
+    Orquestador con el LLM de prueba, sin clasificador local y sin almacenamiento de
+    conversaciones, logs ni ejemplos de clasificación.
+    """
+    from unittest import mock
+    from core.classification_cache import classification_cache
+    from core.orchestrator import OrchestratorAgent
+
+    classification_cache.clear()
+    manager = mock.Mock()
+    manager.get_formatted_conversation.return_value = "Sin historial previo."
+    with mock.patch("core.orchestrator.ChatOpenAI", return_value=llm), \
+            mock.patch("core.orchestrator.ConversationManager", return_value=manager), \
+            mock.patch("core.orchestrator.LogManager"), \
+            mock.patch("core.orchestrator.record_example"), \
+            mock.patch("core.orchestrator.classify_locally", return_value=None):
+        yield OrchestratorAgent()
+
+
+class OrchestratorStreamingTests(SimpleTestCase):
+
+    def test_refined_event_arrives_before_routing_finishes(self):
+        import asyncio
+        from unittest import mock
+
+        async def run():
+            refined_seen = asyncio.Event()
+
+            async def route(query, category=None, agent_tool=None):
+                # Solo termina si el evento 'refined' ya llegó al cliente
+                await asyncio.wait_for(refined_seen.wait(), 5)
+                return {"module": "embeddings", "response": "respuesta del router"}
+
+            events = []
+            with _fake_orchestrator(FakeLLM()) as agent, \
+                    mock.patch("core.orchestrator.aroute_query_with_langchain", side_effect=route):
+                async for event, data in agent.astream_query("¿cómo reinicio el servicio?", "c1"):
+                    events.append(event)
+                    if event == "refined":
+                        self.assertEqual(data, {"refined_query": "consulta refinada"})
+                        refined_seen.set()
+            return events
+
+        events = asyncio.run(run())
+        self.assertEqual(events, ["classified", "refined", "routed", "token", "done"])
+
+
+class PdfTextCacheTests(SimpleTestCase):
+
+    def test_cache_is_created_lazily(self):
+        from unittest import mock
+        from core import pdf_cache
+
+        # Importar el módulo no abre la base de datos
+        self.assertFalse(hasattr(pdf_cache, "pdf_text_cache"))
+        with mock.patch.object(pdf_cache, "_pdf_text_cache", None), \
+                mock.patch.object(pdf_cache, "PdfTextCache") as cache_class:
+            cache = pdf_cache.get_pdf_text_cache()
+            self.assertIs(pdf_cache.get_pdf_text_cache(), cache)
+            cache_class.assert_called_once_with()
+
+    def test_empty_stream_reports_no_documents(self):
+        from core.pdf_orch_tool import analyze_pdf_content
+
+        for mode in ("full", "retrieval", "map_reduce"):
+            self.assertEqual(analyze_pdf_content((doc for doc in []), "resumen", mode=mode),
+                             "No se encontraron documentos para analizar.")
+
+
+class IndexRegistryTests(SimpleTestCase):
+
+    def test_fingerprint_hits_and_misses(self):
+        from unittest import mock
+        from core.index_registry import IndexRegistry
+
+        registry = IndexRegistry()
+        with tempfile.TemporaryDirectory() as directory, \
+                mock.patch("core.index_registry.StorageContext.from_defaults"), \
+                mock.patch("core.index_registry.load_index_from_storage") as load:
+            path = os.path.join(directory, "docstore.json")
+            with open(path, "w") as handle:
+                handle.write("{}")
+            load.side_effect = lambda storage_context: mock.Mock()
+            llm_factory = mock.Mock()
+
+            engine = registry.get_query_engine(directory, llm_factory)
+            # Mismos archivos: se reutiliza el motor sin volver a cargar ni crear el LLM
+            self.assertIs(registry.get_query_engine(directory, llm_factory), engine)
+            self.assertEqual(load.call_count, 1)
+            self.assertEqual(llm_factory.call_count, 1)
+
+            # Cambia la huella (tamaño): se recarga el índice
+            with open(path, "w") as handle:
+                handle.write('{"docs": {}}')
+            reloaded = registry.get_query_engine(directory, llm_factory)
+            self.assertIsNot(reloaded, engine)
+            self.assertEqual(load.call_count, 2)
+
+            registry.invalidate(directory)
+            registry.get_query_engine(directory, llm_factory)
+            self.assertEqual(load.call_count, 3)
+
+
+class ParallelBuildTests(SimpleTestCase):
+
+    def test_incremental_build_skips_unchanged_libraries(self):
+        from concurrent.futures import ThreadPoolExecutor
+        from functools import partial
+        from pathlib import Path
+        from unittest import mock
+        from llama_index.core.embeddings import MockEmbedding
+        import commands
+        from core.index_builder import sync_vector_index
+
+        class CountingEmbedding(MockEmbedding):
+            calls: list = []
+
+            def _get_text_embeddings(self, texts):
+                self.calls.append(len(texts))
+                return super()._get_text_embeddings(texts)
+
+        def build(root, incremental=False):
+            if not incremental:
+                raise AssertionError("initialize_parallel no propagó --incremental")
+            return sync_vector_index(root / "docs", root / "storage", embed_model=embed_model)
+
+        def broken(incremental=False):
+            raise RuntimeError("sin documentos")
+
+        embed_model = CountingEmbedding(embed_dim=8)
+        with tempfile.TemporaryDirectory() as directory:
+            libraries = {}
+            for name in ("orchestrator", "agent_one"):
+                root = Path(directory) / name
+                (root / "docs").mkdir(parents=True)
+                (root / "docs" / "a.txt").write_text(f"Manual de {name}.")
+                libraries[name] = (name, partial(build, root))
+            libraries["agent_two"] = ("agent_two", broken)
+
+            # Hilos en lugar de procesos: las funciones de prueba no se pueden serializar
+            with mock.patch.object(commands, "LIBRARIES", libraries), \
+                    mock.patch.object(commands, "ProcessPoolExecutor", ThreadPoolExecutor):
+                self.assertEqual(commands.initialize_parallel(["orchestrator", "agent_one"], incremental=True), 0)
+                self.assertEqual(sorted(embed_model.calls), [1, 1])
+
+                # Solo cambia la biblioteca del Agente 1: el orquestador no vuelve a embeber nada
+                (Path(directory) / "agent_one" / "docs" / "a.txt").write_text("Manual del Agente 1, revisión 2.")
+                embed_model.calls.clear()
+                exit_code = commands.initialize_parallel(list(libraries), incremental=True, workers=2)
+
+        self.assertEqual(embed_model.calls, [1])
+        # Un error en una biblioteca no detiene a las demás, pero sí el código de salida
+        self.assertEqual(exit_code, 1)
+
+
+class OrchestratorSingletonTests(SimpleTestCase):
+
+    def test_orchestrator_is_built_once_per_process(self):
+        from concurrent.futures import ThreadPoolExecutor
+        from unittest import mock
+        from django.test import RequestFactory
+        from core import orchestrator, views
+
+        with mock.patch.object(orchestrator, "_orchestrator", None), \
+                mock.patch.object(orchestrator, "OrchestratorAgent") as agent_class:
+            agent_class.return_value.handle_query.return_value = "respuesta"
+            with ThreadPoolExecutor(max_workers=8) as executor:
+                agents = list(executor.map(lambda _: orchestrator.get_orchestrator(), range(32)))
+            self.assertTrue(all(agent is agents[0] for agent in agents))
+
+            # Cada solicitud reutiliza el mismo grafo; el usuario viaja en la llamada, no en la instancia
+            factory = RequestFactory()
+            for user in ("ana", "luis"):
+                request = factory.post("/api/agent/", {"query": "hola", "conversation_id": "c1", "optional_id": user},
+                                       content_type="application/json")
+                self.assertEqual(views.agent_view(request).status_code, 200)
+
+        agent_class.assert_called_once_with()
+        users = [call.kwargs["user_id"] for call in agents[0].handle_query.call_args_list]
+        self.assertEqual(users, ["ana", "luis"])
+
+
+class AsyncViewTests(SimpleTestCase):
+
+    async def test_async_views_return_json(self):
+        from unittest import mock
+
+        orchestrator = mock.Mock()
+        orchestrator.ahandle_query = mock.AsyncMock(return_value="respuesta del orquestador")
+        with mock.patch("core.views.get_orchestrator", return_value=orchestrator), \
+                mock.patch("core.views.aroute_query_with_langchain",
+                           mock.AsyncMock(return_value={"module": "generation", "response": "ok"})):
+            response = await self.async_client.post(
+                "/api/agent/async/", {"query": "hola", "conversation_id": "c1"}, content_type="application/json"
+            )
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response["Content-Type"], "application/json")
+            self.assertEqual(response.json(), {
+                "response": "respuesta del orquestador", "conversation_id": "c1", "optional_id": None
+            })
+            orchestrator.ahandle_query.assert_awaited_once_with(
+                query="hola", conversation_id="c1", user_id="default_user", bypass_cache=False
+            )
+
+            response = await self.async_client.post("/api/router/async/", {"query": "hola"})
+            self.assertEqual(response.json()["response"], {"module": "generation", "response": "ok"})
+
+            response = await self.async_client.post("/api/agent/async/", {"query": "hola"},
+                                                    content_type="application/json")
+            self.assertEqual(response.status_code, 400)
+            self.assertIn("error", response.json())
+
+    async def test_async_views_reject_get(self):
+        for url in ("/api/agent/async/", "/api/router/async/", "/api/agent-one/async/",
+                    "/api/agent-two/async/", "/api/agent/stream/"):
+            response = await self.async_client.get(url)
+            self.assertEqual(response.status_code, 405, url)
+
+
+class CombinedClassificationTests(SimpleTestCase):
+
+    def test_parse_combined(self):
+        from core.combined_classification import parse_combined
+
+        self.assertEqual(
+            parse_combined('Respuesta: {"tipo": "técnica", "categoria": "Agent_One", "herramienta": "llm"}'),
+            {"is_general": False, "category": "agent_one", "agent_tool": "llm"}
+        )
+        # La herramienta solo aplica a los agentes; una herramienta desconocida se descarta
+        self.assertEqual(
+            parse_combined('{"tipo": "tecnica", "categoria": "pdf", "herramienta": "llm"}'),
+            {"is_general": False, "category": "pdf", "agent_tool": ""}
+        )
+        self.assertEqual(
+            parse_combined('{"tipo": "técnica", "categoria": "agent_two", "herramienta": "martillo"}')["agent_tool"], ""
+        )
+        self.assertEqual(
+            parse_combined('{"tipo": "general", "categoria": "pdf"}'),
+            {"is_general": True, "category": "", "agent_tool": ""}
+        )
+
+    def test_invalid_output_falls_back(self):
+        from types import SimpleNamespace
+        from unittest import mock
+        from core.combined_classification import aclassify_combined, classify_combined, parse_combined
+        import asyncio
+
+        for text in ("técnica", "{no es json}", '{"tipo": "otro"}', '{"tipo": "técnica", "categoria": "cocina"}'):
+            self.assertIsNone(parse_combined(text), text)
+
+        llm = mock.Mock()
+        llm.invoke.return_value = SimpleNamespace(content="agent_one")
+        llm.ainvoke = mock.AsyncMock(return_value=SimpleNamespace(content='{"tipo": "general"}'))
+        self.assertIsNone(classify_combined(llm, "¿cómo hago un backup?"))
+        self.assertEqual(asyncio.run(aclassify_combined(llm, "hola"))["is_general"], True)
+        self.assertIn("¿cómo hago un backup?", llm.invoke.call_args.args[0])
+
+    def test_orchestrator_threads_combined_decision(self):
+        from unittest import mock
+
+        class CombinedLLM(FakeLLM):
+            def __init__(self, combined):
+                super().__init__()
+                self.combined = combined
+
+            def answer(self, prompt):
+                if "Responde ÚNICAMENTE con un objeto JSON" in str(prompt):
+                    self.prompts.append(str(prompt))
+                    return self.combined
+                return super().answer(prompt)
+
+        def run(llm):
+            router = mock.Mock(return_value={"module": "agent_two", "response": "respuesta del router"})
+            with _fake_orchestrator(llm) as agent, \
+                    mock.patch("core.orchestrator.COMBINED_CLASSIFICATION", True), \
+                    mock.patch("core.orchestrator.route_query_with_langchain", router):
+                agent.handle_query("script de backup en bash", "c1")
+            stepwise = [p for p in llm.prompts if "Responde únicamente con 'general' o 'técnica'" in p]
+            return router.call_args.kwargs, len(stepwise)
+
+        # Respuesta válida: el router y el agente reciben la decisión y no se clasifica por pasos
+        kwargs, stepwise = run(CombinedLLM('{"tipo": "técnica", "categoria": "agent_two", "herramienta": "llm"}'))
+        self.assertEqual((kwargs["category"], kwargs["agent_tool"], stepwise), ("agent_two", "llm", 0))
+
+        # Respuesta inválida: se vuelve a la clasificación por pasos y el router clasifica por su cuenta
+        kwargs, stepwise = run(CombinedLLM("agent_two"))
+        self.assertEqual((kwargs["category"], kwargs["agent_tool"], stepwise), (None, None, 1))
+
+
+class SpeculativeExecutionTests(SimpleTestCase):
+    """
+    El grafo se construye al crear el orquestador: ORCH_SPECULATIVE_EXECUTION se parchea antes.
+    """
+
+    def test_general_query_discards_refinement(self):
+        import threading
+        from unittest import mock
+
+        release = threading.Event()
+
+        class SlowRefineLLM(FakeLLM):
+            def answer(self, prompt):
+                if "reformula la consulta" in str(prompt):
+                    release.wait(5)
+                return super().answer(prompt)
+
+        router = mock.Mock()
+        with mock.patch("core.orchestrator.ORCH_SPECULATIVE_EXECUTION", True), \
+                mock.patch("core.orchestrator.route_query_with_langchain", router), \
+                _fake_orchestrator(SlowRefineLLM(classification="general")) as agent:
+            start = time.monotonic()
+            response = agent.handle_query("hola, ¿qué tal?", "c1")
+            elapsed = time.monotonic() - start
+        # La respuesta no esperó al refinamiento en curso, que se descarta
+        release.set()
+        self.assertLess(elapsed, 4)
+        self.assertEqual(response, "respuesta final")
+        router.assert_not_called()
+
+    def test_async_general_query_cancels_refinement(self):
+        import asyncio
+        from unittest import mock
+
+        cancelled = []
+
+        class SlowRefineLLM(FakeLLM):
+            async def ainvoke(self, prompt, *args, **kwargs):
+                if "reformula la consulta" in str(prompt):
+                    try:
+                        await asyncio.sleep(5)
+                    except asyncio.CancelledError:
+                        cancelled.append(prompt)
+                        raise
+                else:
+                    # La clasificación tarda lo bastante para que el refinamiento ya esté en curso
+                    await asyncio.sleep(0.2)
+                return self.invoke(prompt)
+
+        async def run(llm):
+            router = mock.AsyncMock(return_value={"module": "embeddings", "response": "respuesta del router"})
+            with mock.patch("core.orchestrator.ORCH_SPECULATIVE_EXECUTION", True), \
+                    mock.patch("core.orchestrator.aroute_query_with_langchain", router), \
+                    _fake_orchestrator(llm) as agent:
+                response = await asyncio.wait_for(agent.ahandle_query("hola, ¿qué tal?", "c1"), 3)
+            return response, router
+
+        response, router = asyncio.run(run(SlowRefineLLM(classification="general")))
+        self.assertEqual(response, "respuesta final")
+        self.assertEqual(len(cancelled), 1)
+        router.assert_not_awaited()
+
+        # Consulta técnica: el router recibe la consulta refinada en paralelo, sin refinar de nuevo
+        llm = FakeLLM()
+        response, router = asyncio.run(run(llm))
+        self.assertEqual(router.call_args.args[0], "consulta refinada")
+        self.assertEqual(sum("reformula la consulta" in prompt for prompt in llm.prompts), 1)
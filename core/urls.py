@@ -1,5 +1,9 @@
 from django.urls import path
-from .views import agent_view, router_view, agent_one_view, agent_two_view, health_check_view
+from .views import (
+    agent_view, router_view, agent_one_view, agent_two_view, health_check_view,
+    agent_async_view, router_async_view, agent_one_async_view, agent_two_async_view,
+    agent_stream_view,
+)
 
 
 urlpatterns = [
@@ -8,5 +12,11 @@ urlpatterns = [
     path('agent-one/', agent_one_view, name='agent_one_view'),
     path('agent-two/', agent_two_view, name='agent_two_view'),
     path('health/', health_check_view, name='health_check'),
+    # Versiones asíncronas (servir con ASGI, p. ej. uvicorn api_project.asgi:application)
+    path('agent/async/', agent_async_view, name='agent_async_view'),
+    path('agent/stream/', agent_stream_view, name='agent_stream_view'),
+    path('router/async/', router_async_view, name='router_async_view'),
+    path('agent-one/async/', agent_one_async_view, name='agent_one_async_view'),
+    path('agent-two/async/', agent_two_async_view, name='agent_two_async_view'),
 ]
 
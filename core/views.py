@@ -1,9 +1,25 @@
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
-from .orchestrator import OrchestratorAgent  # Importar el orquestador
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+import json
+from .orchestrator import get_orchestrator  # Importar el orquestador
 from .agents.agent_one.agent_core import SimpleAgent as AgentOne  # Importar el Agente 1
 from .agents.agent_two.agent_core import SimpleAgent as AgentTwo  # Importar el Agente 2
-from .orch_router import route_query_with_langchain  # Importar el Router
+from .orch_router import route_query_with_langchain, aroute_query_with_langchain, agent_pools, get_pool_stats  # Importar el Router
+from .classification_cache import classification_cache
+from .semantic_cache import semantic_cache
+
+
+def _bypass_cache(data) -> bool:
+    """
+    Indicador 'bypass_cache' del cuerpo de la solicitud (JSON o formulario).
+    """
+    value = data.get('bypass_cache', False)
+    if isinstance(value, str):
+        return value.strip().lower() in ("1", "true", "yes")
+    return bool(value)
 
 @api_view(['POST'])
 def agent_view(request):
@@ -20,11 +36,16 @@ def agent_view(request):
         if not query or not conversation_id:
             return Response({"error": "Faltan campos obligatorios: 'query' y 'conversation_id'"}, status=400)
 
-        # Crear instancia del orquestador
-        agent = OrchestratorAgent(user_id=optional_id or "default_user")
+        # Orquestador compartido por el proceso (grafo compilado y clientes LLM reutilizados)
+        agent = get_orchestrator()
 
-        # Procesar la consulta usando el orquestador
-        response = agent.handle_query(query=query, conversation_id=conversation_id)
+        # Procesar la consulta usando el orquestador; el usuario viaja en el estado del grafo
+        response = agent.handle_query(
+            query=query,
+            conversation_id=conversation_id,
+            user_id=optional_id or "default_user",
+            bypass_cache=_bypass_cache(request.data)
+        )
 
         return Response({
             "response": response,
@@ -138,6 +159,169 @@ def agent_two_view(request):
         }, status=500)
 
 
+def _parse_async_body(request) -> dict:
+    """
+    Lee el cuerpo de una solicitud en las vistas asíncronas (JSON o formulario).
+    """
+    if request.content_type == "application/json":
+        try:
+            return json.loads(request.body or b"{}")
+        except json.JSONDecodeError:
+            return {}
+    return request.POST.dict()
+
+
+def _async_error(message, data, status):
+    return JsonResponse({
+        "error": message,
+        "conversation_id": data.get('conversation_id'),
+        "optional_id": data.get('optional_id')
+    }, status=status)
+
+
+@csrf_exempt
+@require_POST
+async def agent_async_view(request):
+    """
+    Endpoint asíncrono del orquestador: ejecuta el grafo con ainvoke sin ocupar un hilo
+    durante las llamadas al LLM.
+    """
+    data = _parse_async_body(request)
+    try:
+        query = data.get('query')
+        optional_id = data.get('optional_id')
+        conversation_id = data.get('conversation_id')
+
+        # Validar campos obligatorios
+        if not query or not conversation_id:
+            return JsonResponse({"error": "Faltan campos obligatorios: 'query' y 'conversation_id'"}, status=400)
+
+        response = await get_orchestrator().ahandle_query(
+            query=query,
+            conversation_id=conversation_id,
+            user_id=optional_id or "default_user",
+            bypass_cache=_bypass_cache(data)
+        )
+
+        return JsonResponse({
+            "response": response,
+            "conversation_id": conversation_id,
+            "optional_id": optional_id
+        })
+    except Exception as e:
+        return _async_error(f"Error en el procesamiento: {str(e)}", data, 500)
+
+
+@csrf_exempt
+@require_POST
+async def router_async_view(request):
+    """
+    Endpoint asíncrono para interactuar directamente con el router.
+    """
+    data = _parse_async_body(request)
+    try:
+        query = data.get('query')
+        optional_id = data.get('optional_id')
+        conversation_id = data.get('conversation_id')
+
+        # Validar campos obligatorios
+        if not query:
+            return JsonResponse({"error": "Faltan campos obligatorios: 'query'"}, status=400)
+
+        response = await aroute_query_with_langchain(
+            query=query,
+            user_id=optional_id or "default_user",
+            conversation_id=conversation_id or "default_conv"
+        )
+
+        return JsonResponse({
+            "response": response,
+            "conversation_id": conversation_id,
+            "optional_id": optional_id
+        })
+    except Exception as e:
+        return _async_error(f"Error en el procesamiento del router: {str(e)}", data, 500)
+
+
+def _sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@csrf_exempt
+@require_POST
+async def agent_stream_view(request):
+    """
+    Endpoint del orquestador con Server-Sent Events: emite el progreso del grafo
+    (classified, refined, routed) y después los tokens de la respuesta final (token),
+    terminando con 'done' (respuesta completa) o 'error'.
+    """
+    data = _parse_async_body(request)
+    query = data.get('query')
+    optional_id = data.get('optional_id')
+    conversation_id = data.get('conversation_id')
+
+    # Validar campos obligatorios
+    if not query or not conversation_id:
+        return JsonResponse({"error": "Faltan campos obligatorios: 'query' y 'conversation_id'"}, status=400)
+
+    async def event_stream():
+        async for event, payload in get_orchestrator().astream_query(
+            query=query,
+            conversation_id=conversation_id,
+            user_id=optional_id or "default_user",
+            bypass_cache=_bypass_cache(data)
+        ):
+            payload.update({"conversation_id": conversation_id, "optional_id": optional_id})
+            yield _sse_event(event, payload)
+
+    response = StreamingHttpResponse(event_stream(), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
+async def _agent_async_response(request, pool_name: str, label: str):
+    data = _parse_async_body(request)
+    try:
+        query = data.get('query')
+        optional_id = data.get('optional_id')
+        conversation_id = data.get('conversation_id')
+
+        # Validar campos obligatorios
+        if not query or not conversation_id:
+            return JsonResponse({"error": "Faltan campos obligatorios: 'query' y 'conversation_id'"}, status=400)
+
+        # Agente prestado del pool compartido con el router
+        async with agent_pools[pool_name].aborrow() as agent:
+            response = await agent.ahandle_query(query)
+
+        return JsonResponse({
+            "response": response,
+            "conversation_id": conversation_id,
+            "optional_id": optional_id
+        })
+    except Exception as e:
+        return _async_error(f"Error en el procesamiento del {label}: {str(e)}", data, 500)
+
+
+@csrf_exempt
+@require_POST
+async def agent_one_async_view(request):
+    """
+    Endpoint asíncrono para interactuar directamente con el Agente 1.
+    """
+    return await _agent_async_response(request, "agent_one", "Agente 1")
+
+
+@csrf_exempt
+@require_POST
+async def agent_two_async_view(request):
+    """
+    Endpoint asíncrono para interactuar directamente con el Agente 2.
+    """
+    return await _agent_async_response(request, "agent_two", "Agente 2")
+
+
 @api_view(['GET'])
 def health_check_view(request):
     """
@@ -145,7 +329,10 @@ def health_check_view(request):
     """
     return Response({
         "status": "OK",
-        "message": "The service is running"
+        "message": "The service is running",
+        "agent_pools": get_pool_stats(),
+        "classification_cache": classification_cache.stats(),
+        "semantic_cache": semantic_cache.stats()
     }, status=200)
 
 """
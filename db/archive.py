@@ -0,0 +1,288 @@
+from db.backends import get_backend
+from db.locking import FileLock, get_conversation_locks
+import gzip
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# Archivo de conversaciones inactivas: segmentos JSONL comprimidos con gzip y un índice SQLite
+ARCHIVE_DIR = os.getenv("CONVERSATION_ARCHIVE_DIR", os.path.join("db", "archive"))
+# Tamaño a partir del cual se empieza un segmento nuevo
+ARCHIVE_SEGMENT_SIZE = int(os.getenv("CONVERSATION_ARCHIVE_SEGMENT_SIZE", 64 * 1024 * 1024))
+# Días sin actividad tras los que una conversación se archiva (política por defecto del comando)
+CONVERSATION_RETENTION_DAYS = float(os.getenv("CONVERSATION_RETENTION_DAYS", 30))
+# Conversaciones que se archivan y eliminan del almacenamiento principal con una sola escritura
+ARCHIVE_BATCH_SIZE = int(os.getenv("CONVERSATION_ARCHIVE_BATCH_SIZE", 200))
+
+DAY = 24 * 60 * 60
+
+
+def conversation_timestamps(conversation: dict) -> list:
+    """
+    Fechas de los mensajes de la conversación (los mensajes anteriores a las fechas no tienen).
+    """
+    return [msg["timestamp"] for msg in conversation.get("messages", []) if "timestamp" in msg]
+
+
+class ConversationArchive:
+    """
+    Almacén comprimido de conversaciones frías.
+
+    Cada conversación se guarda como un miembro gzip independiente (una línea JSON) anexado al
+    segmento actual 'segment-NNNNN.jsonl.gz'; el segmento completo sigue siendo un gzip válido
+    (zcat lo lee como JSONL). El índice guarda el segmento, la posición y la longitud de cada
+    miembro, de modo que recuperar una conversación es una búsqueda por clave y una sola lectura.
+
+    Las conversaciones recuperadas se quitan del índice; su miembro queda sin referencia en el
+    segmento.
+    """
+
+    def __init__(self, directory: str = ARCHIVE_DIR, segment_size: int = ARCHIVE_SEGMENT_SIZE):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.index_path = os.path.join(directory, "index.sqlite3")
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _connection(self, create: bool = False):
+        """
+        Conexión al índice. Sin archivo previo no se crea nada salvo al archivar (create=True).
+        """
+        if self._conn is None:
+            if not create and not os.path.exists(self.index_path):
+                return None
+            os.makedirs(self.directory, exist_ok=True)
+            self._conn = sqlite3.connect(self.index_path, timeout=30, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS archived ("
+                " conversation_id TEXT PRIMARY KEY,"
+                " segment TEXT NOT NULL,"
+                " offset INTEGER NOT NULL,"
+                " length INTEGER NOT NULL,"
+                " last_activity REAL,"
+                " archived_at REAL NOT NULL)"
+            )
+            self._conn.commit()
+        return self._conn
+
+    def _current_segment(self) -> str:
+        segments = sorted(name for name in os.listdir(self.directory) if name.endswith(".jsonl.gz"))
+        if segments:
+            last = segments[-1]
+            if os.path.getsize(os.path.join(self.directory, last)) < self.segment_size:
+                return last
+            return self._next_segment(last)
+        return "segment-00000.jsonl.gz"
+
+    @staticmethod
+    def _next_segment(segment: str) -> str:
+        number = int(segment[len("segment-"):-len(".jsonl.gz")]) + 1
+        return f"segment-{number:05d}.jsonl.gz"
+
+    def add(self, conversation: dict):
+        """
+        Guarda la conversación en el segmento actual y la registra en el índice.
+        """
+        self.add_many([conversation])
+
+    def add_many(self, conversations: list):
+        """
+        Guarda varias conversaciones con un solo anexado (y un solo fsync) por segmento y las
+        registra en el índice en una sola transacción.
+        """
+        if not conversations:
+            return
+        members = [
+            gzip.compress((json.dumps(conversation, ensure_ascii=False) + "\n").encode("utf-8"))
+            for conversation in conversations
+        ]
+        rows = []
+        now = time.time()
+        with self._lock:
+            conn = self._connection(create=True)
+            # Los anexados de varios procesos no se intercalan
+            with FileLock(os.path.join(self.directory, "archive.lock")):
+                segment = self._current_segment()
+                position = 0
+                while position < len(members):
+                    with open(os.path.join(self.directory, segment), "ab") as f:
+                        offset = f.tell()
+                        first = position
+                        # El segmento se llena hasta segment_size; el resto pasa al siguiente
+                        while position < len(members) and (position == first or offset < self.segment_size):
+                            conversation, member = conversations[position], members[position]
+                            f.write(member)
+                            timestamps = conversation_timestamps(conversation)
+                            rows.append((conversation["conversation_id"], segment, offset, len(member),
+                                         max(timestamps) if timestamps else None, now))
+                            offset += len(member)
+                            position += 1
+                        f.flush()
+                        os.fsync(f.fileno())
+                    segment = self._next_segment(segment)
+            with conn:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO archived"
+                    " (conversation_id, segment, offset, length, last_activity, archived_at)"
+                    " VALUES (?, ?, ?, ?, ?, ?)",
+                    rows
+                )
+
+    def get(self, conversation_id):
+        """
+        Devuelve la conversación archivada o None.
+        """
+        with self._lock:
+            conn = self._connection()
+            if conn is None:
+                return None
+            row = conn.execute(
+                "SELECT segment, offset, length FROM archived WHERE conversation_id = ?", (conversation_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        segment, offset, length = row
+        with open(os.path.join(self.directory, segment), "rb") as f:
+            f.seek(offset)
+            member = f.read(length)
+        return json.loads(gzip.decompress(member).decode("utf-8"))
+
+    def remove(self, conversation_id):
+        with self._lock:
+            conn = self._connection()
+            if conn is not None:
+                conn.execute("DELETE FROM archived WHERE conversation_id = ?", (conversation_id,))
+                conn.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            conn = self._connection()
+            conversations = conn.execute("SELECT COUNT(*) FROM archived").fetchone()[0] if conn else 0
+        segments = [name for name in os.listdir(self.directory) if name.endswith(".jsonl.gz")] \
+            if os.path.isdir(self.directory) else []
+        return {
+            "conversations": conversations,
+            "segments": len(segments),
+            "bytes": sum(os.path.getsize(os.path.join(self.directory, name)) for name in segments),
+        }
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+_archive = None
+_archive_lock = threading.Lock()
+
+
+def get_archive() -> ConversationArchive:
+    """
+    Archivo de conversaciones compartido por el proceso.
+    """
+    global _archive
+    with _archive_lock:
+        if _archive is None:
+            _archive = ConversationArchive()
+        return _archive
+
+
+def is_cold(conversation: dict, now: float, inactive_days: float = None, max_age_days: float = None,
+            include_undated: bool = False) -> bool:
+    """
+    Política de retención: inactiva desde hace `inactive_days` (último mensaje) o creada hace
+    más de `max_age_days` (primer mensaje). Las conversaciones sin fechas solo se archivan con
+    `include_undated`.
+    """
+    timestamps = conversation_timestamps(conversation)
+    if not timestamps:
+        return include_undated
+    if inactive_days is not None and now - max(timestamps) >= inactive_days * DAY:
+        return True
+    if max_age_days is not None and now - min(timestamps) >= max_age_days * DAY:
+        return True
+    return False
+
+
+def _archive_batch(conversation_ids: list, now: float, policy: tuple, backend, archive, locks) -> tuple:
+    """
+    Archiva un lote con los bloqueos de sus conversaciones tomados: una escritura en el archivo
+    y una eliminación en el almacenamiento principal para todo el lote.
+
+    Returns:
+        tuple: (conversaciones archivadas, conversaciones que se conservan)
+    """
+    with locks.hold_many(conversation_ids):
+        cold = []
+        kept = 0
+        for conversation_id in conversation_ids:
+            # Pudo recibir mensajes desde que se leyó
+            current = backend.get(conversation_id)
+            if current is None:
+                continue
+            if is_cold(current, now, *policy):
+                cold.append(current)
+            else:
+                kept += 1
+        if cold:
+            archive.add_many(cold)
+            backend.delete_many([conversation["conversation_id"] for conversation in cold])
+    return len(cold), kept
+
+
+def archive_conversations(inactive_days: float = None, max_age_days: float = None, include_undated: bool = False,
+                          backend=None, archive=None, locks=None, batch_size: int = ARCHIVE_BATCH_SIZE,
+                          force: bool = False) -> dict:
+    """
+    Mueve las conversaciones frías del almacenamiento principal al archivo comprimido.
+
+    Las conversaciones se archivan por lotes de `batch_size`: cada lote se vuelve a leer con los
+    bloqueos de sus conversaciones tomados (también frente a los workers del servidor), se
+    escribe en el archivo y solo después se elimina del almacenamiento principal.
+    ConversationManager las recupera de forma transparente al volver a usarlas.
+
+    Con CONVERSATION_WRITE_BEHIND=true los mensajes encolados en otros procesos todavía no están
+    en disco y los bloqueos no los protegen: el archivado se rechaza salvo con `force=True`, que
+    solo debe usarse con el servidor detenido. Las escrituras pendientes de este proceso se
+    vacían antes de empezar.
+
+    Returns:
+        dict: {"archived": conversaciones archivadas, "kept": conversaciones que se conservan}
+    """
+    from db.tinydb_manager import CONVERSATION_WRITE_BEHIND, flush_writers
+
+    if CONVERSATION_WRITE_BEHIND and not force:
+        raise RuntimeError(
+            "Con CONVERSATION_WRITE_BEHIND=true los mensajes pendientes de otros procesos no se pueden "
+            "proteger al archivar. Detén el servidor y usa --force."
+        )
+    flush_writers()
+
+    if inactive_days is None and max_age_days is None:
+        inactive_days = CONVERSATION_RETENTION_DAYS
+    policy = (inactive_days, max_age_days, include_undated)
+    backend = backend or get_backend()
+    archive = archive or get_archive()
+    locks = locks or get_conversation_locks()
+    batch_size = max(1, batch_size)
+    now = time.time()
+
+    archived = kept = 0
+    batch = []
+    for conversation in backend.iter_conversations():
+        if not is_cold(conversation, now, *policy):
+            kept += 1
+            continue
+        batch.append(conversation["conversation_id"])
+        if len(batch) >= batch_size:
+            counts = _archive_batch(batch, now, policy, backend, archive, locks)
+            archived, kept = archived + counts[0], kept + counts[1]
+            batch = []
+    if batch:
+        counts = _archive_batch(batch, now, policy, backend, archive, locks)
+        archived, kept = archived + counts[0], kept + counts[1]
+    return {"archived": archived, "kept": kept}
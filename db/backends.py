@@ -0,0 +1,544 @@
+from tinydb import TinyDB, Query
+from contextlib import contextmanager
+from db.locking import FileLock, CONVERSATION_PROCESS_LOCKS
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+
+# Motor de almacenamiento de las conversaciones: 'tinydb' (archivo JSON), 'sqlite' o 'jsonl'
+CONVERSATION_BACKEND = os.getenv("CONVERSATION_BACKEND", "tinydb")
+TINYDB_PATH = os.path.join("db", "conversations.json")
+SQLITE_PATH = os.getenv("CONVERSATION_SQLITE_PATH", os.path.join("db", "conversations.sqlite3"))
+# Número de shards (archivos o bases de datos) entre los que se reparten las conversaciones
+CONVERSATION_SHARDS = int(os.getenv("CONVERSATION_SHARDS", 1))
+
+
+def message_digest(message: str) -> str:
+    return hashlib.sha256(message.encode("utf-8")).hexdigest()
+
+
+def conversation_digests(conversation: dict) -> dict:
+    """
+    Hashes de las respuestas del sistema de una conversación, como diccionario {hash: True}
+    para comprobar la pertenencia sin recorrerlos. Las conversaciones anteriores a
+    'system_digests' los calculan a partir de sus mensajes (y las que los guardaban como lista,
+    a partir de ella).
+    """
+    digests = conversation.get("system_digests")
+    if isinstance(digests, dict):
+        return digests
+    if digests is None:
+        digests = [message_digest(msg["message"]) for msg in conversation["messages"] if msg["sender"] == "system"]
+    return dict.fromkeys(digests, True)
+
+
+def add_digest(conversation: dict, digest: str):
+    if not isinstance(conversation.get("system_digests"), dict):
+        conversation["system_digests"] = conversation_digests(conversation)
+    conversation["system_digests"][digest] = True
+
+
+class ConversationBackend:
+    """
+    Interfaz de almacenamiento de conversaciones.
+
+    Una conversación es un diccionario {"conversation_id", "messages", ...}; los campos
+    adicionales (resumen, contadores) se guardan tal cual junto a los mensajes.
+    """
+
+    name = "base"
+
+    def get(self, conversation_id):
+        """Devuelve la conversación o None si no existe."""
+        raise NotImplementedError
+
+    def create(self, conversation_id):
+        """Crea una conversación vacía y la devuelve."""
+        raise NotImplementedError
+
+    def append_message(self, conversation_id, message: dict, digest: str = None):
+        """
+        Agrega un mensaje al final de la conversación. Con `digest` registra además el hash de
+        la respuesta del sistema en la misma escritura.
+        """
+        raise NotImplementedError
+
+    def update_fields(self, conversation_id, fields: dict):
+        """Actualiza campos de la conversación distintos de los mensajes."""
+        raise NotImplementedError
+
+    def put(self, conversation: dict):
+        """Guarda una conversación completa, reemplazando la existente (migraciones)."""
+        raise NotImplementedError
+
+    def iter_conversations(self):
+        """Recorre todas las conversaciones almacenadas."""
+        raise NotImplementedError
+
+    def delete(self, conversation_id):
+        """Elimina la conversación (archivado)."""
+        raise NotImplementedError
+
+    def delete_many(self, conversation_ids):
+        """Elimina varias conversaciones (archivado por lotes)."""
+        for conversation_id in conversation_ids:
+            self.delete(conversation_id)
+
+    def exists(self, conversation_id) -> bool:
+        return self.get(conversation_id) is not None
+
+    def close(self):
+        """Libera archivos y conexiones abiertas."""
+
+    def has_digest(self, conversation_id, digest: str) -> bool:
+        """Indica si la conversación ya tiene una respuesta del sistema con ese hash."""
+        conversation = self.get(conversation_id)
+        return conversation is not None and digest in conversation_digests(conversation)
+
+    def add_digest(self, conversation_id, digest: str):
+        """Registra el hash de una nueva respuesta del sistema."""
+        conversation = self.get(conversation_id)
+        if conversation is not None:
+            add_digest(conversation, digest)
+            self.update_fields(conversation_id, {"system_digests": conversation["system_digests"]})
+
+    def apply_batch(self, batch: dict):
+        """
+        Aplica varias operaciones pendientes de una vez (escritura diferida).
+
+        Args:
+            batch (dict): {conversation_id: [(operación, datos)]} con operaciones 'create',
+                'message', 'fields' y 'digest', en orden.
+        """
+        for conversation_id, operations in batch.items():
+            for operation, payload in operations:
+                if operation == "create":
+                    if self.get(conversation_id) is None:
+                        self.create(conversation_id)
+                elif operation == "message":
+                    self.append_message(conversation_id, payload)
+                elif operation == "fields":
+                    self.update_fields(conversation_id, payload)
+                elif operation == "digest":
+                    self.add_digest(conversation_id, payload)
+
+
+def apply_operations(conversation, operations, conversation_id):
+    """
+    Aplica operaciones pendientes sobre una conversación leída del motor (o None si aún no existe).
+    """
+    for operation, payload in operations:
+        if operation == "create":
+            if conversation is None:
+                conversation = {"conversation_id": conversation_id, "messages": []}
+        elif conversation is None:
+            continue
+        elif operation == "message":
+            conversation["messages"].append(payload)
+        elif operation == "fields":
+            conversation.update(payload)
+        elif operation == "digest":
+            add_digest(conversation, payload)
+    return conversation
+
+
+class TinyDBBackend(ConversationBackend):
+    """
+    Almacenamiento original: un único archivo JSON que TinyDB reescribe en cada escritura.
+
+    Todas las operaciones se hacen con el archivo bloqueado (ver db/locking.py), de modo que
+    varios procesos pueden compartirlo sin perder escrituras.
+    """
+
+    name = "tinydb"
+
+    def __init__(self, path: str = TINYDB_PATH):
+        self.path = path
+        self.db = TinyDB(path)
+        # Sin caché de consultas: otros procesos pueden modificar el archivo
+        self.table = self.db.table(self.db.default_table_name, cache_size=0)
+        self.query = Query()
+        self._lock = FileLock(f"{path}.lock") if CONVERSATION_PROCESS_LOCKS else threading.RLock()
+
+    def _where(self, conversation_id):
+        return self.query.conversation_id == conversation_id
+
+    def _insert(self, documents: list):
+        # TinyDB guarda en memoria el siguiente doc_id; otro proceso pudo haberlo usado ya
+        self.table._next_id = None
+        self.table.insert_multiple(documents)
+
+    def get(self, conversation_id):
+        with self._lock:
+            conversation = self.table.search(self._where(conversation_id))
+        return dict(conversation[0]) if conversation else None
+
+    def create(self, conversation_id):
+        new_conversation = {"conversation_id": conversation_id, "messages": []}
+        with self._lock:
+            if not self.table.contains(self._where(conversation_id)):
+                self._insert([new_conversation])
+        return new_conversation
+
+    def append_message(self, conversation_id, message: dict, digest: str = None):
+        # Mensaje y hash en una sola reescritura del archivo
+        def append(document):
+            document["messages"].append(message)
+            if digest is not None:
+                add_digest(document, digest)
+        with self._lock:
+            self.table.update(append, self._where(conversation_id))
+
+    def update_fields(self, conversation_id, fields: dict):
+        with self._lock:
+            self.table.update(fields, self._where(conversation_id))
+
+    def put(self, conversation: dict):
+        with self._lock:
+            if self.table.contains(self._where(conversation["conversation_id"])):
+                self.table.update(conversation, self._where(conversation["conversation_id"]))
+            else:
+                self._insert([conversation])
+
+    def iter_conversations(self):
+        with self._lock:
+            conversations = self.table.all()
+        for conversation in conversations:
+            yield dict(conversation)
+
+    def delete(self, conversation_id):
+        with self._lock:
+            self.table.remove(self._where(conversation_id))
+
+    def delete_many(self, conversation_ids):
+        # Una sola reescritura del archivo para todo el lote
+        conversation_ids = set(conversation_ids)
+        with self._lock:
+            doc_ids = [document.doc_id for document in self.table.all()
+                       if document.get("conversation_id") in conversation_ids]
+            if doc_ids:
+                self.table.remove(doc_ids=doc_ids)
+
+    def close(self):
+        self.db.close()
+
+    def exists(self, conversation_id) -> bool:
+        with self._lock:
+            return self.table.contains(self._where(conversation_id))
+
+    def has_digest(self, conversation_id, digest: str) -> bool:
+        with self._lock:
+            documents = self.table.search(self._where(conversation_id))
+        return bool(documents) and digest in conversation_digests(documents[0])
+
+    def add_digest(self, conversation_id, digest: str):
+        with self._lock:
+            self.table.update(lambda document: add_digest(document, digest), self._where(conversation_id))
+
+    def apply_batch(self, batch: dict):
+        # Todas las conversaciones del lote en una sola reescritura del archivo (más una si hay altas)
+        with self._lock:
+            new_conversations = [
+                {"conversation_id": conversation_id, "messages": []}
+                for conversation_id, operations in batch.items()
+                if any(operation == "create" for operation, _ in operations)
+                and not self.table.contains(self._where(conversation_id))
+            ]
+            if new_conversations:
+                self._insert(new_conversations)
+
+            updates = []
+            for conversation_id, operations in batch.items():
+                changes = [(operation, payload) for operation, payload in operations if operation != "create"]
+                if changes:
+                    updates.append((
+                        lambda document, changes=changes: apply_operations(document, changes, document["conversation_id"]),
+                        self._where(conversation_id)
+                    ))
+            if updates:
+                self.table.update_multiple(updates)
+
+
+class SQLiteBackend(ConversationBackend):
+    """
+    SQLite en modo WAL: una fila por conversación y una por mensaje, indexadas por conversation_id.
+    Agregar un mensaje es un INSERT; leer una conversación no recorre las demás.
+    """
+
+    name = "sqlite"
+
+    def __init__(self, path: str = SQLITE_PATH):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS conversations ("
+            " conversation_id TEXT PRIMARY KEY,"
+            " fields TEXT NOT NULL DEFAULT '{}')"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS messages ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " conversation_id TEXT NOT NULL,"
+            " sender TEXT NOT NULL,"
+            " message TEXT NOT NULL,"
+            " extra TEXT)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS messages_conversation ON messages (conversation_id, id)"
+        )
+        backfill = self._conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'system_digests'"
+        ).fetchone() is None
+        # Hashes de las respuestas del sistema: detección de duplicados sin leer los mensajes
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS system_digests ("
+            " conversation_id TEXT NOT NULL,"
+            " digest TEXT NOT NULL,"
+            " PRIMARY KEY (conversation_id, digest)) WITHOUT ROWID"
+        )
+        if backfill:
+            rows = self._conn.execute(
+                "SELECT conversation_id, message FROM messages WHERE sender = 'system'"
+            ).fetchall()
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO system_digests (conversation_id, digest) VALUES (?, ?)",
+                [(conversation_id, message_digest(message)) for conversation_id, message in rows]
+            )
+        self._conn.commit()
+
+    @contextmanager
+    def _transaction(self, immediate: bool = False):
+        """
+        Transacción que se confirma al terminar o se deshace ante cualquier error, para que un
+        fallo no deje la conexión del proceso dentro de una transacción abierta (con el bloqueo de
+        escritura de SQLite tomado frente a los demás workers).
+        """
+        with self._conn:
+            if immediate:
+                self._conn.execute("BEGIN IMMEDIATE")
+            yield
+
+    @staticmethod
+    def _message_row(conversation_id, message: dict):
+        extra = {key: value for key, value in message.items() if key not in ("sender", "message")}
+        return (conversation_id, message["sender"], message["message"], json.dumps(extra) if extra else None)
+
+    @staticmethod
+    def _message(sender, message, extra):
+        item = {"sender": sender, "message": message}
+        if extra:
+            item.update(json.loads(extra))
+        return item
+
+    def _read(self, conversation_id, fields):
+        rows = self._conn.execute(
+            "SELECT sender, message, extra FROM messages WHERE conversation_id = ? ORDER BY id",
+            (conversation_id,)
+        ).fetchall()
+        conversation = json.loads(fields)
+        conversation.update({
+            "conversation_id": conversation_id,
+            "messages": [self._message(*row) for row in rows],
+        })
+        return conversation
+
+    def get(self, conversation_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT fields FROM conversations WHERE conversation_id = ?", (conversation_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            return self._read(conversation_id, row[0])
+
+    def create(self, conversation_id):
+        with self._lock:
+            with self._transaction():
+                self._conn.execute(
+                    "INSERT OR IGNORE INTO conversations (conversation_id) VALUES (?)", (conversation_id,)
+                )
+        return {"conversation_id": conversation_id, "messages": []}
+
+    def append_message(self, conversation_id, message: dict, digest: str = None):
+        with self._lock:
+            with self._transaction():
+                self._conn.execute(
+                    "INSERT INTO messages (conversation_id, sender, message, extra) VALUES (?, ?, ?, ?)",
+                    self._message_row(conversation_id, message)
+                )
+                if digest is not None:
+                    self._conn.execute(
+                        "INSERT OR IGNORE INTO system_digests (conversation_id, digest) VALUES (?, ?)",
+                        (conversation_id, digest)
+                    )
+
+    def _merge_fields(self, conversation_id, fields: dict):
+        row = self._conn.execute(
+            "SELECT fields FROM conversations WHERE conversation_id = ?", (conversation_id,)
+        ).fetchone()
+        current = json.loads(row[0]) if row else {}
+        current.update(fields)
+        self._conn.execute(
+            "INSERT OR REPLACE INTO conversations (conversation_id, fields) VALUES (?, ?)",
+            (conversation_id, json.dumps(current, ensure_ascii=False))
+        )
+
+    def update_fields(self, conversation_id, fields: dict):
+        with self._lock:
+            with self._transaction(immediate=True):
+                # Lectura y escritura de los campos en la misma transacción (otros procesos esperan)
+                self._merge_fields(conversation_id, fields)
+
+    def put(self, conversation: dict):
+        conversation_id = conversation["conversation_id"]
+        fields = {
+            key: value for key, value in conversation.items()
+            if key not in ("conversation_id", "messages", "system_digests")
+        }
+        with self._lock:
+            with self._transaction():
+                self._conn.execute("DELETE FROM messages WHERE conversation_id = ?", (conversation_id,))
+                self._conn.execute("DELETE FROM system_digests WHERE conversation_id = ?", (conversation_id,))
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO system_digests (conversation_id, digest) VALUES (?, ?)",
+                    [(conversation_id, digest) for digest in conversation_digests(conversation)]
+                )
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO conversations (conversation_id, fields) VALUES (?, ?)",
+                    (conversation_id, json.dumps(fields, ensure_ascii=False))
+                )
+                self._conn.executemany(
+                    "INSERT INTO messages (conversation_id, sender, message, extra) VALUES (?, ?, ?, ?)",
+                    [self._message_row(conversation_id, message) for message in conversation.get("messages", [])]
+                )
+
+    def iter_conversations(self):
+        with self._lock:
+            rows = self._conn.execute("SELECT conversation_id, fields FROM conversations").fetchall()
+        for conversation_id, fields in rows:
+            with self._lock:
+                conversation = self._read(conversation_id, fields)
+            yield conversation
+
+    def exists(self, conversation_id) -> bool:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT 1 FROM conversations WHERE conversation_id = ?", (conversation_id,)
+            ).fetchone() is not None
+
+    def delete(self, conversation_id):
+        with self._lock:
+            with self._transaction(immediate=True):
+                self._conn.execute("DELETE FROM messages WHERE conversation_id = ?", (conversation_id,))
+                self._conn.execute("DELETE FROM system_digests WHERE conversation_id = ?", (conversation_id,))
+                self._conn.execute("DELETE FROM conversations WHERE conversation_id = ?", (conversation_id,))
+
+    def delete_many(self, conversation_ids):
+        rows = [(conversation_id,) for conversation_id in conversation_ids]
+        with self._lock:
+            with self._transaction(immediate=True):
+                self._conn.executemany("DELETE FROM messages WHERE conversation_id = ?", rows)
+                self._conn.executemany("DELETE FROM system_digests WHERE conversation_id = ?", rows)
+                self._conn.executemany("DELETE FROM conversations WHERE conversation_id = ?", rows)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def has_digest(self, conversation_id, digest: str) -> bool:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT 1 FROM system_digests WHERE conversation_id = ? AND digest = ?", (conversation_id, digest)
+            ).fetchone() is not None
+
+    def add_digest(self, conversation_id, digest: str):
+        with self._lock:
+            with self._transaction():
+                self._conn.execute(
+                    "INSERT OR IGNORE INTO system_digests (conversation_id, digest) VALUES (?, ?)", (conversation_id, digest)
+                )
+
+    def apply_batch(self, batch: dict):
+        # Todo el lote en una sola transacción
+        with self._lock:
+            with self._transaction(immediate=True):
+                for conversation_id, operations in batch.items():
+                    for operation, payload in operations:
+                        if operation == "create":
+                            self._conn.execute(
+                                "INSERT OR IGNORE INTO conversations (conversation_id) VALUES (?)", (conversation_id,)
+                            )
+                        elif operation == "message":
+                            self._conn.execute(
+                                "INSERT INTO messages (conversation_id, sender, message, extra) VALUES (?, ?, ?, ?)",
+                                self._message_row(conversation_id, payload)
+                            )
+                        elif operation == "fields":
+                            self._merge_fields(conversation_id, payload)
+                        elif operation == "digest":
+                            self._conn.execute(
+                                "INSERT OR IGNORE INTO system_digests (conversation_id, digest) VALUES (?, ?)",
+                                (conversation_id, payload)
+                            )
+
+
+def _jsonl_backend():
+    # Importación diferida: db.jsonl_backend depende de ConversationBackend
+    from db.jsonl_backend import JsonlBackend
+    return JsonlBackend()
+
+
+BACKENDS = {
+    "tinydb": TinyDBBackend,
+    "sqlite": SQLiteBackend,
+    "jsonl": _jsonl_backend,
+}
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+
+def get_backend(name: str = None) -> ConversationBackend:
+    """
+    Devuelve la instancia del motor indicado (por defecto CONVERSATION_BACKEND), una por proceso.
+    Con CONVERSATION_SHARDS > 1 las conversaciones del motor activo (CONVERSATION_BACKEND) se
+    reparten entre varios shards; los demás motores (p. ej. el origen o destino de una migración)
+    se abren sin shards.
+    """
+    name = name or CONVERSATION_BACKEND
+    if name not in BACKENDS:
+        raise ValueError(f"Motor de conversaciones no reconocido: '{name}'. Opciones: {', '.join(BACKENDS)}")
+    with _backends_lock:
+        if name not in _backends:
+            if CONVERSATION_SHARDS > 1 and name == CONVERSATION_BACKEND:
+                from db.sharding import open_sharded
+                _backends[name] = open_sharded(name, CONVERSATION_SHARDS)
+            else:
+                _backends[name] = BACKENDS[name]()
+        return _backends[name]
+
+
+def migrate_conversations(source: str = "tinydb", target: str = "sqlite") -> int:
+    """
+    Copia todas las conversaciones de un motor a otro (las existentes en el destino se reemplazan).
+
+    Returns:
+        int: Número de conversaciones migradas.
+    """
+    if source == target:
+        raise ValueError("El motor de origen y el de destino deben ser distintos.")
+    source_backend = get_backend(source)
+    target_backend = get_backend(target)
+    migrated = 0
+    for conversation in source_backend.iter_conversations():
+        target_backend.put(conversation)
+        migrated += 1
+    return migrated
@@ -0,0 +1,298 @@
+from db.backends import ConversationBackend, add_digest, conversation_digests
+from collections import OrderedDict
+from db.locking import lock_file, unlock_file
+from contextlib import contextmanager
+import hashlib
+import json
+import os
+import threading
+
+# Un segmento JSONL de solo anexado por conversación
+LOG_DIR = os.getenv("CONVERSATION_LOG_DIR", os.path.join("db", "conversation_log"))
+# Registros que no son mensajes (actualizaciones de campos) tolerados antes de compactar un segmento
+COMPACT_THRESHOLD = int(os.getenv("CONVERSATION_LOG_COMPACT_THRESHOLD", 50))
+# Conversaciones con el conjunto de hashes de respuestas del sistema en memoria
+DIGEST_CACHE_SIZE = int(os.getenv("CONVERSATION_LOG_DIGEST_CACHE_SIZE", 10000))
+
+
+class JsonlBackend(ConversationBackend):
+    """
+    Registro de solo anexado: cada conversación es un archivo JSONL con una operación por línea.
+
+        {"op": "create", "conversation_id": ...}
+        {"op": "message", "message": {...}}
+        {"op": "fields", "fields": {...}}
+        {"op": "digest", "digest": ...}
+        {"op": "snapshot", "conversation": {...}}
+
+    Agregar un mensaje escribe una sola línea al final del segmento, sin importar su tamaño, y leer
+    una conversación es una lectura secuencial de su archivo. La compactación reescribe el segmento
+    como una única instantánea para descartar las actualizaciones de campos acumuladas.
+    """
+
+    name = "jsonl"
+
+    def __init__(self, directory: str = LOG_DIR, compact_threshold: int = COMPACT_THRESHOLD):
+        self.directory = directory
+        self.compact_threshold = compact_threshold
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        # {ruta: (inodo, bytes leídos, hashes)}: cada comprobación solo lee lo anexado desde la anterior
+        self._digests = OrderedDict()
+        self._digests_lock = threading.Lock()
+
+    def _path(self, conversation_id) -> str:
+        # El nombre del archivo es un hash: los ids pueden contener cualquier carácter
+        digest = hashlib.sha256(str(conversation_id).encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, f"{digest}.jsonl")
+
+    @contextmanager
+    def _locked_segment(self, conversation_id):
+        """
+        Abre el segmento para anexar con un bloqueo exclusivo entre procesos.
+
+        Si mientras se esperaba el bloqueo otro proceso compactó el segmento (os.replace),
+        el archivo abierto ya no es el actual y se vuelve a abrir.
+        """
+        path = self._path(conversation_id)
+        with self._lock:
+            while True:
+                f = open(path, "a", encoding="utf-8")
+                try:
+                    lock_file(f)
+                except Exception:
+                    f.close()
+                    raise
+                try:
+                    current = os.stat(path).st_ino == os.fstat(f.fileno()).st_ino
+                except FileNotFoundError:
+                    current = False
+                if current:
+                    break
+                unlock_file(f)
+                f.close()
+            try:
+                f.seek(0, os.SEEK_END)
+                yield f
+            finally:
+                f.flush()
+                unlock_file(f)
+                f.close()
+
+    @staticmethod
+    def _repair_tail(path: str):
+        """
+        Una escritura interrumpida puede dejar la última línea sin '\n': el siguiente anexado se
+        pegaría a ella y _replay descartaría los dos registros. Si la línea está completa se
+        termina; si no, se recorta (nunca se confirmó). Se llama con el segmento bloqueado.
+        """
+        with open(path, "rb+") as f:
+            end = f.seek(0, os.SEEK_END)
+            if end == 0:
+                return
+            f.seek(end - 1)
+            if f.read(1) == b"\n":
+                return
+            # Inicio de la última línea
+            start = end
+            while start > 0:
+                chunk_start = max(0, start - 4096)
+                f.seek(chunk_start)
+                index = f.read(start - chunk_start).rfind(b"\n")
+                if index >= 0:
+                    start = chunk_start + index + 1
+                    break
+                start = chunk_start
+            f.seek(start)
+            try:
+                json.loads(f.read(end - start).decode("utf-8"))
+            except ValueError:
+                f.truncate(start)
+            else:
+                f.write(b"\n")
+            f.flush()
+
+    def _append(self, conversation_id, *records):
+        lines = "".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records)
+        with self._locked_segment(conversation_id) as f:
+            self._repair_tail(f.name)
+            f.write(lines)
+
+    @staticmethod
+    def _replay(path: str):
+        """
+        Reconstruye la conversación aplicando las operaciones del segmento en orden.
+
+        Returns:
+            tuple: (conversación o None, número de registros que no son mensajes)
+        """
+        with open(path, "r", encoding="utf-8") as f:
+            return JsonlBackend._replay_lines(f)
+
+    @staticmethod
+    def _replay_lines(lines):
+        conversation = None
+        overhead = 0
+        for line in lines:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # Línea incompleta por una escritura interrumpida
+                continue
+            op = record.get("op")
+            if op == "snapshot":
+                conversation = record["conversation"]
+                overhead = 0
+            elif op == "create":
+                if conversation is None:
+                    conversation = {"conversation_id": record["conversation_id"], "messages": []}
+            elif conversation is None:
+                continue
+            elif op == "message":
+                conversation["messages"].append(record["message"])
+            elif op == "fields":
+                conversation.update(record["fields"])
+                overhead += 1
+            elif op == "digest":
+                add_digest(conversation, record["digest"])
+        return conversation, overhead
+
+    def get(self, conversation_id):
+        path = self._path(conversation_id)
+        if not os.path.exists(path):
+            return None
+        conversation, overhead = self._replay(path)
+        if conversation is not None and overhead > self.compact_threshold:
+            self.compact(conversation_id)
+        return conversation
+
+    def create(self, conversation_id):
+        self._append(conversation_id, {"op": "create", "conversation_id": conversation_id})
+        return {"conversation_id": conversation_id, "messages": []}
+
+    def append_message(self, conversation_id, message: dict, digest: str = None):
+        records = [{"op": "digest", "digest": digest}] if digest is not None else []
+        self._append(conversation_id, *records, {"op": "message", "message": message})
+
+    def update_fields(self, conversation_id, fields: dict):
+        self._append(conversation_id, {"op": "fields", "fields": fields})
+
+    def exists(self, conversation_id) -> bool:
+        return os.path.exists(self._path(conversation_id))
+
+    def add_digest(self, conversation_id, digest: str):
+        self._append(conversation_id, {"op": "digest", "digest": digest})
+
+    def _write_snapshot(self, conversation: dict):
+        path = self._path(conversation["conversation_id"])
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            f.write(json.dumps({"op": "snapshot", "conversation": conversation}, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+
+    def put(self, conversation: dict):
+        with self._locked_segment(conversation["conversation_id"]):
+            self._write_snapshot(conversation)
+
+    def delete(self, conversation_id):
+        if os.path.exists(self._path(conversation_id)):
+            with self._locked_segment(conversation_id):
+                os.remove(self._path(conversation_id))
+        with self._digests_lock:
+            self._digests.pop(self._path(conversation_id), None)
+
+    def has_digest(self, conversation_id, digest: str) -> bool:
+        return digest in self._digest_set(conversation_id)
+
+    def _digest_set(self, conversation_id):
+        """
+        Hashes de las respuestas del sistema de la conversación, sin volver a leer el segmento.
+
+        La primera vez se reconstruyen con una lectura completa; después solo se leen los bytes
+        anexados desde la comprobación anterior (también por otros procesos) y de ellos solo se
+        interpretan los registros de hash, sin cargar los mensajes. Si el segmento se compactó
+        (otro inodo) o se reescribió, se vuelve a leer entero.
+        """
+        path = self._path(conversation_id)
+        with self._digests_lock:
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                self._digests.pop(path, None)
+                return {}
+            inode, offset, digests = self._digests.get(path, (None, 0, None))
+            if inode != stat.st_ino or stat.st_size < offset:
+                inode, offset, digests = stat.st_ino, 0, None
+            if digests is None or stat.st_size > offset:
+                with open(path, "rb") as f:
+                    f.seek(offset)
+                    data = f.read(stat.st_size - offset)
+                # Solo líneas completas: una escritura en curso se leerá en la siguiente comprobación
+                end = data.rfind(b"\n") + 1
+                lines = data[:end].decode("utf-8").splitlines()
+                if digests is None:
+                    conversation, _ = self._replay_lines(lines)
+                    digests = dict(conversation_digests(conversation)) if conversation else {}
+                else:
+                    for line in lines:
+                        if line.startswith('{"op": "digest"'):
+                            digests[json.loads(line)["digest"]] = True
+                        elif line.startswith('{"op": "snapshot"'):
+                            digests = dict(conversation_digests(json.loads(line)["conversation"]))
+                offset += end
+            self._digests[path] = (inode, offset, digests)
+            self._digests.move_to_end(path)
+            while len(self._digests) > DIGEST_CACHE_SIZE:
+                self._digests.popitem(last=False)
+            return digests
+
+    def compact(self, conversation_id) -> bool:
+        """
+        Reescribe el segmento de una conversación como una única instantánea.
+        """
+        path = self._path(conversation_id)
+        if not os.path.exists(path):
+            return False
+        with self._locked_segment(conversation_id):
+            # Se vuelve a leer bajo el bloqueo para no perder anexados concurrentes
+            conversation, _ = self._replay(path)
+            if conversation is None:
+                return False
+            self._write_snapshot(conversation)
+        return True
+
+    def compact_all(self) -> int:
+        """
+        Compacta todos los segmentos. Devuelve el número de conversaciones compactadas.
+        """
+        compacted = 0
+        for conversation in self.iter_conversations():
+            if self.compact(conversation["conversation_id"]):
+                compacted += 1
+        return compacted
+
+    def apply_batch(self, batch: dict):
+        # Las operaciones pendientes de cada conversación se anexan con una sola escritura
+        for conversation_id, operations in batch.items():
+            records = []
+            for operation, payload in operations:
+                if operation == "create":
+                    records.append({"op": "create", "conversation_id": conversation_id})
+                elif operation == "message":
+                    records.append({"op": "message", "message": payload})
+                elif operation == "fields":
+                    records.append({"op": "fields", "fields": payload})
+                elif operation == "digest":
+                    records.append({"op": "digest", "digest": payload})
+            if records:
+                self._append(conversation_id, *records)
+
+    def iter_conversations(self):
+        for name in sorted(os.listdir(self.directory)):
+            if not name.endswith(".jsonl"):
+                continue
+            conversation, _ = self._replay(os.path.join(self.directory, name))
+            if conversation is not None:
+                yield conversation
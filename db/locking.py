@@ -0,0 +1,156 @@
+from contextlib import contextmanager, ExitStack
+import hashlib
+import os
+import threading
+
+# Bloqueos entre procesos (archivos de bloqueo consultivos) para varios workers de Django
+LOCK_DIR = os.getenv("CONVERSATION_LOCK_DIR", os.path.join("db", "locks"))
+# Los archivos de bloqueo se reparten en franjas para no crear uno por conversación
+LOCK_STRIPES = int(os.getenv("CONVERSATION_LOCK_STRIPES", 256))
+CONVERSATION_PROCESS_LOCKS = os.getenv("CONVERSATION_PROCESS_LOCKS", "true").lower() == "true"
+
+if os.name == "nt":
+    import msvcrt
+
+    def lock_file(handle):
+        handle.seek(0)
+        while True:
+            try:
+                # LK_LOCK reintenta durante unos segundos y después lanza OSError
+                msvcrt.locking(handle.fileno(), msvcrt.LK_LOCK, 1)
+                return
+            except OSError:
+                continue
+
+    def unlock_file(handle):
+        handle.seek(0)
+        msvcrt.locking(handle.fileno(), msvcrt.LK_UNLCK, 1)
+else:
+    import fcntl
+
+    def lock_file(handle):
+        fcntl.flock(handle.fileno(), fcntl.LOCK_EX)
+
+    def unlock_file(handle):
+        fcntl.flock(handle.fileno(), fcntl.LOCK_UN)
+
+
+class FileLock:
+    """
+    Bloqueo exclusivo entre procesos sobre un archivo (fcntl.flock en POSIX, msvcrt en Windows).
+
+    Es reentrante para el hilo que lo posee y excluye también a los demás hilos del proceso.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._handle = None
+
+    def acquire(self):
+        self._lock.acquire()
+        if self._depth == 0:
+            try:
+                handle = open(self.path, "a+b")
+                lock_file(handle)
+            except Exception:
+                self._lock.release()
+                raise
+            self._handle = handle
+        self._depth += 1
+
+    def release(self):
+        self._depth -= 1
+        if self._depth == 0:
+            try:
+                unlock_file(self._handle)
+            finally:
+                self._handle.close()
+                self._handle = None
+        self._lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+def stable_hash(value) -> int:
+    # hash() cambia entre procesos; se usa un hash estable del identificador
+    return int.from_bytes(hashlib.sha1(str(value).encode("utf-8")).digest()[:8], "big")
+
+
+class ConversationLocks:
+    """
+    Bloqueo por conversación: un lock de hilos por conversación dentro del proceso y, entre
+    procesos, un archivo de bloqueo de la franja que le corresponde a la conversación.
+    """
+
+    def __init__(self, directory: str = LOCK_DIR, stripes: int = LOCK_STRIPES,
+                 across_processes: bool = CONVERSATION_PROCESS_LOCKS):
+        self.directory = directory
+        self.stripes = max(1, stripes)
+        self.across_processes = across_processes
+        if across_processes:
+            os.makedirs(directory, exist_ok=True)
+        self._guard = threading.Lock()
+        self._locks = {}
+        self._file_locks = {}
+
+    def _file_lock(self, conversation_id) -> FileLock:
+        stripe = stable_hash(conversation_id) % self.stripes
+        with self._guard:
+            if stripe not in self._file_locks:
+                self._file_locks[stripe] = FileLock(os.path.join(self.directory, f"conversations-{stripe}.lock"))
+            return self._file_locks[stripe]
+
+    @contextmanager
+    def hold(self, conversation_id):
+        """
+        Mantiene el bloqueo de la conversación durante el bloque `with`.
+        """
+        with self._guard:
+            entry = self._locks.setdefault(conversation_id, [threading.RLock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                if self.across_processes:
+                    with self._file_lock(conversation_id):
+                        yield
+                else:
+                    yield
+        finally:
+            with self._guard:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._locks[conversation_id]
+
+    @contextmanager
+    def hold_many(self, conversation_ids):
+        """
+        Mantiene el bloqueo de varias conversaciones. Se toman siempre en el mismo orden (franja
+        y conversación) para que dos procesos que bloquean lotes no se esperen mutuamente.
+        """
+        ordered = sorted(set(conversation_ids), key=lambda cid: (stable_hash(cid) % self.stripes, str(cid)))
+        with ExitStack() as stack:
+            for conversation_id in ordered:
+                stack.enter_context(self.hold(conversation_id))
+            yield
+
+
+_conversation_locks = None
+_conversation_locks_lock = threading.Lock()
+
+
+def get_conversation_locks() -> ConversationLocks:
+    """
+    Bloqueos de conversación compartidos por el proceso.
+    """
+    global _conversation_locks
+    with _conversation_locks_lock:
+        if _conversation_locks is None:
+            _conversation_locks = ConversationLocks()
+        return _conversation_locks
@@ -0,0 +1,270 @@
+from db.backends import ConversationBackend, BACKENDS, TinyDBBackend, SQLiteBackend, CONVERSATION_BACKEND
+from db.backends import TINYDB_PATH, SQLITE_PATH
+from db.locking import stable_hash
+import json
+import os
+import shutil
+import time
+
+# Carpeta de los shards: un archivo o base de datos por shard más el archivo de distribución
+SHARD_DIR = os.getenv("CONVERSATION_SHARD_DIR", os.path.join("db", "shards"))
+LAYOUT_FILE = "shards.json"
+
+
+def shard_backend(name: str, index: int, directory: str = SHARD_DIR) -> ConversationBackend:
+    """
+    Crea el motor de un shard dentro de la carpeta de shards.
+    """
+    os.makedirs(directory, exist_ok=True)
+    if name == "tinydb":
+        return TinyDBBackend(os.path.join(directory, f"conversations-{index}.json"))
+    if name == "sqlite":
+        return SQLiteBackend(os.path.join(directory, f"conversations-{index}.sqlite3"))
+    if name == "jsonl":
+        from db.jsonl_backend import JsonlBackend
+        return JsonlBackend(os.path.join(directory, f"log-{index}"))
+    raise ValueError(f"Motor de conversaciones no reconocido: '{name}'. Opciones: {', '.join(BACKENDS)}")
+
+
+def read_layout(directory: str = SHARD_DIR):
+    """
+    Distribución guardada en la carpeta ({"backend", "shards"}) o None si no hay shards.
+    """
+    path = os.path.join(directory, LAYOUT_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+class ShardedBackend(ConversationBackend):
+    """
+    Reparte las conversaciones entre N shards del mismo motor según un hash estable de
+    conversation_id. Cada escritura solo toca el archivo de su shard, y las conversaciones de
+    shards distintos se escriben en paralelo sin competir por el mismo archivo ni bloqueo.
+
+    El número de shards queda registrado en la carpeta: cambiarlo requiere redistribuir los
+    datos con `python commands.py reshard_conversations N`.
+    """
+
+    def __init__(self, base: str = CONVERSATION_BACKEND, shards: int = 2, directory: str = SHARD_DIR):
+        if shards < 1:
+            raise ValueError("El número de shards debe ser al menos 1.")
+        self.name = base
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        layout = read_layout(directory)
+        if layout is None:
+            self._write_layout({"backend": base, "shards": shards})
+        elif layout != {"backend": base, "shards": shards}:
+            raise ValueError(
+                f"La carpeta '{directory}' contiene {layout['shards']} shards del motor '{layout['backend']}'. "
+                f"Ejecuta 'python commands.py reshard_conversations {shards}' para redistribuir las conversaciones."
+            )
+        self.shards = [shard_backend(base, index, directory) for index in range(shards)]
+
+    def _write_layout(self, layout: dict):
+        path = os.path.join(self.directory, LAYOUT_FILE)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(layout, f)
+        os.replace(temp_path, path)
+
+    def shard_index(self, conversation_id) -> int:
+        return stable_hash(conversation_id) % len(self.shards)
+
+    def shard_for(self, conversation_id) -> ConversationBackend:
+        return self.shards[self.shard_index(conversation_id)]
+
+    def get(self, conversation_id):
+        return self.shard_for(conversation_id).get(conversation_id)
+
+    def create(self, conversation_id):
+        return self.shard_for(conversation_id).create(conversation_id)
+
+    def append_message(self, conversation_id, message: dict, digest: str = None):
+        self.shard_for(conversation_id).append_message(conversation_id, message, digest)
+
+    def update_fields(self, conversation_id, fields: dict):
+        self.shard_for(conversation_id).update_fields(conversation_id, fields)
+
+    def put(self, conversation: dict):
+        self.shard_for(conversation["conversation_id"]).put(conversation)
+
+    def exists(self, conversation_id) -> bool:
+        return self.shard_for(conversation_id).exists(conversation_id)
+
+    def delete(self, conversation_id):
+        self.shard_for(conversation_id).delete(conversation_id)
+
+    def delete_many(self, conversation_ids):
+        shards = {}
+        for conversation_id in conversation_ids:
+            shards.setdefault(self.shard_index(conversation_id), []).append(conversation_id)
+        for index, shard_ids in sorted(shards.items()):
+            self.shards[index].delete_many(shard_ids)
+
+    def has_digest(self, conversation_id, digest: str) -> bool:
+        return self.shard_for(conversation_id).has_digest(conversation_id, digest)
+
+    def add_digest(self, conversation_id, digest: str):
+        self.shard_for(conversation_id).add_digest(conversation_id, digest)
+
+    def apply_batch(self, batch: dict):
+        # Un lote por shard: cada shard conserva su escritura agrupada
+        batches = {}
+        for conversation_id, operations in batch.items():
+            batches.setdefault(self.shard_index(conversation_id), {})[conversation_id] = operations
+        for index, shard_batch in sorted(batches.items()):
+            self.shards[index].apply_batch(shard_batch)
+
+    def iter_conversations(self):
+        for shard in self.shards:
+            yield from shard.iter_conversations()
+
+    def compact_all(self) -> int:
+        return sum(shard.compact_all() for shard in self.shards if hasattr(shard, "compact_all"))
+
+    def close(self):
+        for shard in self.shards:
+            shard.close()
+
+
+def unsharded_store(name: str) -> str:
+    """
+    Ruta del almacenamiento sin shards del motor (archivo o carpeta).
+    """
+    if name == "jsonl":
+        from db.jsonl_backend import LOG_DIR
+        return LOG_DIR
+    return {"tinydb": TINYDB_PATH, "sqlite": SQLITE_PATH}[name]
+
+
+def open_store(name: str, path: str) -> ConversationBackend:
+    """
+    Abre un almacenamiento sin shards del motor en la ruta indicada.
+    """
+    if name == "tinydb":
+        return TinyDBBackend(path)
+    if name == "sqlite":
+        return SQLiteBackend(path)
+    from db.jsonl_backend import JsonlBackend
+    return JsonlBackend(path)
+
+
+def has_conversations(name: str, path: str) -> bool:
+    """
+    Indica si el almacenamiento sin shards de la ruta contiene alguna conversación (sin crearlo).
+    """
+    if not os.path.exists(path):
+        return False
+    store = open_store(name, path)
+    try:
+        return next(iter(store.iter_conversations()), None) is not None
+    finally:
+        store.close()
+
+
+def open_sharded(name: str, shards: int, directory: str = SHARD_DIR) -> ShardedBackend:
+    """
+    Abre los shards del motor activo. La primera vez (sin distribución guardada) se niega a
+    empezar con shards vacíos si el almacenamiento sin shards ya tiene conversaciones: dejarían
+    de verse hasta redistribuirlas.
+    """
+    if read_layout(directory) is None and has_conversations(name, unsharded_store(name)):
+        raise ValueError(
+            f"El almacenamiento sin shards '{unsharded_store(name)}' contiene conversaciones. Ejecuta "
+            f"'python commands.py reshard_conversations {shards}' antes de definir CONVERSATION_SHARDS={shards}."
+        )
+    return ShardedBackend(name, shards, directory)
+
+
+def _move_aside(path: str):
+    """
+    Conserva el almacenamiento actual como '<ruta>.old-<fecha>' (con los archivos -wal/-shm de SQLite).
+    """
+    stamp = time.strftime('%Y%m%d-%H%M%S')
+    backup = f"{path}.old-{stamp}"
+    suffix = 1
+    while os.path.exists(backup):
+        backup = f"{path}.old-{stamp}-{suffix}"
+        suffix += 1
+    os.replace(path, backup)
+    for extension in ("-wal", "-shm"):
+        if os.path.exists(path + extension):
+            os.replace(path + extension, backup + extension)
+
+
+def _discard(path: str):
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.exists(path):
+        os.remove(path)
+    for extension in ("-wal", "-shm"):
+        if os.path.exists(path + extension):
+            os.remove(path + extension)
+
+
+def reshard_conversations(shards: int, base: str = CONVERSATION_BACKEND, directory: str = SHARD_DIR) -> int:
+    """
+    Redistribuye las conversaciones en `shards` shards del motor `base` (sin conexión: el
+    servidor debe estar detenido).
+
+    Los datos se copian a una ubicación temporal ('<destino>.new') y solo al terminar reemplazan
+    al destino, que se conserva como '<destino>.old-<fecha>'. Si la carpeta aún no tiene shards,
+    el origen es el almacenamiento sin shards del motor; con `shards=1` el destino es ese
+    almacenamiento y la carpeta de shards también se conserva como copia. Si el almacenamiento
+    sin shards todavía tiene conversaciones junto a una carpeta de shards, se reparten también
+    (aunque el número de shards no cambie). Una vez repartido, el almacenamiento sin shards se
+    conserva como copia.
+
+    Returns:
+        int: Número de conversaciones copiadas.
+    """
+    if base not in BACKENDS:
+        raise ValueError(f"Motor de conversaciones no reconocido: '{base}'. Opciones: {', '.join(BACKENDS)}")
+    if shards < 1:
+        raise ValueError("El número de shards debe ser al menos 1.")
+
+    layout = read_layout(directory)
+    unsharded = unsharded_store(base)
+    # Datos sin shards pendientes de repartir (p. ej. si se activaron los shards sin redistribuir)
+    pending = layout is not None and shards > 1 and has_conversations(base, unsharded)
+    if layout == ({"backend": base, "shards": shards} if shards > 1 else None) and not pending:
+        # La distribución ya es la pedida
+        return 0
+    # Primero el almacenamiento sin shards: si una conversación está en ambos, gana la de los shards
+    sources = []
+    if layout is None or pending:
+        sources.append(open_store(base, unsharded))
+    if layout is not None:
+        sources.append(ShardedBackend(layout["backend"], layout["shards"], directory))
+
+    destination = directory if shards > 1 else unsharded
+    staging = f"{destination}.new"
+    _discard(staging)
+    target = ShardedBackend(base, shards, staging) if shards > 1 else open_store(base, staging)
+
+    copied = set()
+    try:
+        for source in sources:
+            for conversation in source.iter_conversations():
+                target.put(conversation)
+                copied.add(conversation["conversation_id"])
+    finally:
+        for source in sources:
+            source.close()
+        target.close()
+
+    if os.path.exists(destination):
+        _move_aside(destination)
+    os.replace(staging, destination)
+    if os.path.exists(f"{staging}.lock"):
+        # Archivo de bloqueo de TinyDB de la copia temporal
+        os.remove(f"{staging}.lock")
+    if shards > 1 and (layout is None or pending) and os.path.exists(unsharded):
+        # Ya está repartido en los shards: no debe volver a copiarse en la siguiente redistribución
+        _move_aside(unsharded)
+    if shards == 1 and os.path.exists(directory):
+        _move_aside(directory)
+    return len(copied)
@@ -1,44 +1,345 @@
-from tinydb import TinyDB, Query
+from db.archive import get_archive
+from db.backends import get_backend, apply_operations, message_digest, TINYDB_PATH
+from db.locking import get_conversation_locks
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+import atexit
+import logging
 import os
+import threading
+import time
+import tiktoken
+
+# Configurar logging
+logger = logging.getLogger('conversations')
+logger.setLevel(logging.INFO)
+
+# Configurar el archivo de base de datos (motor TinyDB; ver CONVERSATION_BACKEND en db/backends.py)
+DB_PATH = TINYDB_PATH
+
+# Memoria de la conversación: 'full' (todo el historial) o 'summary' (resumen + últimos turnos)
+CONVERSATION_MEMORY_MODE = os.getenv("CONVERSATION_MEMORY_MODE", "full")
+CONVERSATION_RECENT_TURNS = int(os.getenv("CONVERSATION_RECENT_TURNS", 4))
+CONVERSATION_TOKEN_BUDGET = int(os.getenv("CONVERSATION_TOKEN_BUDGET", 2000))
+
+# Escritura diferida: los mensajes se guardan en segundo plano, agrupados en un solo flush
+CONVERSATION_WRITE_BEHIND = os.getenv("CONVERSATION_WRITE_BEHIND", "false").lower() == "true"
+CONVERSATION_FLUSH_DELAY = float(os.getenv("CONVERSATION_FLUSH_DELAY", 0.05))
+# Intentos de escritura de una conversación antes de descartar sus operaciones pendientes
+CONVERSATION_FLUSH_RETRIES = int(os.getenv("CONVERSATION_FLUSH_RETRIES", 5))
+
+@lru_cache(maxsize=1)
+def _encoding():
+    # Se carga solo en el modo 'summary' (la primera vez puede descargar el vocabulario)
+    return tiktoken.get_encoding("cl100k_base")
+
+
+def count_tokens(text: str) -> int:
+    return len(_encoding().encode(text, disallowed_special=()))
+
+
+def format_messages(messages) -> str:
+    return "\n".join([f"{msg['sender']}: {msg['message']}" for msg in messages])
+
+
+class WriteBehindWriter:
+    """
+    Escritor diferido con un único hilo en segundo plano por motor de almacenamiento.
+
+    Las operaciones se encolan por conversación y el hilo las aplica en lotes: todo lo acumulado
+    durante `delay` segundos se escribe con una sola llamada a apply_batch (en TinyDB, una sola
+    reescritura del archivo). Las lecturas combinan el motor con las operaciones pendientes, de
+    modo que cada conversación ve sus propias escrituras. Al cerrar el proceso se vacía la cola.
+    """
+
+    def __init__(self, backend, delay: float = CONVERSATION_FLUSH_DELAY, retries: int = CONVERSATION_FLUSH_RETRIES):
+        self.backend = backend
+        self.delay = delay
+        self.retries = max(1, retries)
+        self._pending = {}
+        self._failures = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        # Impar mientras un lote se está escribiendo (las lecturas esperan y reintentan)
+        self._generation = 0
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name=f"conversation-writer-{backend.name}", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def enqueue(self, conversation_id, operation: str, payload=None):
+        with self._lock:
+            if not self._closed:
+                self._pending.setdefault(conversation_id, []).append((operation, payload))
+                self._wake.set()
+                return
+        # Después del cierre se escribe directamente
+        self.backend.apply_batch({conversation_id: [(operation, payload)]})
+
+    def read(self, conversation_id, load=None, combine=apply_operations):
+        """
+        Lectura del motor combinada con las operaciones pendientes de la conversación.
+
+        Por defecto devuelve la conversación con las operaciones aplicadas (None si no existe);
+        `load(conversation_id)` y `combine(valor, operaciones, conversation_id)` permiten
+        consultas más ligeras (existencia, hashes) con la misma consistencia.
+        """
+        load = load or self.backend.get
+        while True:
+            with self._lock:
+                generation = self._generation
+                operations = list(self._pending.get(conversation_id, []))
+            if generation % 2:
+                # Hay un lote escribiéndose: se espera a que termine
+                with self._flush_lock:
+                    continue
+            value = load(conversation_id)
+            with self._lock:
+                if self._generation == generation:
+                    return combine(value, operations, conversation_id)
+
+    def flush(self) -> int:
+        """
+        Escribe todas las operaciones pendientes. Devuelve el número de conversaciones escritas.
+        """
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+                if not batch:
+                    return 0
+                self._generation += 1
+            try:
+                self.backend.apply_batch(batch)
+                failed = {}
+            except Exception:
+                # Se reintenta conversación por conversación para aislar la que falla
+                failed = self._apply_each(batch)
+            finally:
+                with self._lock:
+                    self._generation += 1
+            self._failures = {conversation_id: self._failures[conversation_id]
+                              for conversation_id in failed if conversation_id in self._failures}
+            if failed:
+                raise next(iter(failed.values()))
+            return len(batch)
+
+    def _apply_each(self, batch: dict) -> dict:
+        """
+        Escribe cada conversación por separado. Las que fallan vuelven a la cola, delante de las
+        operaciones más recientes, hasta agotar `retries` intentos; después se descartan.
+
+        Returns:
+            dict: {conversation_id: excepción} de las conversaciones que no se pudieron escribir.
+        """
+        failed = {}
+        for conversation_id, operations in batch.items():
+            try:
+                self.backend.apply_batch({conversation_id: operations})
+                continue
+            except Exception as e:
+                failed[conversation_id] = e
+            attempts = self._failures.get(conversation_id, 0) + 1
+            if attempts >= self.retries:
+                logger.error(
+                    f"Se descartan {len(operations)} operaciones pendientes de la conversación "
+                    f"{conversation_id} tras {attempts} intentos: {str(failed[conversation_id])}"
+                )
+                self._failures.pop(conversation_id, None)
+                continue
+            self._failures[conversation_id] = attempts
+            with self._lock:
+                self._pending[conversation_id] = operations + self._pending.get(conversation_id, [])
+        return failed
+
+    def _run(self):
+        while not self._closed:
+            self._wake.wait()
+            self._wake.clear()
+            # Breve espera para agrupar las escrituras que llegan casi a la vez
+            time.sleep(self.delay)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Error al guardar conversaciones en segundo plano: {str(e)}")
+                time.sleep(1)
+                self._wake.set()
+
+    def close(self):
+        """
+        Detiene el hilo y escribe lo pendiente (registrado con atexit).
+        """
+        with self._lock:
+            self._closed = True
+        self._wake.set()
+        self._thread.join(timeout=10)
+        self.flush()
+
+
+_writers = {}
+_writers_lock = threading.Lock()
+
+
+def get_writer(backend) -> WriteBehindWriter:
+    """
+    Escritor diferido del motor, uno por proceso.
+    """
+    with _writers_lock:
+        if backend.name not in _writers:
+            _writers[backend.name] = WriteBehindWriter(backend)
+        return _writers[backend.name]
+
+
+def flush_writers():
+    """
+    Vacía las escrituras diferidas pendientes de todos los motores del proceso.
+    """
+    with _writers_lock:
+        writers = list(_writers.values())
+    for writer in writers:
+        writer.flush()
+
+
+_summaries = None
+_summaries_lock = threading.Lock()
+_scheduled_summaries = set()
+
+
+def _summary_executor() -> ThreadPoolExecutor:
+    """
+    Hilo del proceso que actualiza los resúmenes de las conversaciones.
+    """
+    global _summaries
+    with _summaries_lock:
+        if _summaries is None:
+            _summaries = ThreadPoolExecutor(max_workers=1, thread_name_prefix="conversation-summary")
+        return _summaries
 
-# Configurar el archivo de base de datos
-DB_PATH = os.path.join("db", "conversations.json")
-db = TinyDB(DB_PATH)
 
 class ConversationManager:
-    def __init__(self):
-        self.db = db
-        self.query = Query()
+    def __init__(self, summarizer=None, memory_mode: str = CONVERSATION_MEMORY_MODE,
+                 recent_turns: int = CONVERSATION_RECENT_TURNS, token_budget: int = CONVERSATION_TOKEN_BUDGET,
+                 backend=None, write_behind: bool = CONVERSATION_WRITE_BEHIND, locks=None, archive=None):
+        """
+        Args:
+            summarizer (callable): summarizer(resumen_anterior, mensajes_nuevos) -> resumen actualizado.
+                Necesario en el modo 'summary' para conservar el contenido de los turnos antiguos.
+            backend (ConversationBackend): Motor de almacenamiento (por defecto CONVERSATION_BACKEND).
+            write_behind (bool): Guardar en segundo plano en lugar de esperar a la escritura en disco.
+            locks (ConversationLocks): Bloqueos por conversación (por defecto, los del proceso).
+            archive (ConversationArchive): Archivo de conversaciones frías que se recuperan al usarse.
+        """
+        self.backend = backend or get_backend()
+        self.locks = locks or get_conversation_locks()
+        self.archive = archive or get_archive()
+        self.writer = get_writer(self.backend) if write_behind else None
+        self.summarizer = summarizer
+        self.memory_mode = memory_mode
+        self.recent_turns = recent_turns
+        self.token_budget = token_budget
+        if memory_mode == "summary" and summarizer is None:
+            logger.warning(
+                "CONVERSATION_MEMORY_MODE=summary sin summarizer: los turnos que salen de la ventana "
+                "reciente se omiten del historial en lugar de resumirse"
+            )
+
+    def _write(self, conversation_id, operation: str, payload=None, digest: str = None):
+        if self.writer is not None:
+            if digest is not None:
+                self.writer.enqueue(conversation_id, "digest", digest)
+            self.writer.enqueue(conversation_id, operation, payload)
+        elif operation == "create":
+            self.backend.create(conversation_id)
+        elif operation == "message":
+            # El hash de una respuesta del sistema se guarda en la misma escritura que el mensaje
+            self.backend.append_message(conversation_id, payload, digest)
+        elif operation == "fields":
+            self.backend.update_fields(conversation_id, payload)
+        elif operation == "digest":
+            self.backend.add_digest(conversation_id, payload)
 
+    def _exists(self, conversation_id) -> bool:
+        if self.writer is None:
+            return self.backend.exists(conversation_id)
+        return self.writer.read(
+            conversation_id, self.backend.exists,
+            lambda stored, operations, _: stored or any(operation == "create" for operation, _ in operations)
+        )
+
+    def _has_digest(self, conversation_id, digest: str) -> bool:
+        if self.writer is None:
+            return self.backend.has_digest(conversation_id, digest)
+        return self.writer.read(
+            conversation_id, lambda cid: self.backend.has_digest(cid, digest),
+            lambda stored, operations, _: stored or ("digest", digest) in operations
+        )
+
+    def _restore(self, conversation_id):
+        """
+        Devuelve una conversación archivada al almacenamiento principal (con la conversación bloqueada).
+        """
+        conversation = self.archive.get(conversation_id)
+        if conversation is None:
+            return None
+        self.backend.put(conversation)
+        self.archive.remove(conversation_id)
+        logger.info(f"Conversación {conversation_id} recuperada del archivo")
+        return conversation
+
+    def flush(self):
+        """
+        Espera a que las escrituras diferidas pendientes lleguen al disco.
+        """
+        if self.writer is not None:
+            self.writer.flush()
 
     def add_message(self, conversation_id, sender, message):
         """
         Agrega un mensaje a una conversación específica.
         Las respuestas del sistema no incluirán duplicados.
+
+        La comprobación y la escritura se hacen con la conversación bloqueada, también frente a
+        otros procesos (salvo con escritura diferida, donde la deduplicación es por proceso).
         """
-        conversation = self.get_conversation(conversation_id)
+        with self.locks.hold(conversation_id):
+            if not self._exists(conversation_id) and self._restore(conversation_id) is None:
+                self._write(conversation_id, "create")
 
-        if sender == "system":
-            # No agregar respuestas duplicadas del sistema
-            existing_responses = [msg["message"] for msg in conversation["messages"] if msg["sender"] == "system"]
-            if message in existing_responses:
-                return
+            digest = None
+            if sender == "system":
+                # No agregar respuestas duplicadas del sistema: se consulta el conjunto de hashes
+                # de la conversación en lugar de comparar con cada respuesta anterior
+                digest = message_digest(message)
+                if self._has_digest(conversation_id, digest):
+                    return
 
-        conversation["messages"].append({"sender": sender, "message": message})
-        self.db.update(conversation, self.query.conversation_id == conversation_id)
+            # La fecha del mensaje permite aplicar la política de retención (db/archive.py)
+            self._write(
+                conversation_id, "message", {"sender": sender, "message": message, "timestamp": time.time()}, digest
+            )
+
+    def _read(self, conversation_id):
+        if self.writer is not None:
+            # Incluye las escrituras de la conversación que aún no llegaron al disco
+            return self.writer.read(conversation_id)
+        return self.backend.get(conversation_id)
 
     def get_conversation(self, conversation_id):
         """
         Recupera una conversación completa por su ID, sin formatear.
+        Las conversaciones archivadas se recuperan del archivo de forma transparente.
         """
-        conversation = self.db.search(self.query.conversation_id == conversation_id)
+        conversation = self._read(conversation_id)
+        if conversation:
+            return conversation
+        with self.locks.hold(conversation_id):
+            conversation = self._read(conversation_id) or self._restore(conversation_id)
         if conversation:
-            return conversation[0]  
+            return conversation
         else:
             # Si no existe, crear una nueva conversación
-            new_conversation = {"conversation_id": conversation_id, "messages": []}
-            self.db.insert(new_conversation)
-            return new_conversation
+            self._write(conversation_id, "create")
+            return {"conversation_id": conversation_id, "messages": []}
 
     def get_formatted_conversation(self, conversation_id):
         """
@@ -50,5 +351,89 @@ class ConversationManager:
         if not conversation or "messages" not in conversation:
             return "Sin historial previo."
 
+        if self.memory_mode == "summary":
+            return self._summarized_history(conversation)
+
         # Formatear el historial de mensajes
-        return "\n".join([f"{msg['sender']}: {msg['message']}" for msg in conversation["messages"]])
\ No newline at end of file
+        return format_messages(conversation["messages"])
+
+    def _window(self, conversation):
+        """
+        Resumen guardado y comienzo de la ventana literal: últimos N turnos (usuario + sistema),
+        recortada si excede el presupuesto de tokens.
+        """
+        messages = conversation["messages"]
+        summary = conversation.get("summary", "")
+        summarized_count = conversation.get("summarized_count", 0)
+
+        start = max(summarized_count, len(messages) - 2 * self.recent_turns)
+        budget = self.token_budget - count_tokens(summary)
+        window_tokens = [count_tokens(format_messages([msg])) for msg in messages[start:]]
+        while len(window_tokens) > 1 and sum(window_tokens) > budget:
+            window_tokens.pop(0)
+            start += 1
+        return summary, summarized_count, start
+
+    def _summarized_history(self, conversation):
+        """
+        Resumen de los turnos antiguos más los últimos turnos literales, dentro del presupuesto de tokens.
+
+        Solo lee el resumen guardado: no llama al LLM. El resumen se actualiza después de cada
+        respuesta (schedule_summary), así que los mensajes que acaban de salir de la ventana
+        reciente se incorporan al resumen antes de la siguiente solicitud.
+        """
+        summary, _, start = self._window(conversation)
+        recent = format_messages(conversation["messages"][start:])
+        if summary:
+            return f"Resumen de la conversación anterior:\n{summary}\n\nMensajes recientes:\n{recent}"
+        return recent
+
+    def update_summary(self, conversation_id) -> bool:
+        """
+        Incorpora al resumen los mensajes que salieron de la ventana reciente.
+
+        El resumen se guarda con la conversación junto con el número de mensajes que ya incluye
+        ('summarized_count'). La llamada al LLM se hace sin bloquear la conversación; si otro
+        proceso actualizó el resumen mientras tanto, se descarta el nuevo.
+
+        Returns:
+            bool: True si se guardó un resumen nuevo.
+        """
+        if self.memory_mode != "summary" or self.summarizer is None:
+            return False
+        conversation = self._read(conversation_id)
+        if not conversation or "messages" not in conversation:
+            return False
+        summary, summarized_count, start = self._window(conversation)
+        pending = conversation["messages"][summarized_count:start]
+        if not pending:
+            return False
+
+        summary = self.summarizer(summary, format_messages(pending))
+        with self.locks.hold(conversation_id):
+            current = self._read(conversation_id) or {}
+            if current.get("summarized_count", 0) != summarized_count:
+                return False
+            self._write(conversation_id, "fields", {"summary": summary, "summarized_count": start})
+        return True
+
+    def schedule_summary(self, conversation_id):
+        """
+        Actualiza el resumen en segundo plano, fuera del camino de la solicitud. Las peticiones
+        repetidas de una conversación que ya está en cola se ignoran.
+        """
+        if self.memory_mode != "summary" or self.summarizer is None:
+            return
+        with _summaries_lock:
+            if conversation_id in _scheduled_summaries:
+                return
+            _scheduled_summaries.add(conversation_id)
+        _summary_executor().submit(self._run_summary, conversation_id)
+
+    def _run_summary(self, conversation_id):
+        with _summaries_lock:
+            _scheduled_summaries.discard(conversation_id)
+        try:
+            self.update_summary(conversation_id)
+        except Exception as e:
+            logger.error(f"Error al resumir la conversación {conversation_id}: {str(e)}")